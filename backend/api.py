@@ -1,13 +1,49 @@
-from typing import List, Optional, Dict, Tuple
+from typing import Callable, Collection, Hashable, Iterable, Iterator, List, Optional, Dict, Tuple
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, HTTPException, Query
-from pydantic import BaseModel, Field
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, TypeAdapter
+from typing_extensions import Annotated, TypedDict
 from datetime import datetime
+import hashlib
+import heapq
+import hmac
+import logging
 import math
+import os
 import random
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from operator import itemgetter
+
+from batch_scoring import BatchScorer, EventColumns, take_rows
+from bulk_ingest import BulkFormatError, records_from_stream, validate_chunk
+from catalog import (DEFAULT_CATALOG_PATH, CatalogFormatError, ChallengeItemModel, ChallengeModel,
+                     load_catalog)
+from catalog_search import CatalogSearchIndex
+from challenge_cache import ChallengeCache
+from copurchase import CoPurchaseIndex
+from event_log import (SNAPSHOT_NAME, EventLog, Row, capture_snapshot, encode_rows, load_snapshot,
+                       save_snapshot)
+from event_store import MAX_PRICE, MAX_QUANTITY, EventStore, epoch_timestamp
+from factorization import FactorModel
+from fast_json import fast_response
+from metrics import MetricsMiddleware, Registry
+from popularity_heads import PopularityHeads
+from ingest_server import IngestClient
+from response_cache import EncodedResponseCache, etag_matches
+from shared_state import SharedState, SharedStateFull, check_id
+from stage_timing import STAGE_BUCKETS, StageTimingMiddleware, stage
+from store_layout import StoreLayout
+from striped_lock import StripedLock
+from windowed_popularity import WindowedPopularity
 
 PROMO_DEFAULT = 0
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI(title="Coupon Hunt API")
 app.add_middleware(
     CORSMiddleware,
@@ -16,6 +52,21 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# per-route request counts and latencies at /metrics; METRICS=0 turns the middleware off
+METRICS = Registry()
+if os.getenv("METRICS", "1").lower() not in ("0", "false", "no", "off"):
+    app.add_middleware(MetricsMiddleware, registry=METRICS)
+# per-stage timings of the recommender for this share of requests (0 = off, the default);
+# STAGE_TIMING_HEADER=1 also returns them to the client as a Server-Timing header
+STAGE_TIMING_SAMPLE_RATE = float(os.getenv("STAGE_TIMING_SAMPLE_RATE", "0"))
+if STAGE_TIMING_SAMPLE_RATE > 0:
+    app.add_middleware(
+        StageTimingMiddleware,
+        histogram=METRICS.histogram("challenge_stage_seconds", "Time spent in each stage of item selection.",
+                                    ("stage",), buckets=STAGE_BUCKETS),
+        sample_rate=STAGE_TIMING_SAMPLE_RATE,
+        header=os.getenv("STAGE_TIMING_HEADER", "").lower() in ("1", "true", "yes", "on"),
+    )
 class CartItem(BaseModel):
     id: str
     name: str
@@ -24,154 +75,451 @@ class CartItem(BaseModel):
     points: int
     price: float
     isPromo: Optional[bool] = None
-class ChallengeItemModel(BaseModel):
-    id: str
-    name: str
-    category: str
-    location: str
-    points: int
-    price: float
-    isPromo: Optional[bool] = None
-    barcode: Optional[str] = None
-    scanned: Optional[bool] = None
-
-class ChallengeModel(BaseModel):
-    id: str
-    title: str
-    description: str
-    points: int
-    timeRemaining: str
-    color: str
-    items: List[ChallengeItemModel]
-    currentPoints: Optional[int] = None
-    completed: Optional[bool] = None
 
+# the catalog lives in a file (see catalog.py); POST /admin/catalog/reload or SIGHUP re-reads it
+CATALOG_PATH = os.getenv("CATALOG_PATH", DEFAULT_CATALOG_PATH)
 CATALOG: Dict[str, ChallengeItemModel] = {}
+food_items: List[ChallengeModel] = []  # the static challenges from the catalog file
+
+# items kept per category in each popularity head (see popularity_heads.py)
+POPULARITY_HEAD_SIZE = int(os.getenv("POPULARITY_HEAD_SIZE", "32"))
+
+class CatalogIndex:
+    """Regular/promo candidate pools per category and per template, built once per catalog load.
+
+    Each category gets one bit; a set of allowed categories becomes a mask, and the pools
+    for a mask are computed once (templates eagerly, ad-hoc category lists on first use).
+    The index keeps its own snapshot of the catalog (and of the static challenges loaded with
+    it) so readers never see a half-loaded one, and the categories' popularity heads.
+    """
+
+    def __init__(self, catalog: Dict[str, ChallengeItemModel],
+                 templates: Optional[Dict[str, "ChallengeTemplate"]] = None, version: int = 0,
+                 challenges: Optional[List[ChallengeModel]] = None):
+        self.catalog = catalog
+        self.version = version
+        self.challenges = challenges if challenges is not None else []
+        self.category_bits: Dict[str, int] = {}
+        self.item_bits: Dict[str, int] = {}
+        by_category: Dict[str, Dict[str, ChallengeItemModel]] = {}
+        for iid, it in catalog.items():
+            if it.category not in self.category_bits:
+                self.category_bits[it.category] = 1 << len(self.category_bits)
+                by_category[it.category] = {}
+            self.item_bits[iid] = self.category_bits[it.category]
+            by_category[it.category][iid] = it
+        self.all_mask = (1 << len(self.category_bits)) - 1
+        self.positions = {iid: pos for pos, iid in enumerate(catalog)}
+        self._pools: Dict[int, Tuple[List[str], List[str]]] = {}
+        # single-category pools come from one pass above rather than one catalog scan per category
+        self.by_category = {}
+        for cat, bit in self.category_bits.items():
+            self._pools[bit] = self.by_category[cat] = split_candidates(by_category[cat])
+        self.by_template = {tid: self.candidates(tpl.allowed_categories)
+                            for tid, tpl in (templates or {}).items()}
+        self._search: Optional[CatalogSearchIndex] = None
+        self._layout: Optional[StoreLayout] = None
+        self.heads: Dict[Tuple[Hashable, bool], PopularityHeads] = {}  # (popularity source, promo) -> heads
+        self._lazy_lock = threading.Lock()
+
+    def mask_for(self, allowed_categories: Optional[List[str]]) -> int:
+        if allowed_categories is None:
+            return self.all_mask
+        mask = 0
+        for cat in allowed_categories:
+            mask |= self.category_bits.get(cat, 0)
+        return mask
+
+    def _pools_for_mask(self, mask: int) -> Tuple[List[str], List[str]]:
+        pools = self._pools.get(mask)
+        if pools is None:
+            # one pass in catalog order so ties rank exactly like a full scan would
+            pools = split_candidates({iid: self.catalog[iid]
+                                      for iid, bit in self.item_bits.items() if bit & mask})
+            self._pools[mask] = pools
+        return pools
+
+    def candidates(self, allowed_categories: Optional[List[str]] = None) -> Tuple[List[str], List[str]]:
+        """(regular_ids, promo_ids) for a theme; callers must not mutate the returned lists."""
+        return self._pools_for_mask(self.mask_for(allowed_categories))
+
+    def search_index(self) -> CatalogSearchIndex:
+        """Inverted indexes for GET /catalog/search, built on first use (publish_catalog builds them up front)."""
+        if self._search is None:
+            with self._lazy_lock:
+                if self._search is None:
+                    self._search = CatalogSearchIndex(self.catalog)
+        return self._search
+
+    def popularity_heads(self, source: Hashable, promo: bool = False) -> PopularityHeads:
+        """The categories' regular (or promo) items by one popularity source's counts."""
+        heads = self.heads.get((source, promo))
+        if heads is None:
+            with self._lazy_lock:
+                heads = self.heads.get((source, promo))
+                if heads is None:
+                    pools = {cat: pools[1 if promo else 0] for cat, pools in self.by_category.items()}
+                    heads = self.heads[(source, promo)] = PopularityHeads(pools, POPULARITY_HEAD_SIZE)
+        return heads
+
+    def store_layout(self) -> StoreLayout:
+        """Parsed item locations, walking distances and cached routes for ordering challenges."""
+        if self._layout is None:
+            with self._lazy_lock:
+                if self._layout is None:
+                    self._layout = StoreLayout(self.catalog)
+        return self._layout
+
+CATALOG_INDEX: Optional[CatalogIndex] = None
+
+_CATALOG_PUBLISH_LOCK = threading.Lock()
+
+def publish_catalog(items: Dict[str, ChallengeItemModel], challenges: List[ChallengeModel]) -> CatalogIndex:
+    """Index a new catalog and make it current in one step.
+
+    The index is built off to the side and then swapped in by rebinding the globals, never by
+    mutating the old dicts, so in-flight requests keep a consistent snapshot. The version bump
+    makes the challenge and response caches drop everything built from the old catalog.
+    """
+    global CATALOG_INDEX, CATALOG, food_items
+    with _CATALOG_PUBLISH_LOCK:
+        version = CATALOG_INDEX.version + 1 if CATALOG_INDEX is not None else 1
+        index = CatalogIndex(items, TEMPLATES, version, challenges)
+        index.search_index()
+        index.store_layout()
+        CATALOG_INDEX = index
+        CATALOG = index.catalog
+        food_items = index.challenges
+    return index
+
 def ingest_challenges_into_catalog(challs: List[ChallengeModel]):
+    """Merge challenge items into the current catalog and swap in a freshly built index."""
+    current = CATALOG_INDEX
+    merged = dict(current.catalog) if current is not None else {}
     for ch in challs:
         for it in ch.items:
-            CATALOG[it.id] = it
+            merged[it.id] = it
+    publish_catalog(merged, current.challenges if current is not None else [])
+
+def reload_catalog(path: Optional[str] = None) -> CatalogIndex:
+    """Re-read the catalog file and publish it; on error the current catalog stays."""
+    data = load_catalog(path or CATALOG_PATH)  # parse and validate before touching anything
+    return publish_catalog(data.items, data.challenges)
+
+def current_catalog_index() -> CatalogIndex:
+    return CATALOG_INDEX
+
+def catalog_index_for(catalog: Dict[str, ChallengeItemModel]) -> CatalogIndex:
+    """The shared index for the current catalog; a throwaway one for any other dict."""
+    index = CATALOG_INDEX
+    if index is not None and catalog is index.catalog:
+        return index
+    return CatalogIndex(catalog)
 
-food_items: List[ChallengeModel] = [
-    ChallengeModel(
-        id="4",
-        title="Health & Wellness",
-        description="Pick up vitamins and supplements",
-        points=300,
-        timeRemaining="3h 00m",
-        color="from-[var(--store-gradient-from)] to-[var(--store-gradient-to)]",
-        items=[
-            # existing
-            ChallengeItemModel(id="13", name="Multivitamins", category="Health", location="Aisle 10, Left", points=100, price=15.99),
-            ChallengeItemModel(id="14", name="Protein Powder", category="Health", location="Aisle 10, Center", points=120, price=29.99, isPromo=True),
-            ChallengeItemModel(id="15", name="Greek Yogurt", category="Dairy", location="Aisle 3, Center", points=80, price=5.99),
-
-            # new (Health/Dairy only)
-            ChallengeItemModel(id="26", name="Vitamin D3 2000 IU", category="Health", location="Aisle 10, Left", points=90, price=8.99, isPromo=True),
-            ChallengeItemModel(id="27", name="Omega-3 Fish Oil", category="Health", location="Aisle 10, Left", points=110, price=12.49),
-            ChallengeItemModel(id="28", name="Probiotic Capsules", category="Health", location="Aisle 10, Center", points=120, price=17.99),
-            ChallengeItemModel(id="29", name="Electrolyte Drink Mix", category="Health", location="Aisle 10, Right", points=70, price=9.49),
-            ChallengeItemModel(id="30", name="Almond Milk (Unsweetened)", category="Dairy", location="Aisle 3, Left", points=75, price=3.79),
-            ChallengeItemModel(id="31", name="Kefir (Plain)", category="Dairy", location="Aisle 3, Right", points=85, price=4.99, isPromo=True),
-            ChallengeItemModel(id="32", name="Whey Isolate", category="Health", location="Aisle 10, Center", points=130, price=34.99),
-            ChallengeItemModel(id="33", name="Collagen Peptides", category="Health", location="Aisle 10, Right", points=120, price=22.99),
-            ChallengeItemModel(id="34", name="Herbal Tea (Chamomile)", category="Health", location="Aisle 10, Endcap", points=60, price=3.49),
-            ChallengeItemModel(id="35", name="Hand Sanitizer (Travel)", category="Health", location="Aisle 10, Front", points=50, price=2.49),
-            ChallengeItemModel(id="36", name="First Aid Kit (Small)", category="Health", location="Aisle 10, Back", points=140, price=14.99),
-            ChallengeItemModel(id="37", name="Flexible Bandages", category="Health", location="Aisle 10, Back", points=55, price=3.29),
-            ChallengeItemModel(id="38", name="Digital Thermometer", category="Health", location="Aisle 10, Back", points=150, price=9.99, isPromo=True),
-            ChallengeItemModel(id="39", name="Low-Fat Milk (1%)", category="Dairy", location="Aisle 3, Left", points=70, price=2.99),
-            ChallengeItemModel(id="40", name="Cottage Cheese", category="Dairy", location="Aisle 3, Center", points=80, price=3.59),
-        ],
-    ),
-    ChallengeModel(
-        id="5",
-        title="Weekend BBQ",
-        description="Everything you need for a backyard BBQ",
-        points=750,
-        timeRemaining="6h 30m",
-        color="from-[var(--store-gradient-from)] to-[var(--store-gradient-to)]",
-        items=[
-            # existing
-            ChallengeItemModel(id="16", name="Ground Beef", category="Meat", location="Aisle 1, Back", points=150, price=9.99, isPromo=True),
-            ChallengeItemModel(id="17", name="Hot Dog Buns", category="Bakery", location="Aisle 7, Left", points=80, price=2.99),
-            ChallengeItemModel(id="18", name="BBQ Sauce", category="Condiments", location="Aisle 4, Center", points=100, price=4.99),
-            ChallengeItemModel(id="19", name="Lettuce", category="Produce", location="Front Section", points=120, price=2.49),
-            ChallengeItemModel(id="20", name="Tomatoes", category="Produce", location="Front Section", points=120, price=3.99),
-            ChallengeItemModel(id="21", name="Cheese Slices", category="Dairy", location="Aisle 3, Right", points=180, price=5.99, isPromo=True),
-
-            # new (Meat/Bakery/Condiments/Produce/Dairy only)
-            ChallengeItemModel(id="41", name="Italian Sausage Links", category="Meat", location="Aisle 1, Back", points=140, price=8.49),
-            ChallengeItemModel(id="42", name="Chicken Thighs (Bone-in)", category="Meat", location="Aisle 1, Back", points=130, price=6.99, isPromo=True),
-            ChallengeItemModel(id="43", name="Brioche Burger Buns", category="Bakery", location="Aisle 7, Right", points=95, price=3.99),
-            ChallengeItemModel(id="44", name="Sesame Hamburger Buns", category="Bakery", location="Aisle 7, Right", points=85, price=2.79),
-            ChallengeItemModel(id="45", name="Ketchup (Squeeze)", category="Condiments", location="Aisle 4, Left", points=70, price=2.49),
-            ChallengeItemModel(id="46", name="Yellow Mustard", category="Condiments", location="Aisle 4, Left", points=60, price=1.69),
-            ChallengeItemModel(id="47", name="Dill Pickle Spears", category="Condiments", location="Aisle 4, Right", points=80, price=3.49),
-            ChallengeItemModel(id="48", name="Relish", category="Condiments", location="Aisle 4, Right", points=60, price=1.99),
-            ChallengeItemModel(id="49", name="Corn on the Cob (4 ct)", category="Produce", location="Front Section", points=110, price=3.99, isPromo=True),
-            ChallengeItemModel(id="50", name="Portobello Mushrooms (2 ct)", category="Produce", location="Front Section", points=100, price=4.49),
-            ChallengeItemModel(id="51", name="Red Onions (2 lb)", category="Produce", location="Front Section", points=90, price=2.29),
-            ChallengeItemModel(id="52", name="Watermelon (Quarter)", category="Produce", location="Front Section", points=120, price=4.99),
-            ChallengeItemModel(id="53", name="American Cheese Slices (24 ct)", category="Dairy", location="Aisle 3, Right", points=160, price=4.79),
-            ChallengeItemModel(id="54", name="Swiss Cheese Slices", category="Dairy", location="Aisle 3, Right", points=170, price=5.49),
-            ChallengeItemModel(id="55", name="Thick-Cut Bacon", category="Meat", location="Aisle 1, Back", points=140, price=7.99),
-            ChallengeItemModel(id="56", name="Coleslaw Mix", category="Produce", location="Front Section", points=100, price=2.69),
-        ],
-    ),
-    ChallengeModel(
-        id="6",
-        title="Baking Bonanza",
-        description="Gather supplies for weekend baking",
-        points=400,
-        timeRemaining="4h 20m",
-        color="from-[var(--store-gradient-from)] to-[var(--store-gradient-to)]",
-        items=[
-            # existing
-            ChallengeItemModel(id="22", name="All-Purpose Flour", category="Baking", location="Aisle 8, Left", points=100, price=4.99),
-            ChallengeItemModel(id="23", name="Sugar", category="Baking", location="Aisle 8, Left", points=100, price=3.99, isPromo=True),
-            ChallengeItemModel(id="24", name="Butter", category="Dairy", location="Aisle 3, Center", points=100, price=5.49),
-            ChallengeItemModel(id="25", name="Vanilla Extract", category="Baking", location="Aisle 8, Center", points=100, price=6.99),
-
-            # new (Baking/Dairy only)
-            ChallengeItemModel(id="57", name="Baking Powder", category="Baking", location="Aisle 8, Left", points=85, price=2.49),
-            ChallengeItemModel(id="58", name="Baking Soda", category="Baking", location="Aisle 8, Left", points=80, price=1.29),
-            ChallengeItemModel(id="59", name="Brown Sugar", category="Baking", location="Aisle 8, Left", points=95, price=2.79),
-            ChallengeItemModel(id="60", name="Powdered Sugar", category="Baking", location="Aisle 8, Left", points=90, price=2.59),
-            ChallengeItemModel(id="61", name="Chocolate Chips", category="Baking", location="Aisle 8, Center", points=110, price=3.49, isPromo=True),
-            ChallengeItemModel(id="62", name="Cocoa Powder", category="Baking", location="Aisle 8, Center", points=110, price=4.29),
-            ChallengeItemModel(id="63", name="Active Dry Yeast (3 pk)", category="Baking", location="Aisle 8, Right", points=95, price=1.99),
-            ChallengeItemModel(id="64", name="Large Eggs (12 ct)", category="Dairy", location="Aisle 3, Center", points=100, price=3.29),
-            ChallengeItemModel(id="65", name="Whole Milk (Vitamin D)", category="Dairy", location="Aisle 3, Left", points=90, price=3.39),
-            ChallengeItemModel(id="66", name="Heavy Whipping Cream", category="Dairy", location="Aisle 3, Center", points=105, price=4.19),
-            ChallengeItemModel(id="67", name="Vanilla Beans (2 ct)", category="Baking", location="Aisle 8, Center", points=140, price=8.99),
-            ChallengeItemModel(id="68", name="Almond Extract", category="Baking", location="Aisle 8, Center", points=95, price=3.69),
-            ChallengeItemModel(id="69", name="Ground Cinnamon", category="Baking", location="Aisle 8, Right", points=90, price=2.99),
-            ChallengeItemModel(id="70", name="Ground Nutmeg", category="Baking", location="Aisle 8, Right", points=90, price=3.29),
-            ChallengeItemModel(id="71", name="Cream Cheese (8 oz)", category="Dairy", location="Aisle 3, Right", points=100, price=2.79, isPromo=True),
-            ChallengeItemModel(id="72", name="Sour Cream (16 oz)", category="Dairy", location="Aisle 3, Right", points=95, price=2.49),
-        ],
-    ),
-]
-CATALOG.clear()
-ingest_challenges_into_catalog(food_items)
 class PurchaseEvent(BaseModel):
     user_id: str
     item_id: str
-    quantity: int
-    price_paid: float
+    quantity: int = Field(ge=1, le=MAX_QUANTITY)  # history stores int32 quantities
+    price_paid: float = Field(ge=0, le=MAX_PRICE)  # and float32 prices
     purchased_at: datetime
 
-# naive in-memory stores
-PURCHASE_HISTORY: Dict[str, List[PurchaseEvent]] = {}  # user_id -> events
+class PurchaseRecord(TypedDict):
+    """PurchaseEvent validated to a plain dict, for /history/bulk: no model is built per record."""
+    user_id: str
+    item_id: str
+    quantity: Annotated[int, Field(ge=1, le=MAX_QUANTITY)]
+    price_paid: Annotated[float, Field(ge=0, le=MAX_PRICE)]
+    purchased_at: datetime
+
+def epoch_days(ts: datetime) -> float:
+    """Days since the Unix epoch; naive datetimes are taken as UTC (like datetime.utcnow())."""
+    return epoch_timestamp(ts) / 86400.0
+
+class DecayedAffinity:
+    """Per-item exponentially decayed purchase counts for one user and one half-life.
+
+    Each event adds ``quantity * exp(lam * (t - ref))`` for a fixed reference time ``ref``,
+    so an update is O(1) and never touches older events. The score at ``now`` is the stored
+    value times ``exp(-lam * (now - ref))``. When the exponent would grow too large the
+    reference is moved forward and the stored values rescaled once.
+    """
+
+    MAX_EXPONENT = 600.0  # exp(709) overflows a float
+
+    def __init__(self, half_life_days: float):
+        self.lam = math.log(2) / half_life_days
+        self.ref: Optional[float] = None
+        self.scores: Dict[str, float] = {}
+
+    def add(self, item_id: str, quantity: int, t_days: float):
+        if self.ref is None:
+            self.ref = t_days
+        x = self.lam * (t_days - self.ref)
+        if x > self.MAX_EXPONENT:
+            self.rebase(t_days)
+            x = 0.0
+        self.scores[item_id] = self.scores.get(item_id, 0.0) + quantity * math.exp(x)
+
+    def add_many(self, rows: List[Row]):
+        """add() for each (user_id, item_id, quantity, price_paid, epoch seconds) row, in order."""
+        if not rows:
+            return
+        if self.ref is None:
+            self.ref = rows[0][4] / 86400.0
+        scores, lam = self.scores, self.lam
+        last_ts, weight = None, 0.0
+        for _, item_id, quantity, _, ts in rows:
+            if ts != last_ts:  # a receipt's rows share a timestamp; one exp for all of them
+                t_days = ts / 86400.0
+                x = lam * (t_days - self.ref)
+                if x > self.MAX_EXPONENT:
+                    self.rebase(t_days)
+                    scores, x = self.scores, 0.0
+                last_ts, weight = ts, math.exp(x)
+            scores[item_id] = scores.get(item_id, 0.0) + quantity * weight
+
+    def rebase(self, t_days: float):
+        scale = math.exp(-self.lam * (t_days - self.ref))
+        self.scores = {iid: s * scale for iid, s in self.scores.items()}
+        self.ref = t_days
+
+    def scores_at(self, t_days: float) -> Dict[str, float]:
+        if self.ref is None:
+            return {}
+        f = math.exp(-self.lam * (t_days - self.ref))
+        return {iid: s * f for iid, s in self.scores.items()}
+
+# half-lives kept up to date on every purchase; any other half_life_days rescans PURCHASE_HISTORY
+AFFINITY_HALF_LIVES: Tuple[float, ...] = (7.0, 30.0, 90.0)
+
+# in-memory stores
+# user_id -> compact event arrays; events lighter than HISTORY_MIN_WEIGHT under the longest
+# tracked half-life get compacted away, so a rescan with a longer half-life only sees what's left
+PURCHASE_HISTORY = EventStore(
+    half_life_days=float(os.getenv("HISTORY_COMPACT_HALF_LIFE_DAYS", max(AFFINITY_HALF_LIVES))),
+    min_weight=float(os.getenv("HISTORY_MIN_WEIGHT", "1e-3")),
+    max_events_per_user=int(os.getenv("HISTORY_MAX_EVENTS_PER_USER", "10000")),
+)
 STOREWIDE_POPULARITY: Dict[str, int] = {}  # item_id -> count
+# item -> count over the last N days for each N in POPULARITY_WINDOWS_DAYS; a template or a
+# request picks one with popularity_window_days (unset = all-time STOREWIDE_POPULARITY)
+POPULARITY_WINDOWS = WindowedPopularity(
+    windows_days=[float(d) for d in os.getenv("POPULARITY_WINDOWS_DAYS", "7,30").split(",") if d.strip()],
+    bucket_seconds=float(os.getenv("POPULARITY_BUCKET_SECONDS", "3600")),
+)
+USER_AFFINITY: Dict[str, Dict[float, DecayedAffinity]] = {}  # user_id -> half-life -> affinity
+
+# generated challenges per challenge_cache_key: (user_id, challenge_id, n_items, promo_ratio,
+# half_life_days, max_per_category, popularity window, seed period, user state version)
+CHALLENGE_CACHE = ChallengeCache(
+    maxsize=int(os.getenv("CHALLENGE_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("CHALLENGE_CACHE_TTL_SECONDS", "300")),
+)
+
+# Purchases are applied under striped per-user locks: a user's history and affinity only
+# change while that user's stripe is held, and readers take the stripe to read them.
+# STOREWIDE_POPULARITY is only written under _POPULARITY_LOCK, and then only with single
+# dict stores, so readers use plain .get() (or dict(...) for a point-in-time copy) without locking.
+USER_LOCKS = StripedLock(int(os.getenv("USER_LOCK_STRIPES", "64")))
+# reentrant: open_event_log replays the log through _apply_purchases while ingest is paused
+_POPULARITY_LOCK = threading.RLock()
+
+@contextmanager
+def ingest_paused() -> Iterator[None]:
+    """Hold every lock ingest uses, e.g. to restore or snapshot a consistent state."""
+    with USER_LOCKS.holding_all(), _POPULARITY_LOCK:
+        yield
+
+# durable log of every purchase (only when EVENT_LOG_DIR is set); a batch is logged while its
+# users' stripes are held, so each user's events are logged in the order they are applied
+EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR")
+SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("SNAPSHOT_INTERVAL_SECONDS", "300"))
+EVENT_LOG: Optional[EventLog] = None
+# called with every applied batch while its stripes and _POPULARITY_LOCK are held
+PURCHASE_LISTENERS: List[Callable[[List[Row]], None]] = []
+# item -> items bought with it by the same user within COPURCHASE_WINDOW_SECONDS, pruned to the
+# top COPURCHASE_TOP_N per item; in multi-worker mode it lives in the ingest process, so workers
+# rank without it (like windowed popularity)
+CO_PURCHASES = CoPurchaseIndex(
+    top_n=int(os.getenv("COPURCHASE_TOP_N", "20")),
+    window_seconds=float(os.getenv("COPURCHASE_WINDOW_SECONDS", "3600")),
+)
+PURCHASE_LISTENERS.append(CO_PURCHASES.add_rows)
+# latent user/item factors trained offline by factorization.py (None = not configured);
+# loaded at startup and again on SIGHUP, after a retrain has switched the directory's CURRENT
+FACTOR_MODEL_PATH = os.getenv("FACTOR_MODEL_PATH")
+FACTOR_MODEL: Optional[FactorModel] = None
+
+def load_factor_model(path: Optional[str] = None) -> FactorModel:
+    global FACTOR_MODEL
+    FACTOR_MODEL = FactorModel.load(path or FACTOR_MODEL_PATH)
+    return FACTOR_MODEL
+
+# multi-worker mode (see ingest_server.py): with both set, this process keeps no state of its
+# own; it reads popularity/affinity from the shared file and forwards purchases to the ingester
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH")
+INGEST_SOCKET = os.getenv("INGEST_SOCKET")
+SHARED_STATE: Optional[SharedState] = None
+INGEST_CLIENT: Optional[IngestClient] = None
+
+def _apply_purchases(rows: List[Row]):
+    """(user_id, item_id, quantity, price_paid, epoch seconds) rows -> in-memory stores.
+    The caller holds the stripes of every user in ``rows``."""
+    pop_delta: Dict[str, int] = {}
+    by_user: Dict[str, List[Row]] = {}
+    for row in rows:
+        pop_delta[row[1]] = pop_delta.get(row[1], 0) + row[2]
+        user_rows = by_user.get(row[0])
+        if user_rows is None:
+            by_user[row[0]] = [row]
+        else:
+            user_rows.append(row)
+    for user_id, user_rows in by_user.items():
+        PURCHASE_HISTORY.append_rows(user_id, user_rows)
+        tracked = USER_AFFINITY.get(user_id)
+        if tracked is None:
+            tracked = USER_AFFINITY[user_id] = {hl: DecayedAffinity(hl) for hl in AFFINITY_HALF_LIVES}
+        for aff in tracked.values():
+            aff.add_many(user_rows)
+
+    with _POPULARITY_LOCK:
+        for iid, qty in pop_delta.items():
+            STOREWIDE_POPULARITY[iid] = STOREWIDE_POPULARITY.get(iid, 0) + qty
+        POPULARITY_WINDOWS.add_many((r[1], r[2], r[4]) for r in rows)
+        bump_popularity_heads(pop_delta)
+        for listener in PURCHASE_LISTENERS:
+            listener(rows)
+
+def check_rows(rows: List[Row]) -> bytearray:
+    """The rows' log records; ValueError if any row can't be logged, or published to SHARED_STATE."""
+    if SHARED_STATE is not None:
+        for user_id, item_id, *_ in rows:
+            check_id(user_id)
+            check_id(item_id)
+    return encode_rows(rows)
+
+def record_rows(rows: List[Row]):
+    """Apply a batch of rows; popularity and cache invalidation are merged once per batch.
+    With EVENT_LOG_DIR set, returns once the batch is fsynced (group commit).
+    Raises ValueError if any row can't be stored, and SharedStateFull (behind an ingest
+    server) if the shared state has no room for the batch; either way nothing is applied or logged."""
+    # the log records and the history columns have the same limits, so a batch that
+    # encodes also applies: nothing fails halfway through _apply_purchases
+    encoded = check_rows(rows)
+    users = {r[0] for r in rows}
+    if INGEST_CLIENT is not None:
+        INGEST_CLIENT.send(rows, encoded)
+    else:
+        log = EVENT_LOG
+        with USER_LOCKS.holding(users):
+            seq = log.append(rows, encoded) if log is not None else 0
+            _apply_purchases(rows)
+        if log is not None:
+            log.sync(seq)
+    for user_id in users:
+        CHALLENGE_CACHE.invalidate_user(user_id)
+
+def record_purchases(evts: Iterable[PurchaseEvent]):
+    record_rows([(e.user_id, e.item_id, e.quantity, e.price_paid, epoch_timestamp(e.purchased_at)) for e in evts])
 
 def record_purchase(evt: PurchaseEvent):
-    PURCHASE_HISTORY.setdefault(evt.user_id, []).append(evt)
-    STOREWIDE_POPULARITY[evt.item_id] = STOREWIDE_POPULARITY.get(evt.item_id, 0) + evt.quantity
+    record_purchases((evt,))
+
+def open_event_log(directory: str):
+    """Restore state from the last snapshot plus newer log segments, then start logging.
+    Raises EventLogLocked if another process is already logging to ``directory``."""
+    global EVENT_LOG
+    log = EventLog(directory)
+    log.lock()  # before replay, which truncates torn tails
+    with ingest_paused():
+        first = load_snapshot(os.path.join(directory, SNAPSHOT_NAME), PURCHASE_HISTORY,
+                              STOREWIDE_POPULARITY, USER_AFFINITY, DecayedAffinity)
+        # the windows aren't in the snapshot; the history it restored still has every recent event
+        item_ids = PURCHASE_HISTORY.item_ids
+        POPULARITY_WINDOWS.add_many(
+            (item_ids[i], q, t) for events in PURCHASE_HISTORY.values()
+            for i, q, t in zip(events.item_idx, events.quantity, events.ts)
+        )
+        # nor are co-purchases; rebuilt from what the history kept, so the oldest baskets are gone
+        CO_PURCHASES.add_rows(
+            (user_id, item_ids[i], q, 0.0, t) for user_id, events in PURCHASE_HISTORY.items()
+            for i, q, t in zip(events.item_idx, events.quantity, events.ts)
+        )
+        for rows in log.replay(from_segment=first or 0):
+            _apply_purchases(rows)
+        log.open()
+        EVENT_LOG = log
+
+def snapshot_state():
+    """Fold everything logged so far into a new snapshot and drop the log segments it covers.
+    Ingest pauses only while the state is copied; the file is written after."""
+    log = EVENT_LOG
+    if log is None:
+        return
+    with ingest_paused():
+        segment = log.roll()
+        captured = capture_snapshot(segment, PURCHASE_HISTORY, STOREWIDE_POPULARITY,
+                                    USER_AFFINITY, AFFINITY_HALF_LIVES)
+    save_snapshot(os.path.join(log.directory, SNAPSHOT_NAME), captured)
+    log.drop_segments_before(segment)
+
+def _snapshot_loop(stop: threading.Event):
+    while not stop.wait(SNAPSHOT_INTERVAL_SECONDS):
+        snapshot_state()
+
+_SNAPSHOT_STOP = threading.Event()
+
+def _reload_on_sighup(signum, frame):
+    # off the signal handler: loading a large file shouldn't stall whatever the main thread was doing
+    threading.Thread(target=_reload_logged, daemon=True).start()
+
+def _reload_logged():
+    _reload_catalog_logged()
+    if FACTOR_MODEL_PATH:
+        try:
+            model = load_factor_model()
+            logger.info("factor model reloaded: %d users x %d items", len(model.user_ids), len(model.item_ids))
+        except (OSError, ValueError, KeyError):
+            logger.exception("factor model reload failed, keeping the previous one")
+
+def _reload_catalog_logged():
+    try:
+        index = reload_catalog()
+        logger.info("catalog reloaded: version %s, %d items", index.version, len(index.catalog))
+    except (CatalogFormatError, OSError):
+        logger.exception("catalog reload failed, keeping version %s", CATALOG_INDEX.version)
+
+@app.on_event("startup")
+def restore_state():
+    global SHARED_STATE, INGEST_CLIENT
+    if hasattr(signal, "SIGHUP"):
+        try:
+            signal.signal(signal.SIGHUP, _reload_on_sighup)
+        except ValueError:  # not the main thread (e.g. under a test client)
+            pass
+    if FACTOR_MODEL_PATH:
+        load_factor_model()
+    if SHARED_STATE_PATH and INGEST_SOCKET:
+        SHARED_STATE = SharedState.attach(SHARED_STATE_PATH)
+        INGEST_CLIENT = IngestClient(INGEST_SOCKET)
+    elif EVENT_LOG_DIR:
+        open_event_log(EVENT_LOG_DIR)
+        threading.Thread(target=_snapshot_loop, args=(_SNAPSHOT_STOP,), daemon=True).start()
+
+@app.on_event("shutdown")
+def close_event_log():
+    global EVENT_LOG, SHARED_STATE
+    _SNAPSHOT_STOP.set()
+    if SHARED_STATE is not None:
+        SHARED_STATE.close()
+        SHARED_STATE = None
+    if EVENT_LOG is not None:
+        snapshot_state()
+        EVENT_LOG.close()
+        EVENT_LOG = None
 
 # --- Scoring ---
-def exp_decay_score(events: List[PurchaseEvent], now: datetime, half_life_days: float = 30.0) -> Dict[str, float]:
+def exp_decay_score(events: Iterable[PurchaseEvent], now: datetime, half_life_days: float = 30.0) -> Dict[str, float]:
     """Return per-item affinity given a user's events."""
     if half_life_days <= 0:
         half_life_days = 30.0
@@ -183,6 +531,87 @@ def exp_decay_score(events: List[PurchaseEvent], now: datetime, half_life_days:
         scores[e.item_id] = scores.get(e.item_id, 0.0) + w
     return scores
 
+def popularity_lookup(window_days: Optional[float] = None,
+                      now: Optional[datetime] = None) -> Callable[[str, int], int]:
+    """(item_id, default) -> purchase count, all-time or over the last ``window_days``."""
+    if SHARED_STATE is not None:
+        # windowed counts live in the ingest process only; workers rank by all-time counts
+        return SHARED_STATE.popularity
+    if window_days is None:
+        return STOREWIDE_POPULARITY.get
+    return POPULARITY_WINDOWS.view(window_days, epoch_timestamp(now or datetime.utcnow())).get
+
+# workers only read the ingester's counts, so their heads are re-read this often (seconds)
+SHARED_POPULARITY_MAX_AGE = float(os.getenv("SHARED_POPULARITY_MAX_AGE", "1.0"))
+
+def popularity_heads(index: CatalogIndex, window_days: Optional[float] = None,
+                     promo: bool = False) -> PopularityHeads:
+    """``index``'s heads ordered by the counts popularity_lookup(window_days) reads."""
+    if SHARED_STATE is not None:
+        heads = index.popularity_heads("shared", promo)
+        heads.expire(math.floor(time.monotonic() / SHARED_POPULARITY_MAX_AGE))
+    elif window_days is None:
+        heads = index.popularity_heads(None, promo)  # all-time counts only grow: bumps keep it exact
+    else:
+        heads = index.popularity_heads(window_days, promo)
+        heads.expire(POPULARITY_WINDOWS.head)  # window counts only drop when the window moves
+    return heads
+
+def bump_popularity_heads(item_ids: Collection[str]):
+    """Tell the current index's heads which counts just went up; under _POPULARITY_LOCK."""
+    index = CATALOG_INDEX
+    if index is None:
+        return
+    for (source, _), heads in list(index.heads.items()):
+        if source is None:
+            heads.bump(item_ids, STOREWIDE_POPULARITY.get)
+        elif source in POPULARITY_WINDOWS.totals:
+            heads.bump(item_ids, POPULARITY_WINDOWS.totals[source].get)
+
+def check_popularity_window(window_days: Optional[float]) -> Optional[float]:
+    if window_days is not None and window_days not in POPULARITY_WINDOWS.windows:
+        allowed = ", ".join(f"{w:g}" for w in POPULARITY_WINDOWS.windows)
+        raise HTTPException(status_code=400, detail=f"popularity_window_days must be one of: {allowed}")
+    return window_days
+
+def has_history(user_id: str) -> bool:
+    if SHARED_STATE is not None:
+        return SHARED_STATE.has_user(user_id)
+    return bool(PURCHASE_HISTORY.get(user_id, ()))
+
+def user_state_version(user_id: str) -> int:
+    """Part of cache keys: other workers' purchases can't invalidate this worker's cache."""
+    return SHARED_STATE.user_version(user_id) if SHARED_STATE is not None else 0
+
+def challenge_cache_key(user_id: str, challenge_id: str, n_items: int, promo_ratio: float,
+                        half_life_days: float, max_per_category: int, window: Optional[float],
+                        period: Optional[str]) -> Tuple:
+    """CHALLENGE_CACHE key; /challenges/{id} and /challenges/batch share entries."""
+    return (user_id, challenge_id, n_items, promo_ratio, half_life_days, max_per_category,
+            window, period, user_state_version(user_id))
+
+def _shared_affinity(user_id: str, now: datetime, half_life_days: float) -> Dict[str, float]:
+    # only the tracked half-lives are shared; anything else uses the nearest one
+    hl = min(SHARED_STATE.half_lives, key=lambda h: abs(math.log(h / half_life_days)))
+    found = SHARED_STATE.user_affinity(user_id, hl)
+    if found is None:
+        return {}
+    ref, scores = found
+    f = math.exp(-math.log(2) / hl * (epoch_days(now) - ref))
+    return {iid: s * f for iid, s in scores.items()}
+
+def user_affinity(user_id: str, now: datetime, half_life_days: float = 30.0) -> Dict[str, float]:
+    """Same numbers as exp_decay_score over the user's history, without the rescan when
+    half_life_days is one of AFFINITY_HALF_LIVES."""
+    if SHARED_STATE is not None:
+        return _shared_affinity(user_id, now, half_life_days)
+    with USER_LOCKS.for_key(user_id):
+        tracked = USER_AFFINITY.get(user_id, {}).get(half_life_days)
+        if tracked is not None:
+            return tracked.scores_at(epoch_days(now))
+        events = list(PURCHASE_HISTORY.get(user_id, ()))
+    return exp_decay_score(events, now, half_life_days)
+
 # --- Candidate pools ---
 def split_candidates(catalog: Dict[str, ChallengeItemModel]) -> Tuple[List[str], List[str]]:
     regular_ids, promo_ids = [], []
@@ -205,7 +634,159 @@ def greedy_diversify_ranked(item_ids: List[str], catalog: Dict[str, ChallengeIte
             cat_counts[cat] = cat_counts.get(cat, 0) + 1
     return picked
 
+def top_k_diversified(item_ids: List[str], key: Callable[[str], Tuple[float, ...]],
+                      catalog: Dict[str, ChallengeItemModel], k: int,
+                      max_per_category: int = 2) -> List[str]:
+    """Same ids, in the same order, as
+    ``greedy_diversify_ranked(sorted(item_ids, key=key, reverse=True), catalog, max_per_category)[:k]``
+    without sorting the whole list.
+
+    Items are heapified per category (ties keep input order, like a stable sort); a small
+    heap over the category heads is then popped k times, and a category stops offering
+    items once it hits its cap. O(n + k log C) for C categories.
+    """
+    if k <= 0 or max_per_category <= 0:
+        return []
+    heaps: Dict[str, list] = {}
+    for pos, iid in enumerate(item_ids):
+        neg_key = tuple(-x for x in key(iid))
+        heaps.setdefault(catalog[iid].category, []).append((neg_key, pos, iid))
+    heads = []
+    for cat, h in heaps.items():
+        heapq.heapify(h)
+        heads.append(h[0] + (cat,))
+    heapq.heapify(heads)
+
+    picked, cat_counts = [], {}
+    while heads and len(picked) < k:
+        _, _, iid, cat = heapq.heappop(heads)
+        picked.append(iid)
+        cat_counts[cat] = cat_counts.get(cat, 0) + 1
+        h = heaps[cat]
+        heapq.heappop(h)
+        if h and cat_counts[cat] < max_per_category:
+            heapq.heappush(heads, h[0] + (cat,))
+    return picked
+
+# themes with more regular items than this are ranked from a bounded candidate set
+RANK_CANDIDATES_MIN_POOL = int(os.getenv("RANK_CANDIDATES_MIN_POOL", "256"))
+LATENT_CANDIDATES = int(os.getenv("LATENT_CANDIDATES", "64"))  # best latent items added to it
+
+def rank_candidates(index: CatalogIndex, allowed_categories: Optional[List[str]], heads: PopularityHeads,
+                    popularity: Callable[[str, int], int], scored: Collection[str],
+                    max_per_category: int) -> List[str]:
+    """The theme's regular items that can make its top k at ``max_per_category`` per category,
+    in catalog order (top_k_diversified breaks ties by input order): every one in ``scored``
+    (they rank above the rest) plus, per category, the most popular of the rest.
+
+    Exact when everything that isn't scored ranks by popularity, as for cold starts and
+    affinity; with latent scores, a category's best latent item outside ``scored`` can be
+    passed over for a popular one.
+    """
+    mask = index.mask_for(allowed_categories)
+    bits, catalog = index.item_bits, index.catalog
+    out = {iid for iid in scored if bits.get(iid, 0) & mask and not catalog[iid].isPromo}
+    for cat, bit in index.category_bits.items():
+        if bit & mask:
+            fill = [iid for iid in heads.head(cat, popularity) if iid not in scored][:max_per_category]
+            if len(fill) < max_per_category:  # the head is mostly scored items; take the whole category
+                fill = heads.pool(cat)
+            out.update(fill)
+    return sorted(out, key=index.positions.__getitem__)
+
+# --- Promo sampling ---
+# themes with more promos than this sample from each category's most popular ones
+PROMO_SAMPLE_POOL = int(os.getenv("PROMO_SAMPLE_POOL", "256"))
+
+def promo_candidates(index: CatalogIndex, allowed_categories: Optional[List[str]],
+                     popularity: Callable[[str, int], int], window_days: Optional[float] = None) -> List[str]:
+    """The promos a challenge samples from, in catalog order: the theme's whole promo pool, or,
+    past PROMO_SAMPLE_POOL items, the popularity heads of its categories (the long tail, which
+    the popularity weights rarely draw anyway, is left out)."""
+    promo_ids = index.candidates(allowed_categories)[1]
+    if len(promo_ids) <= PROMO_SAMPLE_POOL:
+        return promo_ids
+    heads = popularity_heads(index, window_days, promo=True)
+    mask = index.mask_for(allowed_categories)
+    out = [iid for cat, bit in index.category_bits.items() if bit & mask for iid in heads.head(cat, popularity)]
+    return sorted(out, key=index.positions.__getitem__)
+
+def weighted_sample_without_replacement(item_ids: List[str], weights: List[float], k: int,
+                                        rng: Optional[random.Random] = None) -> List[str]:
+    """Pick up to k distinct ids, each draw proportional to weight among those left.
+
+    Efraimidis–Spirakis: every id gets the key log(u) / w with u ~ U(0, 1) and the k largest
+    keys win, in draw order. One pass plus a k-sized heap, O(n log k). Ids with a
+    non-positive weight only come out once every positive-weight id has been taken.
+    """
+    if k <= 0:
+        return []
+    rand = (rng or random).random
+    keyed = []
+    for iid, w in zip(item_ids, weights):
+        u = rand()
+        keyed.append((math.log(u) / w if w > 0 and u > 0.0 else -math.inf, iid))
+    return [iid for _, iid in heapq.nlargest(k, keyed, key=itemgetter(0))]
+
+# --- Seeded generation ---
+# A seeded challenge draws its promos and order from an RNG derived from (user, template,
+# period), so the same inputs give the same items for the whole period: cacheable at the
+# edge and replayable. Unseeded challenges use a per-thread RNG rather than the global one.
+SEED_PERIOD_SECONDS = int(os.getenv("SEED_PERIOD_SECONDS", "86400"))
+SEEDED_BY_DEFAULT = os.getenv("SEEDED_CHALLENGES", "").lower() in ("1", "true", "yes", "on")
+# an explicit period (a bucket number, a hunt id) ends up in challenge ids and cache keys
+SEED_PERIOD_MAX_LENGTH = 64
+SEED_PERIOD_PATTERN = r"^[A-Za-z0-9_.:-]+$"
+_THREAD_RNG = threading.local()
+
+def current_period(now: datetime) -> str:
+    return str(math.floor(epoch_timestamp(now) / SEED_PERIOD_SECONDS))
+
+def challenge_rng(user_id: str, template_id: str, period: str) -> random.Random:
+    digest = hashlib.blake2b(f"{user_id}\x1f{template_id}\x1f{period}".encode(), digest_size=8).digest()
+    return random.Random(int.from_bytes(digest, "little"))
+
+def thread_rng() -> random.Random:
+    rng = getattr(_THREAD_RNG, "rng", None)
+    if rng is None:
+        rng = _THREAD_RNG.rng = random.Random()
+    return rng
+
+def resolve_seed(user_id: str, template_id: str, seeded: bool, period: Optional[str],
+                 now: datetime) -> Tuple[Optional[random.Random], Optional[str]]:
+    """(rng, period) for a request; (None, None) when it isn't seeded. A period implies seeded."""
+    if period is None and not seeded:
+        return None, None
+    period = period or current_period(now)
+    return challenge_rng(user_id, template_id, period), period
+
 # --- Selection ---
+def promo_split(n_items: int, promo_ratio: float, n_promo_candidates: int) -> Tuple[int, int]:
+    """(n_regular, n_promos) for one challenge."""
+    n_promos = max(0, min(n_promo_candidates, round(n_items * promo_ratio)))
+    return max(0, n_items - n_promos), n_promos
+
+def assemble_challenge_items(regular_ranked: List[str], promo_ids: List[str], n_items: int,
+                             n_promos: int, catalog: Dict[str, ChallengeItemModel],
+                             popularity: Optional[Callable[[str, int], int]] = None,
+                             rng: Optional[random.Random] = None,
+                             layout: Optional[StoreLayout] = None) -> List[ChallengeItemModel]:
+    """Add sampled promos to the ranked regular picks and order them along a walking route."""
+    rng = rng or thread_rng()
+    # promos: pop-weighted sampling without replacement
+    with stage("promo_sample"):
+        popularity = popularity or popularity_lookup()
+        promo_weights = [popularity(iid, 1) for iid in promo_ids]
+        chosen_promos = weighted_sample_without_replacement(promo_ids, promo_weights, n_promos, rng)
+
+    chosen_ids = (regular_ranked + chosen_promos)[:n_items]
+    # aisle by aisle rather than ranked order, so the hunt doesn't zig-zag across the store
+    with stage("route"):
+        layout = layout or StoreLayout({iid: catalog[iid] for iid in chosen_ids})
+        chosen_ids = layout.order(chosen_ids)
+
+    return [catalog[iid] for iid in chosen_ids]
+
 def select_items_for_challenge(
     user_id: str,
     catalog: Dict[str, ChallengeItemModel],
@@ -214,69 +795,78 @@ def select_items_for_challenge(
     half_life_days: float = 30.0,
     max_per_category: int = 2,
     allowed_categories: Optional[List[str]] = None,  # thematic filter
+    now: Optional[datetime] = None,
+    index: Optional[CatalogIndex] = None,  # pin a catalog snapshot across several calls
+    popularity_window_days: Optional[float] = None,  # None = all-time popularity
+    rng: Optional[random.Random] = None,  # e.g. challenge_rng(...) for a reproducible challenge
 ) -> List[ChallengeItemModel]:
     """Return concrete items for one challenge."""
-    now = datetime.utcnow()
+    now = now or datetime.utcnow()
+    with stage("popularity"):
+        popularity = popularity_lookup(popularity_window_days, now)
 
-    # filter by theme if provided
-    themed_ids = [iid for iid, it in catalog.items()
-                  if (allowed_categories is None or it.category in allowed_categories)]
-
-    themed_catalog = {iid: catalog[iid] for iid in themed_ids}
-    regular_ids, promo_ids = split_candidates(themed_catalog)
+    # filter by theme if provided (precomputed per catalog load)
+    with stage("theme_filter"):
+        index = index or catalog_index_for(catalog)
+        themed_catalog = index.catalog
+        regular_ids, promo_ids = index.candidates(allowed_categories)
 
     # how many of each
-    n_promos = max(0, min(len(promo_ids), round(n_items * promo_ratio)))
-    n_regular = max(0, n_items - n_promos)
+    n_regular, n_promos = promo_split(n_items, promo_ratio, len(promo_ids))
 
     # user scores
-    user_events = PURCHASE_HISTORY.get(user_id, [])
-    regular_rank = regular_ids[:]
-    if user_events:
-        scores = exp_decay_score(user_events, now, half_life_days)
-        # backfill zero for unseen items to stable sort by score desc, then small popularity bonus
+    history = has_history(user_id)
+    scores: Dict[str, float] = {}
+    related: Dict[str, float] = {}
+    if history:
+        with stage("affinity"):
+            scores = user_affinity(user_id, now, half_life_days)
+        with stage("related"):
+            related = CO_PURCHASES.related(scores)
+
+    # latent-factor preference, for users the offline model was trained on
+    model, latent = FACTOR_MODEL, None
+    if model is not None and model.user_vector(user_id) is None:
+        model = None
+
+    # a large theme is ranked from the items with a score plus each category's most popular others
+    candidates = regular_ids
+    if len(regular_ids) > RANK_CANDIDATES_MIN_POOL:
+        scored = scores.keys() | related.keys()
+        if model is not None:
+            with stage("latent"):
+                scored.update(model.top_items(user_id, LATENT_CANDIDATES, regular_ids))
+        with stage("candidates"):
+            candidates = rank_candidates(index, allowed_categories, popularity_heads(index, popularity_window_days),
+                                         popularity, scored, max_per_category)
+    if model is not None:
+        with stage("latent"):
+            latent = model.scorer(user_id, candidates)
+
+    if history:
+        # bought items by score desc, then items bought with them, then (latent preference and) popularity
+        if latent is None:
+            def key(iid: str):
+                return (scores.get(iid, 0.0), related.get(iid, 0.0), popularity(iid, 0))
+        else:
+            def key(iid: str):
+                return (scores.get(iid, 0.0), related.get(iid, 0.0), latent(iid), popularity(iid, 0))
+    elif latent is not None:
+        # no history in this process, but the model knows the user (e.g. from the purchases table)
         def key(iid: str):
-            pop = STOREWIDE_POPULARITY.get(iid, 0)
-            return (scores.get(iid, 0.0), pop)
-        regular_rank.sort(key=key, reverse=True)
+            return (latent(iid), popularity(iid, 0))
     else:
-        # cold start: use store popularity, then random
-        regular_rank.sort(key=lambda iid: STOREWIDE_POPULARITY.get(iid, 0), reverse=True)
-        if not regular_rank:
-            random.shuffle(regular_rank)
-
-    # diversity
-    regular_rank_div = greedy_diversify_ranked(regular_rank, themed_catalog, max_per_category)[:n_regular]
-
-    # promos: simple pop-weighted sampling without replacement
-    if promo_ids:
-        weighted = [(iid, STOREWIDE_POPULARITY.get(iid, 1)) for iid in promo_ids]
-        total = sum(w for _, w in weighted) or 1
-        # normalize weights to probabilities
-        probs = [(iid, w / total) for iid, w in weighted]
-        chosen_promos = []
-        pool = probs[:]
-        for _ in range(n_promos):
-            r = random.random()
-            acc = 0.0
-            pick = pool[0][0]
-            for iid, p in pool:
-                acc += p
-                if r <= acc:
-                    pick = iid
-                    break
-            chosen_promos.append(pick)
-            # remove picked and renormalize
-            pool = [(iid, p) for iid, p in pool if iid != pick]
-            s = sum(p for _, p in pool) or 1.0
-            pool = [(iid, p / s) for iid, p in pool]
-    else:
-        chosen_promos = []
+        # cold start: use store popularity
+        def key(iid: str):
+            return (popularity(iid, 0),)
 
-    chosen_ids = (regular_rank_div + chosen_promos)[:n_items]
-    random.shuffle(chosen_ids)  # avoid all regulars appearing first
+    # ranking + diversity in one bounded pass; never sorts the whole pool
+    with stage("rank"):
+        regular_rank_div = top_k_diversified(candidates, key, themed_catalog, n_regular, max_per_category)
 
-    return [themed_catalog[iid] for iid in chosen_ids]
+    promo_ids = promo_candidates(index, allowed_categories, popularity, popularity_window_days)
+    return assemble_challenge_items(regular_rank_div, promo_ids, n_items, n_promos, themed_catalog, popularity, rng,
+                                    index.store_layout())
 
 # --- Challenge Templates (themes) ---
 class ChallengeTemplate(BaseModel):
@@ -287,6 +877,7 @@ class ChallengeTemplate(BaseModel):
     default_points: int = 300
     default_timeRemaining: str = "3h 00m"
     allowed_categories: Optional[List[str]] = None
+    popularity_window_days: Optional[float] = None  # rank by recent popularity (see POPULARITY_WINDOWS)
 
 TEMPLATES: Dict[str, ChallengeTemplate] = {
     "health": ChallengeTemplate(
@@ -309,23 +900,147 @@ TEMPLATES: Dict[str, ChallengeTemplate] = {
     ),
 }
 
+reload_catalog()
+
 # --- Endpoints ---
 
 @app.post("/history")
 def add_purchase(evt: PurchaseEvent):
     if evt.item_id not in CATALOG:
         raise HTTPException(status_code=400, detail="Unknown item_id")
-    record_purchase(evt)
+    try:
+        record_purchase(evt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SharedStateFull as e:
+        raise HTTPException(status_code=413, detail=str(e))
     return {"ok": True}
 
+BULK_CHUNK_SIZE = 2000
+BULK_MAX_REPORTED_ERRORS = 1000
+PURCHASE_RECORD_ADAPTER = TypeAdapter(PurchaseRecord)
+PURCHASE_RECORDS_ADAPTER = TypeAdapter(List[PurchaseRecord])
+
+def _ingest_chunk(records: list) -> Tuple[int, List[dict]]:
+    valid, errors = validate_chunk(PURCHASE_RECORD_ADAPTER, PURCHASE_RECORDS_ADAPTER, records)
+    catalog = CATALOG
+    lines: List[int] = []
+    rows: List[Row] = []
+    for line, rec in valid:
+        if rec["item_id"] in catalog:
+            lines.append(line)
+            rows.append((rec["user_id"], rec["item_id"], rec["quantity"], rec["price_paid"],
+                         epoch_timestamp(rec["purchased_at"])))
+        else:
+            errors.append({"line": line, "error": "Unknown item_id"})
+    try:
+        record_rows(rows)
+    except ValueError:
+        # nothing was applied; find the rows that can't be stored and keep the rest
+        ok = []
+        for line, row in zip(lines, rows):
+            try:
+                check_rows([row])
+                ok.append(row)
+            except ValueError as e:
+                errors.append({"line": line, "error": str(e)})
+        rows = ok
+        record_rows(rows)
+    errors.sort(key=itemgetter("line"))
+    return len(rows), errors
+
+@app.post("/history/bulk")
+async def add_purchases_bulk(request: Request):
+    """
+    Many PurchaseEvents in one request: NDJSON (application/x-ndjson) or a JSON array.
+    The body is read as a stream and validated/applied about BULK_CHUNK_SIZE records at a time;
+    bad records are skipped and reported by line (NDJSON) or element position (array).
+    """
+    accepted, rejected, errors = 0, 0, []
+    chunk = []
+
+    async def flush():
+        nonlocal accepted, rejected, chunk
+        n_ok, errs = await run_in_threadpool(_ingest_chunk, chunk)
+        chunk = []
+        accepted += n_ok
+        rejected += len(errs)
+        errors.extend(errs[:BULK_MAX_REPORTED_ERRORS - len(errors)])
+
+    try:
+        async for records in records_from_stream(request.stream(), request.headers.get("content-type", "")):
+            chunk += records
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                await flush()
+        if chunk:
+            await flush()
+    except BulkFormatError as e:
+        # everything before the break has already been applied
+        raise HTTPException(status_code=400, detail={"error": str(e), "accepted": accepted, "rejected": rejected})
+    except SharedStateFull as e:
+        # likewise; the chunk that didn't fit and everything after it were not
+        raise HTTPException(status_code=413, detail={"error": str(e), "accepted": accepted, "rejected": rejected})
+
+    return {
+        "ok": rejected == 0,
+        "accepted": accepted,
+        "rejected": rejected,
+        "errors": errors,
+        "errors_truncated": rejected > len(errors),
+    }
+
+MAX_SEARCH_PAGE = 200
+
+def _csv_param(value: Optional[str]) -> Optional[List[str]]:
+    return [v for v in (x.strip() for x in value.split(",")) if v] if value else None
+
+@app.get("/catalog/search")
+@fast_response()
+def search_catalog(
+    q: Optional[str] = Query(None, description="Words that start words of the item name"),
+    category: Optional[str] = Query(None, description="Category, or several separated by commas"),
+    aisle: Optional[str] = Query(None, description='Aisle as in "Aisle 10, Left", or several separated by commas'),
+    promo: Optional[bool] = Query(None, description="Only promo items (true) or only regular ones (false)"),
+    whole_words: bool = Query(False, description="Match whole words of the name instead of prefixes"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=MAX_SEARCH_PAGE),
+):
+    """Catalog items matching all the given filters, in catalog order, one page at a time."""
+    index = current_catalog_index()
+    search = index.search_index()
+    hits = search.search(q, _csv_param(category), _csv_param(aisle), promo, whole_words)
+    return {
+        "catalog_version": index.version,
+        "total": len(hits),
+        "offset": offset,
+        "limit": limit,
+        "items": search.page(hits, offset, limit),
+    }
+
+# encoded bodies of the static challenge responses, per filter and catalog version
+STATIC_RESPONSES = EncodedResponseCache(maxsize=int(os.getenv("STATIC_RESPONSE_CACHE_SIZE", "256")))
+CHALLENGES_ADAPTER = TypeAdapter(List[ChallengeModel])
+CHALLENGE_ADAPTER = TypeAdapter(ChallengeModel)
+
+def encoded_response(body: bytes, etag: str, if_none_match: Optional[str]) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}  # cacheable, but revalidate every time
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @app.get("/challenges", response_model=List[ChallengeModel])
-def list_challenges(ids: Optional[str] = None):
-    """Unchanged from your original: returns pre-defined 4–6 or a subset."""
-    data = food_items
-    if ids:
-        wanted = set(x.strip() for x in ids.split(","))
-        data = [c for c in food_items if c.id in wanted]
-    return data
+def list_challenges(ids: Optional[str] = None, if_none_match: Optional[str] = Header(None)):
+    """Unchanged from your original: returns pre-defined 4–6 or a subset.
+    The encoded body is cached per filter and catalog version and served with an ETag."""
+    wanted = frozenset(x.strip() for x in ids.split(",")) if ids else None
+
+    def build() -> bytes:
+        data = index.challenges if wanted is None else [c for c in index.challenges if c.id in wanted]
+        return CHALLENGES_ADAPTER.dump_json(data)
+
+    index = current_catalog_index()
+    body, etag = STATIC_RESPONSES.get_or_build(("list", wanted), index.version, build)
+    return encoded_response(body, etag, if_none_match)
 
 # @app.get("/challenges/{challenge_id}", response_model=ChallengeModel)
 # def get_challenge(challenge_id: str):
@@ -335,6 +1050,98 @@ def list_challenges(ids: Optional[str] = None):
 #     raise HTTPException(status_code=404, detail="Challenge not found")
 
 
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+@app.post("/admin/catalog/reload")
+def admin_reload_catalog(x_admin_token: Optional[str] = Header(None)):
+    """Re-read CATALOG_PATH and swap it in. Needs ADMIN_TOKEN to be set and sent as X-Admin-Token.
+    Only this process reloads; with several workers, send each of them SIGHUP instead."""
+    if not ADMIN_TOKEN or not hmac.compare_digest((x_admin_token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    try:
+        index = reload_catalog()
+    except (CatalogFormatError, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"Catalog not reloaded: {e}")
+    return {"ok": True, "version": index.version, "items": len(index.catalog),
+            "challenges": len(index.challenges), "path": CATALOG_PATH}
+
+@app.get("/challenges/cache/stats")
+def challenge_cache_stats():
+    """Hit/miss/eviction counters for the generated-challenge, static response and route caches."""
+    return {**CHALLENGE_CACHE.stats(), "static_responses": STATIC_RESPONSES.stats(),
+            "routes": current_catalog_index().store_layout().stats()}
+
+METRICS.gauge("purchase_history_users", "Users with purchase history in this process.",
+              fn=lambda: len(PURCHASE_HISTORY))
+METRICS.gauge("purchase_history_events", "Purchase events held in this process.",
+              fn=lambda: PURCHASE_HISTORY.total_events)
+METRICS.gauge("catalog_items", "Items in the published catalog.", fn=lambda: len(current_catalog_index().catalog))
+METRICS.gauge("catalog_version", "Version of the published catalog; bumps on every reload.",
+              fn=lambda: current_catalog_index().version)
+METRICS.gauge("copurchase_pairs", "Item pairs kept by the co-purchase index.", fn=lambda: CO_PURCHASES.n_pairs)
+METRICS.gauge("factor_model_users", "Users in the loaded factor model (0 = none loaded).",
+              fn=lambda: len(FACTOR_MODEL.user_ids) if FACTOR_MODEL is not None else 0)
+METRICS.gauge("challenge_cache_entries", "Generated challenges in the cache.",
+              fn=lambda: CHALLENGE_CACHE.stats()["size"])
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus text format; values are for this worker process only."""
+    return METRICS.response()
+
+# registered before /challenges/{challenge_id}, which would otherwise match "generate" first
+@app.get("/challenges/generate", response_model=ChallengeModel)
+@fast_response(ChallengeModel)
+def generate_challenge(
+    user_id: str,
+    template_id: str = Query("bbq"),
+    n_items: int = Query(6, ge=1, le=20),
+    promo_ratio: float = Query(0.33, ge=0.0, le=1.0),
+    half_life_days: float = Query(30.0, gt=0.0),
+    max_per_category: int = Query(2, ge=1),
+    popularity_window_days: Optional[float] = Query(None, gt=0.0, description="Overrides the template's window"),
+    seeded: bool = Query(SEEDED_BY_DEFAULT, description="Same items for this user all through the period"),
+    period: Optional[str] = Query(None, max_length=SEED_PERIOD_MAX_LENGTH, pattern=SEED_PERIOD_PATTERN,
+                                  description="Seed period to use (implies seeded); default: current one"),
+):
+    if template_id not in TEMPLATES:
+        raise HTTPException(status_code=404, detail="Unknown template")
+    tpl = TEMPLATES[template_id]
+    window = check_popularity_window(popularity_window_days or tpl.popularity_window_days)
+    now = datetime.utcnow()
+    rng, period = resolve_seed(user_id, tpl.id, seeded, period, now)
+
+    index = current_catalog_index()
+    items = select_items_for_challenge(
+        user_id=user_id,
+        catalog=index.catalog,
+        n_items=n_items,
+        promo_ratio=promo_ratio,
+        half_life_days=half_life_days,
+        max_per_category=max_per_category,
+        allowed_categories=tpl.allowed_categories,
+        now=now,
+        index=index,
+        popularity_window_days=window,
+        rng=rng,
+    )
+
+    # points can be derived or left as template default; here we sum item points.
+    total_points = sum(i.points for i in items) if items else tpl.default_points
+
+    # a seeded challenge keeps its id for the whole period
+    return ChallengeModel(
+        id=f"gen-{template_id}-{user_id}-{period if period is not None else int(now.timestamp())}",
+        title=tpl.title,
+        description=tpl.description,
+        points=total_points,
+        timeRemaining=tpl.default_timeRemaining,
+        color=tpl.color,
+        items=items,
+        currentPoints=0,
+        completed=False
+    )
+
 ID_TO_TEMPLATE = {
     "4": "health",
     "5": "bbq",
@@ -342,6 +1149,7 @@ ID_TO_TEMPLATE = {
 }
 
 @app.get("/challenges/{challenge_id}", response_model=ChallengeModel)
+@fast_response(ChallengeModel)
 def get_challenge(
     challenge_id: str,
     user_id: Optional[str] = Query(None, description="User to personalize for"),
@@ -349,6 +1157,11 @@ def get_challenge(
     promo_ratio: float = Query(PROMO_DEFAULT, ge=0.0, le=1.0),
     half_life_days: float = Query(30.0, gt=0.0),
     max_per_category: int = Query(2, ge=1),
+    popularity_window_days: Optional[float] = Query(None, gt=0.0, description="Overrides the template's window"),
+    seeded: bool = Query(SEEDED_BY_DEFAULT, description="Same items for this user all through the period"),
+    period: Optional[str] = Query(None, max_length=SEED_PERIOD_MAX_LENGTH, pattern=SEED_PERIOD_PATTERN,
+                                  description="Seed period to use (implies seeded); default: current one"),
+    if_none_match: Optional[str] = Header(None),
 ):
     """
     For challenge IDs 4–6, dynamically (re)generate items using the user's purchase history
@@ -362,21 +1175,36 @@ def get_challenge(
             raise HTTPException(status_code=404, detail="Template missing for this challenge")
 
         tpl = TEMPLATES[template_id]
+        window = check_popularity_window(popularity_window_days or tpl.popularity_window_days)
+        now = datetime.utcnow()
+        rng, period = resolve_seed(user_id or "anon", tpl.id, seeded, period, now)
+
+        index = current_catalog_index()
+        cache_key = challenge_cache_key(user_id or "anon", challenge_id, n_items, promo_ratio, half_life_days,
+                                        max_per_category, window, period)
+        generation = CHALLENGE_CACHE.generation(user_id or "anon")
+        cached = CHALLENGE_CACHE.get(cache_key, index.version)
+        if cached is not None:
+            return cached
 
         # Personalize; if user_id is None or has no history, we gracefully fall back to popularity
         items = select_items_for_challenge(
             user_id=user_id or "anon",
-            catalog=CATALOG,
+            catalog=index.catalog,
             n_items=n_items,
             promo_ratio=promo_ratio,
             half_life_days=half_life_days,
             max_per_category=max_per_category,
             allowed_categories=tpl.allowed_categories,
+            now=now,
+            index=index,
+            popularity_window_days=window,
+            rng=rng,
         )
 
         total_points = sum(i.points for i in items) if items else tpl.default_points
 
-        return ChallengeModel(
+        challenge = ChallengeModel(
             id=challenge_id,  # keep original id for UI stability
             title=tpl.title,
             description=tpl.description,
@@ -387,50 +1215,173 @@ def get_challenge(
             currentPoints=0,
             completed=False,
         )
+        CHALLENGE_CACHE.put(cache_key, index.version, challenge, generation)
+        return challenge
 
     # Otherwise: original static behavior for non-4/5/6 ids
-    for c in food_items:
-        if c.id == challenge_id:
-            return c
-    raise HTTPException(status_code=404, detail="Challenge not found")
+    index = current_catalog_index()
+    challenge = next((c for c in index.challenges if c.id == challenge_id), None)
+    if challenge is None:  # never cached, so made-up ids can't push real entries out
+        raise HTTPException(status_code=404, detail="Challenge not found")
+    body, etag = STATIC_RESPONSES.get_or_build(("one", challenge_id), index.version,
+                                               lambda: CHALLENGE_ADAPTER.dump_json(challenge))
+    return encoded_response(body, etag, if_none_match)
 
-@app.get("/challenges/generate", response_model=ChallengeModel)
-def generate_challenge(
-    user_id: str,
-    template_id: str = Query("bbq"),
-    n_items: int = Query(6, ge=1, le=20),
-    promo_ratio: float = Query(0.33, ge=0.0, le=1.0),
-    half_life_days: float = Query(30.0, gt=0.0),
-    max_per_category: int = Query(2, ge=1),
-):
-    if template_id not in TEMPLATES:
-        raise HTTPException(status_code=404, detail="Unknown template")
-    tpl = TEMPLATES[template_id]
+# ------------- POST /challenges/batch -------------
+class ChallengeParams(BaseModel):
+    n_items: int = Field(6, ge=1, le=20)
+    promo_ratio: float = Field(PROMO_DEFAULT, ge=0.0, le=1.0)
+    half_life_days: float = Field(30.0, gt=0.0)
+    max_per_category: int = Field(2, ge=1)
+    popularity_window_days: Optional[float] = Field(None, gt=0.0)  # overrides the template's window
+    seeded: bool = SEEDED_BY_DEFAULT
+    period: Optional[str] = Field(None, max_length=SEED_PERIOD_MAX_LENGTH, pattern=SEED_PERIOD_PATTERN)  # implies seeded
 
-    items = select_items_for_challenge(
-        user_id=user_id,
-        catalog=CATALOG,
-        n_items=n_items,
-        promo_ratio=promo_ratio,
-        half_life_days=half_life_days,
-        max_per_category=max_per_category,
-        allowed_categories=tpl.allowed_categories
-    )
+class BatchChallengeRequest(BaseModel):
+    user_id: Optional[str] = None
+    # a TEMPLATES key ("bbq"), or one of the smart challenge ids ("5") to keep that id in the response
+    template_id: str
+    params: ChallengeParams = Field(default_factory=ChallengeParams)
 
-    # points can be derived or left as template default; here we sum item points.
-    total_points = sum(i.points for i in items) if items else tpl.default_points
+MAX_BATCH_CHALLENGES = 1000
+BATCH_VECTORISE_MIN = 16  # smaller batches are cheaper scored one by one than with a BatchScorer
 
-    return ChallengeModel(
-        id=f"gen-{template_id}-{user_id}-{int(datetime.utcnow().timestamp())}",
-        title=tpl.title,
-        description=tpl.description,
-        points=total_points,
-        timeRemaining=tpl.default_timeRemaining,
-        color=tpl.color,
-        items=items,
-        currentPoints=0,
-        completed=False
-    )
+def rank_regulars_batch(reqs: List[BatchChallengeRequest], tpls: List[ChallengeTemplate],
+                        windows: List[Optional[float]], index: CatalogIndex, now: datetime) -> List[List[str]]:
+    """Ranked, diversified regular ids for every request, scoring all users together."""
+    user_ids = [r.user_id or "anon" for r in reqs]
+    with USER_LOCKS.holding(user_ids):
+        events = EventColumns.from_store(PURCHASE_HISTORY, set(user_ids))
+    scorers: Dict[Optional[float], BatchScorer] = {}
+    now_days = epoch_days(now)
+
+    groups: Dict[Tuple[float, int, Optional[float]], List[int]] = {}
+    for i, r in enumerate(reqs):
+        groups.setdefault((r.params.half_life_days, r.params.max_per_category, windows[i]), []).append(i)
+
+    ranked: List[List[str]] = [[] for _ in reqs]
+    for (half_life_days, max_per_category, window), members in groups.items():
+        scorer = scorers.get(window)
+        if scorer is None:
+            counts = STOREWIDE_POPULARITY if window is None else POPULARITY_WINDOWS.view(window, epoch_timestamp(now))
+            scorer = scorers[window] = BatchScorer.from_catalog(index.catalog, dict(counts))
+        rows = [events.user_rows.get(user_ids[i], -1) for i in members]
+        with stage("affinity"):
+            entries = scorer.affinity_entries(events, rows, now_days, half_life_days)
+        related = None
+        if len(CO_PURCHASES):
+            with stage("related"):
+                related = scorer.sparse_entries([
+                    CO_PURCHASES.related(user_affinity(user_ids[i], now, half_life_days)) if row >= 0 else None
+                    for i, row in zip(members, rows)])
+        by_template: Dict[str, List[int]] = {}
+        for pos, i in enumerate(members):
+            by_template.setdefault(tpls[i].id, []).append(pos)
+        for positions in by_template.values():
+            tpl = tpls[members[positions[0]]]
+            _, promo_ids = index.candidates(tpl.allowed_categories)
+            n_regular = [promo_split(reqs[members[pos]].params.n_items, reqs[members[pos]].params.promo_ratio,
+                                     len(promo_ids))[0] for pos in positions]
+            # only this template's users, so each template's top-k work is proportional to its own share
+            tpl_entries, tpl_related = entries, related
+            if len(positions) < len(members):
+                tpl_entries = take_rows(entries, len(members), positions)
+                if related is not None:
+                    tpl_related = take_rows(related, len(members), positions)
+            with stage("rank"):
+                top = scorer.top_k(tpl_entries, len(positions), tpl.allowed_categories,
+                                   max(n_regular), max_per_category, tpl_related)
+            for row, pos in enumerate(positions):
+                ranked[members[pos]] = scorer.ids(top[row, :n_regular[row]])
+    return ranked
+
+@app.post("/challenges/batch", response_model=List[Optional[ChallengeModel]])
+@fast_response(List[Optional[ChallengeModel]])
+def generate_challenges_batch(reqs: List[BatchChallengeRequest]):
+    """
+    Generate many challenges in one call, e.g. all cards for one user or a whole store's hunts.
+    Every challenge in the batch sees the same catalog snapshot and the same clock, and
+    shares CHALLENGE_CACHE entries with /challenges/{challenge_id}; only misses are generated.
+    An id that isn't a template or a smart challenge gets the static challenge with that id,
+    as /challenges/{challenge_id} would, or null in its place if there is none.
+    """
+    if len(reqs) > MAX_BATCH_CHALLENGES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_CHALLENGES} challenges per batch")
+    tpls = [TEMPLATES.get(ID_TO_TEMPLATE.get(r.template_id, r.template_id)) for r in reqs]
+    windows = [check_popularity_window(r.params.popularity_window_days or tpl.popularity_window_days)
+               if tpl is not None else None for r, tpl in zip(reqs, tpls)]
+
+    now = datetime.utcnow()
+    index = current_catalog_index()
+    static = {c.id: c for c in index.challenges}
+    out: List[Optional[ChallengeModel]] = [None] * len(reqs)
+    keys, generations, misses = {}, {}, []
+    for i, (r, tpl) in enumerate(zip(reqs, tpls)):
+        if tpl is None:
+            out[i] = static.get(r.template_id)
+            continue
+        p, user_id = r.params, r.user_id or "anon"
+        period = resolve_seed(user_id, tpl.id, p.seeded, p.period, now)[1]
+        keys[i] = challenge_cache_key(user_id, r.template_id, p.n_items, p.promo_ratio, p.half_life_days,
+                                      p.max_per_category, windows[i], period)
+        generations[i] = CHALLENGE_CACHE.generation(user_id)
+        out[i] = CHALLENGE_CACHE.get(keys[i], index.version)
+        if out[i] is None:
+            misses.append(i)
+
+    # the vectorised path needs the raw history, which only a single-process server keeps;
+    # users the factor model knows are ranked one by one (its sparse top-k can't take dense
+    # latent scores), so a loaded model only narrows the path to the users it wasn't trained on
+    model = FACTOR_MODEL
+    batched = [i for i in misses if model is None or model.user_vector(reqs[i].user_id or "anon") is None]
+    ranked: Dict[int, List[str]] = {}
+    if len(batched) >= BATCH_VECTORISE_MIN and SHARED_STATE is None:
+        ranked = dict(zip(batched, rank_regulars_batch([reqs[i] for i in batched], [tpls[i] for i in batched],
+                                                       [windows[i] for i in batched], index, now)))
+
+    for i in misses:
+        r, tpl = reqs[i], tpls[i]
+        p = r.params
+        user_id = r.user_id or "anon"
+        rng, period = resolve_seed(user_id, tpl.id, p.seeded, p.period, now)
+        if i not in ranked:
+            items = select_items_for_challenge(
+                user_id=user_id,
+                catalog=index.catalog,
+                n_items=p.n_items,
+                promo_ratio=p.promo_ratio,
+                half_life_days=p.half_life_days,
+                max_per_category=p.max_per_category,
+                allowed_categories=tpl.allowed_categories,
+                now=now,
+                index=index,
+                popularity_window_days=windows[i],
+                rng=rng,
+            )
+        else:
+            _, promo_ids = index.candidates(tpl.allowed_categories)
+            n_promos = promo_split(p.n_items, p.promo_ratio, len(promo_ids))[1]
+            popularity = popularity_lookup(windows[i], now)
+            items = assemble_challenge_items(ranked[i], promo_candidates(index, tpl.allowed_categories, popularity,
+                                                                         windows[i]),
+                                             p.n_items, n_promos, index.catalog, popularity, rng, index.store_layout())
+
+        total_points = sum(it.points for it in items) if items else tpl.default_points
+        challenge_id = r.template_id if r.template_id in ID_TO_TEMPLATE \
+            else f"gen-{tpl.id}-{user_id}-{period if period is not None else int(now.timestamp())}"
+        out[i] = ChallengeModel(
+            id=challenge_id,
+            title=tpl.title,
+            description=tpl.description,
+            points=total_points,
+            timeRemaining=tpl.default_timeRemaining,
+            color=tpl.color,
+            items=items,
+            currentPoints=0,
+            completed=False,
+        )
+        CHALLENGE_CACHE.put(keys[i], index.version, out[i], generations[i])
+    return out
 
 class HuntResult(BaseModel):
     # Keep the camelCase keys you requested
@@ -0,0 +1 @@
+"""Benchmarks for the recommender in api.py. Run from backend/, e.g. `python -m bench.promo_sampler`."""
@@ -0,0 +1,102 @@
+"""
+Stress check for concurrent purchases and challenge reads.
+
+Threads call the /history and /challenges/{id} handlers directly, the way the
+AnyIO threadpool runs them, with a tiny switch interval to force interleaving.
+At the end every counter must match what was posted exactly.
+
+    python -m bench.concurrent_ingest [--writers 8] [--readers 8] [--events 20000]
+"""
+import argparse
+import math
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import api
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--events", type=int, default=20_000, help="per writer")
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    sys.setswitchinterval(1e-6)
+    item_ids = list(api.CATALOG)
+    start = datetime(2025, 1, 1)
+    posted = [Counter() for _ in range(args.writers)]
+    per_user = [Counter() for _ in range(args.writers)]
+    done = threading.Event()
+    reads = Counter()
+    errors = []
+
+    def writer(w: int):
+        rng = random.Random(w)
+        try:
+            for i in range(args.events):
+                user_id = f"user-{rng.randrange(args.users)}"
+                evt = api.PurchaseEvent(user_id=user_id, item_id=rng.choice(item_ids),
+                                        quantity=rng.randint(1, 3), price_paid=1.0,
+                                        purchased_at=start + timedelta(minutes=i))
+                api.add_purchase(evt)
+                posted[w][evt.item_id] += evt.quantity
+                per_user[w][user_id] += 1
+        except Exception as e:  # noqa: BLE001 - surfaced in the summary
+            errors.append(repr(e))
+
+    def reader(r: int):
+        rng = random.Random(1000 + r)
+        try:
+            while not done.is_set():
+                api.get_challenge(rng.choice(list(api.ID_TO_TEMPLATE)), user_id=f"user-{rng.randrange(args.users)}",
+                                  n_items=6, promo_ratio=api.PROMO_DEFAULT, half_life_days=rng.choice([7.0, 30.0, 45.0]),
+                                  max_per_category=2, popularity_window_days=None,
+                                  seeded=False, period=None, if_none_match=None)
+                reads[r] += 1
+        except Exception as e:  # noqa: BLE001
+            errors.append(repr(e))
+
+    writers = [threading.Thread(target=writer, args=(w,)) for w in range(args.writers)]
+    readers = [threading.Thread(target=reader, args=(r,)) for r in range(args.readers)]
+    t0 = time.perf_counter()
+    for t in readers + writers:
+        t.start()
+    for t in writers:
+        t.join()
+    done.set()
+    for t in readers:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    expected_pop = sum(posted, Counter())
+    expected_users = sum(per_user, Counter())
+    pop_ok = dict(expected_pop) == api.STOREWIDE_POPULARITY
+    # nothing is compacted at these volumes, so every event has to be there
+    hist_ok = all(len(api.PURCHASE_HISTORY.get(u, ())) == n for u, n in expected_users.items())
+    total_ok = api.PURCHASE_HISTORY.total_events == args.writers * args.events
+    now = start + timedelta(days=365)
+    aff_ok = all(
+        math.isclose(s, ref.get(iid, 0.0), rel_tol=1e-9)
+        for u in expected_users
+        for ref in [api.exp_decay_score(api.PURCHASE_HISTORY[u], now, 30.0)]
+        for iid, s in api.user_affinity(u, now, 30.0).items()
+    )
+
+    print(f"{args.writers} writers x {args.events:,} purchases, {args.readers} readers, {elapsed:.1f}s")
+    print(f"purchases/s: {args.writers * args.events / elapsed:,.0f}  challenge reads: {sum(reads.values()):,}")
+    print(f"popularity exact: {pop_ok}  history exact: {hist_ok}  total_events exact: {total_ok}  "
+          f"affinity matches rescan: {aff_ok}  errors: {len(errors)}")
+    for e in errors[:5]:
+        print("  ", e)
+    if errors or not (pop_ok and hist_ok and total_ok and aff_ok):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Deterministic synthetic data for the benchmarks: catalogs, purchase histories.
+
+Everything is derived from the seed and the sizes, so two runs (or two
+commits) benchmark exactly the same inputs.
+"""
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List, Sequence
+
+from api import PurchaseEvent
+from catalog import ChallengeItemModel
+
+# fixed "now" so decay and popularity windows see the same ages on every run
+NOW = datetime(2025, 6, 1)
+CATEGORIES = ["Produce", "Dairy", "Meat", "Bakery", "Baking", "Health", "Condiments", "Snacks",
+              "Frozen", "Beverages", "Pantry", "Household"]
+WORDS = ["organic", "fresh", "whole", "greek", "sourdough", "smoked", "roasted", "unsweetened", "classic", "family",
+         "apple", "banana", "yogurt", "milk", "bread", "chicken", "salmon", "olive", "oil", "salt", "sugar", "flour",
+         "vanilla", "protein", "coffee", "tea", "rice", "pasta", "sauce", "cheese", "butter", "eggs", "beans"]
+SPOTS = ["Front", "Center", "Back", "Left", "Right", "Endcap"]
+
+
+def synthetic_catalog(n_items: int, seed: int = 0, promo_share: float = 0.15,
+                      n_aisles: int = 20) -> Dict[str, ChallengeItemModel]:
+    rng = random.Random(f"catalog-{n_items}-{seed}")
+    catalog = {}
+    for i in range(n_items):
+        iid = f"i{i}"
+        location = "Front Section" if rng.random() < 0.05 else \
+            f"Aisle {rng.randint(1, n_aisles)}, {rng.choice(SPOTS)}"
+        catalog[iid] = ChallengeItemModel(
+            id=iid,
+            name=" ".join(rng.sample(WORDS, rng.randint(1, 3))).title(),
+            category=rng.choice(CATEGORIES),
+            location=location,
+            points=rng.randrange(10, 200, 10),
+            price=round(rng.uniform(0.5, 40.0), 2),
+            isPromo=True if rng.random() < promo_share else None,
+        )
+    return catalog
+
+
+def synthetic_events(user_id: str, n_events: int, item_ids: Sequence[str], seed: int = 0,
+                     span_days: int = 365) -> List[PurchaseEvent]:
+    """``n_events`` purchases over the ``span_days`` before NOW, oldest first, skewed towards a few items."""
+    rng = random.Random(f"events-{user_id}-{n_events}-{len(item_ids)}-{seed}")
+    # every user has favourites: a Zipf-ish pick over a per-user shuffle of the catalog
+    favourites = rng.sample(list(item_ids), min(len(item_ids), 200))
+    offsets = sorted(rng.randrange(span_days * 86400) for _ in range(n_events))
+    start = NOW - timedelta(days=span_days)
+    return [
+        PurchaseEvent(user_id=user_id,
+                      item_id=favourites[min(int(rng.paretovariate(1.2)) - 1, len(favourites) - 1)],
+                      quantity=rng.randint(1, 4), price_paid=round(rng.uniform(0.5, 40.0), 2),
+                      purchased_at=start + timedelta(seconds=off))
+        for off in offsets
+    ]
+
+
+def popularity_weights(item_ids: Sequence[str], seed: int = 0) -> List[int]:
+    rng = random.Random(f"popularity-{len(item_ids)}-{seed}")
+    return [int(rng.paretovariate(1.1)) for _ in item_ids]
@@ -0,0 +1,65 @@
+"""
+Memory of PURCHASE_HISTORY: the old dict of PurchaseEvent lists vs event_store.EventStore.
+
+    python -m bench.history_memory [--events 1000000] [--users 20000]
+"""
+import argparse
+import gc
+import random
+import tracemalloc
+from datetime import datetime, timedelta
+
+from api import PurchaseEvent
+from event_store import EventStore, epoch_seconds
+
+
+def synthetic_events(n_events: int, n_users: int, n_items: int = 5_000, seed: int = 0):
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    for _ in range(n_events):
+        yield (f"user-{rng.randrange(n_users)}", str(rng.randrange(n_items)), rng.randint(1, 4),
+               round(rng.uniform(0.5, 40.0), 2), start + timedelta(seconds=rng.randrange(300 * 86400)))
+
+
+def measure(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    gc.collect()
+    return size
+
+
+def build_lists(args):
+    history = {}
+    for u, iid, q, p, ts in synthetic_events(args.events, args.users):
+        history.setdefault(u, []).append(PurchaseEvent(user_id=u, item_id=iid, quantity=q, price_paid=p, purchased_at=ts))
+    return history
+
+
+def build_store(args):
+    # no decay compaction here, so both sides hold every event
+    store = EventStore(min_weight=0.0, max_events_per_user=args.events)
+    for u, iid, q, p, ts in synthetic_events(args.events, args.users):
+        store.append(u, iid, q, p, epoch_seconds(ts))
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    args = parser.parse_args()
+
+    old = measure(lambda: build_lists(args))
+    new = measure(lambda: build_store(args))
+    print(f"events: {args.events:,}  users: {args.users:,}")
+    print(f"{'Dict[str, List[PurchaseEvent]]':<32} {old / 2**20:>9.1f} MiB  {old / args.events:>7.1f} B/event")
+    print(f"{'EventStore':<32} {new / 2**20:>9.1f} MiB  {new / args.events:>7.1f} B/event")
+    print(f"ratio: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Micro-benchmarks for the recommender hot path, with machine-readable results.
+
+Cases (all inputs from bench.datagen, so they are identical between runs):
+
+- exp_decay_score over 0-10^4 events;
+- split_candidates, greedy_diversify_ranked and the promo sampler
+  (weighted_sample_without_replacement) over 10^2-10^5 item catalogs;
+- select_items_for_challenge for every catalog size x user history size.
+
+Each case is timed call by call with perf_counter_ns until --budget seconds or
+--repeat calls, whichever comes first, and reports min/p50/p90/p99/mean. A
+separate, shorter pass under tracemalloc records the peak bytes allocated
+during a call and the bytes still held after it returns, result included
+(medians).
+
+    python -m bench.hot_path [--quick] [--filter select] [--json out.json]
+    python -m bench.hot_path --json new.json --compare old.json [--threshold 0.1] [--fail-on-regression]
+
+--compare matches cases by name and flags those whose p50 got slower by more
+than --threshold (a fraction).
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+import api
+from bench.datagen import NOW, popularity_weights, synthetic_catalog, synthetic_events
+
+CATALOG_SIZES = [100, 1_000, 10_000, 100_000]
+EVENT_COUNTS = [0, 10, 100, 1_000, 10_000]
+QUICK_CATALOG_SIZES = [100, 10_000]
+QUICK_EVENT_COUNTS = [0, 1_000]
+
+
+class Case(NamedTuple):
+    name: str
+    params: Dict[str, Any]
+    fn: Callable[[], Any]
+
+
+def percentile(sorted_ns: List[int], q: float) -> float:
+    return sorted_ns[min(len(sorted_ns) - 1, int(q * len(sorted_ns)))] / 1e3
+
+
+def time_case(fn: Callable[[], Any], budget_s: float, repeat: int, min_calls: int = 5) -> Dict[str, float]:
+    for _ in range(3):  # warm caches, lazily built indexes and the allocator
+        fn()
+    samples: List[int] = []
+    deadline = time.perf_counter() + budget_s
+    gc_was_enabled = gc.isenabled()
+    gc.disable()  # collections land on random calls and mostly measure everything else alive
+    try:
+        while len(samples) < repeat and (len(samples) < min_calls or time.perf_counter() < deadline):
+            t0 = time.perf_counter_ns()
+            fn()
+            samples.append(time.perf_counter_ns() - t0)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    samples.sort()
+    return {
+        "calls": len(samples),
+        "min_us": samples[0] / 1e3,
+        "p50_us": percentile(samples, 0.50),
+        "p90_us": percentile(samples, 0.90),
+        "p99_us": percentile(samples, 0.99),
+        "mean_us": statistics.fmean(samples) / 1e3,
+    }
+
+
+def allocations(fn: Callable[[], Any], calls: int = 5) -> Dict[str, int]:
+    peaks, retained = [], []
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for _ in range(calls):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            result = fn()
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(after - before)
+            del result
+    finally:
+        tracemalloc.stop()
+    return {"peak_alloc_bytes": int(statistics.median(peaks)), "retained_bytes": int(statistics.median(retained))}
+
+
+def build_cases(catalog_sizes: List[int], event_counts: List[int], seed: int) -> List[Case]:
+    cases: List[Case] = []
+    rng = random.Random(seed)
+
+    # exp_decay_score only looks at the events, so one mid-sized catalog is enough
+    item_ids = [f"i{i}" for i in range(1_000)]
+    for n_events in event_counts:
+        events = synthetic_events("decay-user", n_events, item_ids, seed)
+        cases.append(Case("exp_decay_score", {"events": n_events},
+                          lambda events=events: api.exp_decay_score(events, NOW, 30.0)))
+
+    for n_items in catalog_sizes:
+        catalog = synthetic_catalog(n_items, seed)
+        index = api.CatalogIndex(catalog, api.TEMPLATES)
+        ids = list(catalog)
+        regular_ids, promo_ids = api.split_candidates(catalog)
+        weights = popularity_weights(ids, seed)
+        by_score = [iid for _, iid in sorted(zip(weights, ids), reverse=True)]
+        promo_weights = [weights[int(iid[1:])] for iid in promo_ids]
+        cases.append(Case("split_candidates", {"items": n_items},
+                          lambda catalog=catalog: api.split_candidates(catalog)))
+        cases.append(Case("greedy_diversify_ranked", {"items": n_items},
+                          lambda ranked=by_score, catalog=catalog: api.greedy_diversify_ranked(ranked, catalog, 2)))
+        cases.append(Case("weighted_sample_without_replacement", {"items": len(promo_ids), "k": 2},
+                          lambda ids=promo_ids, w=promo_weights: api.weighted_sample_without_replacement(ids, w, 2, rng)))
+
+        for n_events in event_counts:
+            user_id = f"bench-{n_items}-{n_events}"
+            if n_events and not api.has_history(user_id):
+                api.record_purchases(synthetic_events(user_id, n_events, ids, seed))
+            cases.append(Case("select_items_for_challenge", {"items": n_items, "events": n_events},
+                              lambda user_id=user_id, catalog=catalog, index=index: api.select_items_for_challenge(
+                                  user_id, catalog, n_items=6, promo_ratio=0.33, half_life_days=30.0,
+                                  allowed_categories=api.TEMPLATES["bbq"].allowed_categories, now=NOW,
+                                  index=index, rng=rng)))
+    return cases
+
+
+def case_key(result: Dict[str, Any]) -> str:
+    return result["name"] + "".join(f" {k}={v}" for k, v in sorted(result["params"].items()))
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, threshold: float) -> int:
+    with open(baseline_path) as f:
+        baseline = {case_key(r): r for r in json.load(f)["results"]}
+    regressions = 0
+    print(f"\n{'vs ' + baseline_path:<60} {'p50 before':>11} {'p50 now':>9} {'change':>8}")
+    for r in results:
+        old = baseline.get(case_key(r))
+        if old is None:
+            continue
+        change = r["p50_us"] / old["p50_us"] - 1 if old["p50_us"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{case_key(r):<60} {old['p50_us']:>11.1f} {r['p50_us']:>9.1f} {change:>+7.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="fewer sizes, for a smoke run")
+    parser.add_argument("--filter", default="", help="only cases whose name contains this")
+    parser.add_argument("--budget", type=float, default=0.5, help="seconds of timing per case")
+    parser.add_argument("--repeat", type=int, default=2000, help="at most this many timed calls per case")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--compare", help="a previous --json file to compare p50s against")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    sizes = QUICK_CATALOG_SIZES if args.quick else CATALOG_SIZES
+    events = QUICK_EVENT_COUNTS if args.quick else EVENT_COUNTS
+    cases = [c for c in build_cases(sizes, events, args.seed) if args.filter in c.name]
+
+    results = []
+    print(f"{'case':<60} {'calls':>6} {'p50 us':>9} {'p90 us':>9} {'p99 us':>9} {'peak KiB':>9} {'kept KiB':>9}")
+    for case in cases:
+        r = {"name": case.name, "params": case.params,
+             **time_case(case.fn, args.budget, args.repeat), **allocations(case.fn)}
+        results.append(r)
+        print(f"{case_key(r):<60} {r['calls']:>6} {r['p50_us']:>9.1f} {r['p90_us']:>9.1f} {r['p99_us']:>9.1f} "
+              f"{r['peak_alloc_bytes'] / 1024:>9.1f} {r['retained_bytes'] / 1024:>9.1f}")
+
+    if args.json:
+        meta = {"commit": git_commit(), "python": platform.python_version(), "numpy": np.__version__,
+                "machine": platform.machine(), "platform": platform.platform(),
+                "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "seed": args.seed, "quick": args.quick, "budget_s": args.budget, "repeat": args.repeat}
+        with open(args.json, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=1)
+        print(f"\nwrote {args.json}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Response encoding per endpoint: FastAPI's response_model path vs fast_json.
+
+The baseline is what FastAPI runs for a route's return value: validate
+against response_model, serialise, then JSONResponse.render. The fast path
+is fast_json.encode_response with the route's type. Payloads are typical
+responses for each endpoint. profileapi routes are skipped when its database
+driver isn't installed.
+
+    python -m bench.json_encoding [--repeat 2000]
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, List, Tuple
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+from pydantic import TypeAdapter
+
+import api
+from fast_json import encode_response
+
+
+def route_for(app, path: str, method: str) -> APIRoute:
+    for route in app.routes:
+        if isinstance(route, APIRoute) and route.path == path and method in route.methods:
+            return route
+    raise KeyError(path)
+
+
+def fastapi_encoder(route: APIRoute) -> Callable[[Any], Awaitable[bytes]]:
+    async def encode(content):
+        data = await serialize_response(field=route.response_field, response_content=content,
+                                        is_coroutine=asyncio.iscoroutinefunction(route.endpoint))
+        return JSONResponse(data).body  # the app's default response class
+    return encode
+
+
+def challenge_payloads() -> List[Tuple[str, str, str, Any]]:
+    index = api.catalog_index_for(api.CATALOG)
+    tpl = api.TEMPLATES["bbq"]
+
+    def challenge(i: int) -> api.ChallengeModel:
+        items = api.select_items_for_challenge(f"user-{i}", index.catalog, allowed_categories=tpl.allowed_categories,
+                                               index=index)
+        return api.ChallengeModel(id="5", title=tpl.title, description=tpl.description, points=600,
+                                  timeRemaining=tpl.default_timeRemaining, color=tpl.color, items=items)
+
+    return [
+        ("api GET /challenges/{id}", "/challenges/{challenge_id}", "GET", challenge(0)),
+        ("api POST /challenges/batch x100", "/challenges/batch", "POST", [challenge(i) for i in range(100)]),
+    ]
+
+
+def profile_payloads():
+    try:
+        import profileapi
+    except ImportError as e:
+        print(f"(skipping profileapi: {e})")
+        return None, []
+    now = datetime.now(timezone.utc)
+    user = profileapi.UserProfile(user_id="u-1", email="a@b.c", first_name="Ann", last_name="Lee", points=1200,
+                                  created_at=now, updated_at=now)
+    purchases = [
+        profileapi.Purchase(purchase_id=f"p-{i}", user_id="u-1", store_location="Main St", total_amount=42.5,
+                            items=[{"id": str(j), "name": f"Item {j}", "quantity": 2, "price": 3.49} for j in range(5)],
+                            purchase_date=now - timedelta(days=i))
+        for i in range(50)
+    ]
+    return profileapi.app, [
+        ("profileapi GET /users/{id}", "/users/{user_id}", "GET", user),
+        ("profileapi GET /users/{id}/purchases x50", "/users/{user_id}/purchases", "GET", purchases),
+    ]
+
+
+def timed(fn: Callable[[], Any], repeat: int) -> float:
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat * 1e6
+
+
+async def timed_async(fn: Callable[[], Awaitable[Any]], repeat: int) -> float:
+    await fn()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        await fn()
+    return (time.perf_counter() - t0) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    cases = [(api.app, *c) for c in challenge_payloads()]
+    profile_app, profile_cases = profile_payloads()
+    cases += [(profile_app, *c) for c in profile_cases]
+
+    print(f"{'endpoint':<42} {'fastapi us':>11} {'fast us':>9} {'speedup':>8}  same JSON")
+    for app, name, path, method, payload in cases:
+        route = route_for(app, path, method)
+        baseline = fastapi_encoder(route)
+        adapter = TypeAdapter(route.response_model)
+        fast = lambda: encode_response(payload, adapter).body  # noqa: E731
+        same = json.loads(asyncio.run(baseline(payload))) == json.loads(fast())
+        before = asyncio.run(timed_async(lambda: baseline(payload), args.repeat))
+        after = timed(fast, args.repeat)
+        print(f"{name:<42} {before:>11.1f} {after:>9.1f} {before / after:>7.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    main()
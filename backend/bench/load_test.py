@@ -0,0 +1,437 @@
+"""
+End-to-end load test of profileapi and api, with SQLite standing in for Snowflake.
+
+Each virtual user goes through a realistic flow, in a loop:
+
+    profile POST /users                         sign up
+    for each visit (--visits):
+        api     POST /challenges/batch          the home page's three cards
+        profile POST /users/{id}/purchases      checkout
+        api     POST /history/bulk              the same items, for the recommender
+        profile POST /users/{id}/points         points for the purchase
+    profile GET  /users/{id}/purchases          history page
+    profile GET  /users/{id}                    profile page
+    api     GET  /challenges/{id}?user_id=      a personalised challenge
+
+Drivers:
+
+- in-process (default): both apps are called through ASGI in this process,
+  startup and shutdown included, so no web server or HTTP client is needed.
+  Async endpoints block the event loop while they wait on the database, just
+  as they do under uvicorn. DB round trips are counted per request.
+- --serve: starts both apps under uvicorn (needs uvicorn), with
+  PROFILE_DB pointed at the stand-in, and drives them over HTTP. DB round
+  trips come from the stand-in's per-process stats files after shutdown, as a
+  total per profileapi request.
+- --profile-url/--api-url: servers that are already running. No DB counts.
+
+STANDIN_LATENCY_MS adds a delay per DB round trip to mimic the network to
+Snowflake. The report shows throughput plus p50/p95/p99 and DB round trips per
+request for each endpoint; --json also writes it to a file.
+
+    python -m bench.load_test [--users 32] [--duration 20] [--visits 3] [--serve --workers 2]
+    python -m bench.load_test --bulk 200000 [--bulk-body 10000] [--users 4]
+"""
+import argparse
+import asyncio
+import gc
+import http.client
+import json
+import os
+import random
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+PROFILE, API = "profile", "api"
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.round_trips: Dict[str, List[int]] = defaultdict(list)
+        self.flows = 0
+
+    def add(self, name: str, seconds: float, ok: bool, round_trips: Optional[int]):
+        self.latencies[name].append(seconds)
+        if not ok:
+            self.errors[name] += 1
+        if round_trips is not None:
+            self.round_trips[name].append(round_trips)
+
+
+class InProcessDriver:
+    """Both ASGI apps in this process; requests never touch a socket."""
+
+    def __init__(self, db_path: str):
+        os.environ["PROFILE_DB"] = f"sqlite:{db_path}"
+        import api
+        import profileapi
+        import sqlite_standin
+        self.apps = {PROFILE: profileapi.app, API: api.app}
+        self.sink = sqlite_standin.ROUND_TRIP_SINK
+        self._lifespans = []
+
+    async def _lifespan(self, app) -> Tuple[asyncio.Queue, asyncio.Queue, asyncio.Task]:
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        task = asyncio.create_task(app({"type": "lifespan", "asgi": {"version": "3.0"}}, inbox.get, outbox.put))
+        await inbox.put({"type": "lifespan.startup"})
+        msg = await outbox.get()
+        if msg["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"startup failed: {msg}")
+        return inbox, outbox, task
+
+    async def start(self):
+        for app in self.apps.values():
+            self._lifespans.append(await self._lifespan(app))
+
+    async def stop(self):
+        for inbox, outbox, task in self._lifespans:
+            await inbox.put({"type": "lifespan.shutdown"})
+            await outbox.get()
+            await task
+
+    async def request(self, target: str, method: str, path: str, body: Any = None,
+                      query: Optional[dict] = None) -> Tuple[int, bytes, Optional[int]]:
+        payload = json.dumps(body).encode() if body is not None else b""
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+            "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+            "query_string": urlencode(query or {}).encode(),
+            "headers": [(b"host", b"loadtest"), (b"content-type", b"application/json"),
+                        (b"content-length", str(len(payload)).encode())],
+            "client": ("127.0.0.1", 0), "server": ("loadtest", 80),
+        }
+        done = asyncio.Event()
+        delivered = False
+
+        async def receive():
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {"type": "http.request", "body": payload, "more_body": False}
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        status, chunks = 0, []
+
+        async def send(msg):
+            nonlocal status
+            if msg["type"] == "http.response.start":
+                status = msg["status"]
+            elif msg["type"] == "http.response.body":
+                chunks.append(msg.get("body", b""))
+                if not msg.get("more_body"):
+                    done.set()
+
+        sink: List[str] = []
+        token = self.sink.set(sink)  # the app's threadpool calls inherit this context
+        try:
+            await self.apps[target](scope, receive, send)
+        finally:
+            self.sink.reset(token)
+            done.set()
+        return status, b"".join(chunks), len(sink)
+
+
+class HttpDriver:
+    """Servers over HTTP, one keep-alive connection per worker thread and server."""
+
+    def __init__(self, urls: Dict[str, str], concurrency: int):
+        self.urls = {k: urlsplit(v) for k, v in urls.items()}
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+        self._local = threading.local()
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        self.pool.shutdown()
+
+    def _conn(self, target: str) -> http.client.HTTPConnection:
+        conns = self._local.__dict__.setdefault("conns", {})
+        if target not in conns:
+            url = self.urls[target]
+            conns[target] = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+        return conns[target]
+
+    def _blocking(self, target, method, path, payload, query):
+        if query:
+            path = f"{path}?{urlencode(query)}"
+        for attempt in (0, 1):
+            conn = self._conn(target)
+            try:
+                conn.request(method, path, body=payload, headers={"Content-Type": "application/json"})
+                resp = conn.getresponse()
+                return resp.status, resp.read()
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                if attempt:
+                    raise
+
+    async def request(self, target: str, method: str, path: str, body: Any = None,
+                      query: Optional[dict] = None) -> Tuple[int, bytes, Optional[int]]:
+        payload = json.dumps(body).encode() if body is not None else None
+        loop = asyncio.get_running_loop()
+        status, data = await loop.run_in_executor(self.pool, self._blocking, target, method, path, payload, query)
+        return status, data, None
+
+
+async def timed(driver, rec: Recorder, name: str, target: str, method: str, path: str, **kw) -> Optional[Any]:
+    t0 = time.perf_counter()
+    try:
+        status, data, round_trips = await driver.request(target, method, path, **kw)
+    except Exception:  # noqa: BLE001 - a failed request is a data point, not the end of the run
+        rec.add(name, time.perf_counter() - t0, False, None)
+        return None
+    rec.add(name, time.perf_counter() - t0, 200 <= status < 300, round_trips)
+    if not 200 <= status < 300:
+        return None
+    return json.loads(data) if data else None
+
+
+async def user_flow(driver, rec: Recorder, rng: random.Random, vu: int, n: int, visits: int):
+    tag = f"{os.getpid()}-{vu}-{n}"
+    user = await timed(driver, rec, "profile POST /users", PROFILE, "POST", "/users",
+                       body={"email": f"load-{tag}@example.com", "first_name": "Load", "last_name": f"User{vu}"})
+    if user is None:
+        return
+    uid = user["user_id"]
+    for _ in range(visits):
+        cards = await timed(driver, rec, "api POST /challenges/batch", API, "POST", "/challenges/batch",
+                            body=[{"user_id": uid, "template_id": t} for t in ("4", "5", "6")])
+        items = [it for card in cards or () for it in card["items"]]
+        if not items:
+            continue
+        basket = rng.sample(items, min(len(items), rng.randint(1, 4)))
+        lines = [{"id": it["id"], "name": it["name"], "quantity": rng.randint(1, 3), "price": it["price"]}
+                 for it in basket]
+        await timed(driver, rec, "profile POST /users/{id}/purchases", PROFILE, "POST", f"/users/{uid}/purchases",
+                    body={"store_location": "Main St", "items": lines,
+                          "total_amount": round(sum(li["price"] * li["quantity"] for li in lines), 2)})
+        now = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+        await timed(driver, rec, "api POST /history/bulk", API, "POST", "/history/bulk",
+                    body=[{"user_id": uid, "item_id": li["id"], "quantity": li["quantity"],
+                           "price_paid": li["price"], "purchased_at": now} for li in lines])
+        await timed(driver, rec, "profile POST /users/{id}/points", PROFILE, "POST", f"/users/{uid}/points",
+                    body={"points_change": sum(it["points"] for it in basket), "description": "load test"})
+    await timed(driver, rec, "profile GET /users/{id}/purchases", PROFILE, "GET", f"/users/{uid}/purchases")
+    await timed(driver, rec, "profile GET /users/{id}", PROFILE, "GET", f"/users/{uid}")
+    await timed(driver, rec, "api GET /challenges/{id}", API, "GET", f"/challenges/{rng.choice('456')}",
+                query={"user_id": uid})
+    rec.flows += 1
+
+
+async def run(driver, users: int, duration: float, visits: int, seed: int) -> Tuple[Recorder, float]:
+    rec = Recorder()
+    await driver.start()
+    deadline = time.perf_counter() + duration
+
+    async def virtual_user(vu: int):
+        rng = random.Random(f"{seed}-{vu}")
+        n = 0
+        while time.perf_counter() < deadline:
+            await user_flow(driver, rec, rng, vu, n, visits)
+            n += 1
+
+    t0 = time.perf_counter()
+    try:
+        await asyncio.gather(*(virtual_user(vu) for vu in range(users)))
+    finally:
+        elapsed = time.perf_counter() - t0
+        await driver.stop()
+    return rec, elapsed
+
+
+async def bulk_run(driver, events: int, body_events: int, concurrency: int,
+                   seed: int) -> Tuple[Recorder, float, int]:
+    """Post ``events`` purchases to /history/bulk as receipts, ``concurrency`` bodies at a time;
+    returns the recorder, the elapsed time and how many events were accepted."""
+    rec = Recorder()
+    await driver.start()
+    try:
+        _, data, _ = await driver.request(API, "GET", "/catalog/search", query={"limit": 200})
+        item_ids = [it["id"] for it in json.loads(data)["items"]]
+        rng = random.Random(seed)
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        bodies, body = [], []
+        while sum(map(len, bodies)) + len(body) < events:
+            uid = f"bulk-{rng.randrange(max(1, events // 5))}"
+            at = (now - timedelta(minutes=rng.randrange(30 * 24 * 60))).isoformat()
+            body += [{"user_id": uid, "item_id": rng.choice(item_ids), "quantity": rng.randint(1, 3),
+                      "price_paid": 2.5, "purchased_at": at} for _ in range(rng.randint(1, 8))]
+            if len(body) >= body_events:
+                bodies.append(body)
+                body = []
+        if body:
+            bodies.append(body)
+        # a real client's payload isn't in the server's heap; keep full collections from scanning it
+        gc.freeze()
+
+        accepted = 0
+        pending = iter(bodies)
+
+        async def poster():
+            nonlocal accepted
+            for b in pending:
+                result = await timed(driver, rec, "api POST /history/bulk", API, "POST", "/history/bulk", body=b)
+                accepted += result["accepted"] if result else 0
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(poster() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+    finally:
+        await driver.stop()
+    return rec, elapsed, accepted
+
+
+def pct(sorted_s: List[float], q: float) -> float:
+    return sorted_s[min(len(sorted_s) - 1, int(q * len(sorted_s)))] * 1e3
+
+
+def report(rec: Recorder, elapsed: float, server_round_trips: Optional[int]) -> Dict[str, Any]:
+    rows = []
+    for name in sorted(rec.latencies):
+        lat = sorted(rec.latencies[name])
+        trips = rec.round_trips.get(name)
+        rows.append({
+            "endpoint": name, "requests": len(lat), "errors": rec.errors.get(name, 0), "rps": len(lat) / elapsed,
+            "p50_ms": pct(lat, 0.50), "p95_ms": pct(lat, 0.95), "p99_ms": pct(lat, 0.99),
+            "db_round_trips_per_request": statistics.fmean(trips) if trips else None,
+        })
+    total = sum(r["requests"] for r in rows)
+    profile_requests = sum(r["requests"] for r in rows if r["endpoint"].startswith(PROFILE))
+    summary = {
+        "elapsed_s": elapsed, "requests": total, "errors": sum(r["errors"] for r in rows),
+        "rps": total / elapsed, "flows": rec.flows, "flows_per_s": rec.flows / elapsed,
+    }
+    if server_round_trips is not None and profile_requests:
+        summary["db_round_trips_per_profile_request"] = server_round_trips / profile_requests
+
+    print(f"{'endpoint':<38} {'reqs':>7} {'errs':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'DB trips':>9}")
+    for r in rows:
+        trips = r["db_round_trips_per_request"]
+        print(f"{r['endpoint']:<38} {r['requests']:>7} {r['errors']:>5} {r['rps']:>8.1f} {r['p50_ms']:>8.2f} "
+              f"{r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {'-' if trips is None else f'{trips:.1f}':>9}")
+    print(f"\n{summary['requests']} requests ({summary['errors']} errors) in {elapsed:.1f}s: "
+          f"{summary['rps']:.0f} req/s, {summary['flows_per_s']:.1f} user flows/s")
+    if "db_round_trips_per_profile_request" in summary:
+        print(f"DB round trips per profileapi request: {summary['db_round_trips_per_profile_request']:.1f}")
+    return {"summary": summary, "endpoints": rows}
+
+
+def start_servers(db_path: str, stats_dir: str, workers: int, base_port: int) -> Tuple[List[subprocess.Popen], Dict]:
+    if subprocess.run([sys.executable, "-c", "import uvicorn"], capture_output=True).returncode:
+        sys.exit("--serve needs uvicorn (pip install uvicorn)")
+    env = {**os.environ, "PROFILE_DB": f"sqlite:{db_path}",
+           "STANDIN_STATS_PATH": os.path.join(stats_dir, "standin-{pid}.json")}
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    procs, urls = [], {}
+    for i, (target, module) in enumerate(((PROFILE, "profileapi:app"), (API, "api:app"))):
+        port = base_port + i
+        procs.append(subprocess.Popen([sys.executable, "-m", "uvicorn", module, "--port", str(port),
+                                       "--workers", str(workers), "--log-level", "warning"], cwd=backend, env=env))
+        urls[target] = f"http://127.0.0.1:{port}"
+    for target, path in ((PROFILE, "/health"), (API, "/challenges")):
+        url = urlsplit(urls[target])
+        for _ in range(300):
+            try:
+                conn = http.client.HTTPConnection(url.hostname, url.port, timeout=1)
+                conn.request("GET", path)
+                if conn.getresponse().status == 200:
+                    break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            stop_servers(procs)
+            sys.exit(f"{target} server did not come up on {urls[target]}")
+    return procs, urls
+
+
+def stop_servers(procs: List[subprocess.Popen]):
+    for p in procs:
+        p.send_signal(signal.SIGINT)  # a clean shutdown runs the stand-in's atexit stats dump
+    for p in procs:
+        try:
+            p.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=32, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--visits", type=int, default=3, help="checkouts per user flow")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--serve", action="store_true", help="run both apps under uvicorn and test over HTTP")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers per app with --serve")
+    parser.add_argument("--port", type=int, default=18000, help="first port for --serve")
+    parser.add_argument("--profile-url", help="an already running profileapi")
+    parser.add_argument("--api-url", help="an already running api")
+    parser.add_argument("--db", help="stand-in database file (default: a fresh temporary one)")
+    parser.add_argument("--json", help="also write the report here")
+    parser.add_argument("--bulk", type=int, default=0, metavar="EVENTS",
+                        help="instead of user flows, post this many events to /history/bulk "
+                             "(--users bodies in flight) and report events/s")
+    parser.add_argument("--bulk-body", type=int, default=10_000, help="events per /history/bulk body")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="cartquest-load-")
+    db_path = args.db or os.path.join(workdir, "profile.db")
+    procs: List[subprocess.Popen] = []
+    server_round_trips = None
+    try:
+        if args.profile_url or args.api_url:
+            if not (args.profile_url and args.api_url):
+                sys.exit("give both --profile-url and --api-url")
+            driver = HttpDriver({PROFILE: args.profile_url, API: args.api_url}, args.users)
+        elif args.serve:
+            procs, urls = start_servers(db_path, workdir, args.workers, args.port)
+            driver = HttpDriver(urls, args.users)
+        else:
+            driver = InProcessDriver(db_path)
+        if args.bulk:
+            rec, elapsed, accepted = asyncio.run(bulk_run(driver, args.bulk, args.bulk_body,
+                                                          args.users, args.seed))
+        else:
+            rec, elapsed = asyncio.run(run(driver, args.users, args.duration, args.visits, args.seed))
+        if procs:
+            stop_servers(procs)
+            procs = []
+            server_round_trips = 0
+            for name in os.listdir(workdir):
+                if name.startswith("standin-"):
+                    with open(os.path.join(workdir, name)) as f:
+                        server_round_trips += json.load(f)["round_trips"]
+        result = report(rec, elapsed, server_round_trips)
+        if args.bulk:
+            result["summary"]["events_per_s"] = accepted / elapsed
+            print(f"{accepted} events accepted: {accepted / elapsed:,.0f} events/s")
+    finally:
+        stop_servers(procs)
+        if not args.db:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        result["config"] = {k: v for k, v in vars(args).items() if k != "json"}
+        result["config"]["standin_latency_ms"] = float(os.getenv("STANDIN_LATENCY_MS", "0"))
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=1)
+        print(f"wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Promo sampler benchmark: the old renormalise-after-every-pick loop vs
+weighted_sample_without_replacement, for growing promo pools.
+
+    python -m bench.promo_sampler [--k 2] [--repeat 20]
+"""
+import argparse
+import random
+import time
+from typing import List
+
+from api import weighted_sample_without_replacement
+
+POOL_SIZES = [10, 100, 1_000, 5_000, 20_000]
+
+
+def renormalising_sampler(item_ids: List[str], weights: List[float], k: int, rng: random.Random) -> List[str]:
+    """The promo loop select_items_for_challenge used to run, kept here as the baseline."""
+    total = sum(weights) or 1
+    pool = [(iid, w / total) for iid, w in zip(item_ids, weights)]
+    chosen = []
+    for _ in range(min(k, len(pool))):
+        r = rng.random()
+        acc = 0.0
+        pick = pool[0][0]
+        for iid, p in pool:
+            acc += p
+            if r <= acc:
+                pick = iid
+                break
+        chosen.append(pick)
+        pool = [(iid, p) for iid, p in pool if iid != pick]
+        s = sum(p for _, p in pool) or 1.0
+        pool = [(iid, p / s) for iid, p in pool]
+    return chosen
+
+
+def time_per_call_us(fn, item_ids, weights, k, repeat, seed=0) -> float:
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(item_ids, weights, k, rng)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=2, help="promos drawn per challenge")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    data_rng = random.Random(42)
+    print(f"{'promos':>8} {'renormalise (us)':>18} {'keyed heap (us)':>17} {'keyed us/item':>14}")
+    for n in POOL_SIZES:
+        ids = [f"p{i}" for i in range(n)]
+        weights = [data_rng.randint(1, 500) for _ in range(n)]
+        old = time_per_call_us(renormalising_sampler, ids, weights, args.k, args.repeat)
+        new = time_per_call_us(weighted_sample_without_replacement, ids, weights, args.k, args.repeat)
+        print(f"{n:>8} {old:>18.1f} {new:>17.1f} {new / n:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
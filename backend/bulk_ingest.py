@@ -0,0 +1,149 @@
+"""
+Streaming parsing and chunked validation for bulk uploads.
+
+Bodies are either NDJSON (one JSON object per line) or a single JSON array.
+Records come out as (line, raw) pairs while the body is still arriving, one
+list per piece of body received: for NDJSON ``line`` is the 1-based line
+number and ``raw`` the line's bytes, for an array ``line`` is the 1-based
+element position and ``raw`` the decoded object. validate_chunk then validates a whole chunk in one pydantic call and
+only goes record by record when that chunk has a bad record in it.
+"""
+import codecs
+import json
+import re
+from typing import Any, AsyncIterator, List, Tuple
+
+from pydantic import TypeAdapter, ValidationError
+
+
+_WHITESPACE = re.compile(r"[ \t\r\n]*")
+
+
+class BulkFormatError(ValueError):
+    """The body can't be split into records at all (e.g. a broken JSON array)."""
+
+
+async def ndjson_records(stream: AsyncIterator[bytes]) -> AsyncIterator[List[Tuple[int, bytes]]]:
+    buf = b""
+    line_no = 0
+    async for chunk in stream:
+        *lines, buf = (buf + chunk).split(b"\n")
+        batch = []
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                batch.append((line_no, line))
+        if batch:
+            yield batch
+    if buf.strip():
+        yield [(line_no + 1, buf)]
+
+
+async def json_array_records(stream: AsyncIterator[bytes]) -> AsyncIterator[List[Tuple[int, Any]]]:
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    text, pos, index = "", 0, 0
+    started = finished = False
+
+    def drain(final: bool):
+        nonlocal pos, index, started, finished
+        out = []
+        while not finished:
+            pos = _WHITESPACE.match(text, pos).end()
+            if pos >= len(text):
+                break
+            ch = text[pos]
+            if not started:
+                if ch != "[":
+                    raise BulkFormatError("body must be a JSON array or NDJSON")
+                started = True
+                pos += 1
+            elif ch == "]":
+                finished = True
+                pos += 1
+            elif ch == "," and index:
+                pos += 1
+            else:
+                try:
+                    obj, end = decoder.raw_decode(text, pos)
+                except json.JSONDecodeError as e:
+                    if final:
+                        raise BulkFormatError(f"element {index + 1}: {e.msg}") from None
+                    break  # probably cut off mid-element; wait for more
+                if end == len(text) and not final:
+                    break  # a number could still be growing
+                index += 1
+                out.append((index, obj))
+                pos = end
+        return out
+
+    async for chunk in stream:
+        text = text[pos:] + utf8.decode(chunk)
+        pos = 0
+        batch = drain(final=False)
+        if batch:
+            yield batch
+    text = text[pos:] + utf8.decode(b"", final=True)
+    pos = 0
+    batch = drain(final=True)
+    if batch:
+        yield batch
+    if not finished:
+        raise BulkFormatError("unterminated JSON array")
+    if text[pos:].strip():
+        raise BulkFormatError("trailing data after JSON array")
+
+
+async def records_from_stream(stream: AsyncIterator[bytes],
+                              content_type: str = "") -> AsyncIterator[List[Tuple[int, Any]]]:
+    """NDJSON if the content type says so, otherwise sniffed from the first non-blank byte."""
+    it = stream.__aiter__()
+    head = b""
+    async for chunk in it:
+        head += chunk
+        if head.strip():
+            break
+
+    async def replay():
+        yield head
+        async for chunk in it:
+            yield chunk
+
+    ndjson = "ndjson" in content_type or "jsonl" in content_type or not head.lstrip().startswith(b"[")
+    async for batch in (ndjson_records if ndjson else json_array_records)(replay()):
+        yield batch
+
+
+def _first_error(e: ValidationError) -> str:
+    err = e.errors()[0]
+    loc = ".".join(str(p) for p in err.get("loc", ()))
+    return f"{loc}: {err['msg']}" if loc else err["msg"]
+
+
+def validate_chunk(one: TypeAdapter, many: TypeAdapter,
+                   records: List[Tuple[int, Any]]) -> Tuple[List[Tuple[int, Any]], List[dict]]:
+    """(valid (line, model) pairs, [{line, error}]) for one chunk of records.
+
+    ``one`` validates a single record, ``many`` a list of them.
+    """
+    lines = [line for line, _ in records]
+    raws = [raw for _, raw in records]
+    is_json = bool(raws) and isinstance(raws[0], bytes)
+    try:
+        if is_json:
+            models = many.validate_json(b"[" + b",".join(raws) + b"]")
+        else:
+            models = many.validate_python(raws)
+        # a line holding two objects would shift everything after it
+        if len(models) == len(raws):
+            return list(zip(lines, models)), []
+    except ValidationError:
+        pass
+
+    valid, errors = [], []
+    for line, raw in records:
+        try:
+            valid.append((line, one.validate_json(raw) if is_json else one.validate_python(raw)))
+        except ValidationError as e:
+            errors.append({"line": line, "error": _first_error(e)})
+    return valid, errors
@@ -0,0 +1,97 @@
+"""Catalog models and loading the catalog from a .json, .csv or .parquet file."""
+import csv
+import json
+import os
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "catalog.json")
+
+
+class ChallengeItemModel(BaseModel):
+    id: str
+    name: str
+    category: str
+    location: str
+    points: int
+    price: float
+    isPromo: Optional[bool] = None
+    barcode: Optional[str] = None
+    scanned: Optional[bool] = None
+
+class ChallengeModel(BaseModel):
+    id: str
+    title: str
+    description: str
+    points: int
+    timeRemaining: str
+    color: str
+    items: List[ChallengeItemModel]
+    currentPoints: Optional[int] = None
+    completed: Optional[bool] = None
+
+
+ITEMS_ADAPTER = TypeAdapter(List[ChallengeItemModel])
+CHALLENGE_LIST_ADAPTER = TypeAdapter(List[ChallengeModel])
+
+
+class CatalogFormatError(ValueError):
+    """The file can't be read as a catalog; the message says where."""
+
+
+class CatalogData(NamedTuple):
+    items: Dict[str, ChallengeItemModel]  # item id -> item, in file order
+    challenges: List[ChallengeModel]  # the static challenges served by GET /challenges
+
+
+def _validate(adapter: TypeAdapter, data: Any, path: str):
+    try:
+        return adapter.validate_python(data)
+    except ValidationError as e:
+        err = e.errors()[0]
+        loc = ".".join(str(p) for p in err.get("loc", ()))
+        raise CatalogFormatError(f"{path}: {loc}: {err['msg']} ({e.error_count()} errors)") from None
+
+
+def _rows_to_items(rows: List[Dict[str, Any]], path: str) -> List[ChallengeItemModel]:
+    # CSV cells are strings; pydantic's lax mode turns "100"/"true" into ints/bools
+    cleaned = [{k: v for k, v in row.items() if k and v not in ("", None)} for row in rows]
+    return _validate(ITEMS_ADAPTER, cleaned, path)
+
+
+def load_catalog(path: str) -> CatalogData:
+    """Challenges and items from ``path``; an "items" entry wins over a challenge item with its id."""
+    ext = os.path.splitext(path)[1].lower()
+    challenges: List[ChallengeModel] = []
+    if ext == ".json":
+        with open(path, "rb") as f:
+            try:
+                raw = json.load(f)
+            except json.JSONDecodeError as e:
+                raise CatalogFormatError(f"{path}: {e}") from None
+        if isinstance(raw, list):
+            raw = {"challenges": raw}
+        if not isinstance(raw, dict):
+            raise CatalogFormatError(f"{path}: expected an object or a list of challenges")
+        challenges = _validate(CHALLENGE_LIST_ADAPTER, raw.get("challenges", []), path)
+        items = _validate(ITEMS_ADAPTER, raw.get("items", []), path)
+    elif ext == ".csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            items = _rows_to_items(list(csv.DictReader(f)), path)
+    elif ext in (".parquet", ".pq"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise CatalogFormatError(f"{path}: reading Parquet needs pyarrow") from None
+        items = _rows_to_items(pq.read_table(path).to_pylist(), path)
+    else:
+        raise CatalogFormatError(f"{path}: unsupported catalog format {ext!r}")
+
+    by_id: Dict[str, ChallengeItemModel] = {}
+    for ch in challenges:
+        for it in ch.items:
+            by_id[it.id] = it
+    for it in items:
+        by_id[it.id] = it
+    return CatalogData(by_id, challenges)
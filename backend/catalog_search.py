@@ -0,0 +1,188 @@
+"""
+Inverted indexes over the catalog for GET /catalog/search.
+
+Items are numbered by their position in the catalog. Each posting list is a
+sorted int32 array of positions. There are postings for:
+
+- name tokens: the lowercase alphanumeric runs of the name ("Greek Yogurt" ->
+  "greek", "yogurt"), both as whole words and as every prefix ("g", "gr", ...);
+- category, compared case-insensitively;
+- aisle, parsed from location ("Aisle 10, Left" -> "10"). An item whose
+  location names no aisle can't match an aisle filter;
+- isPromo. An unset flag counts as not a promo.
+
+All name postings share one flat array. A key maps to a slot, and slot k is
+flat[offsets[k]:offsets[k + 1]], a view rather than a copy. This way a 100k-item
+index needs only one dict entry per key, not one numpy object per key.
+
+Name postings are intersected starting from the shortest. Binary search is used
+when one list is much shorter than the other; otherwise a boolean mask over the
+catalog does the job. The category, aisle and promo filters ("facets") also
+keep one small code per item. A facet filter is then a lookup in a table
+indexed by those codes, and it costs O(candidates) no matter how big the
+facet's own postings are. Results come back in catalog order, so offset/limit
+pages stay stable for a given catalog version.
+"""
+import re
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from catalog import ChallengeItemModel
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_AISLE_RE = re.compile(r"\baisle\s*([a-z0-9]+)", re.IGNORECASE)
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def parse_aisle(location: str) -> Optional[str]:
+    m = _AISLE_RE.search(location)
+    return m.group(1).lower() if m else None
+
+
+def _intersect(a: np.ndarray, b: np.ndarray, n: int) -> np.ndarray:
+    """Sorted, unique a and b (positions below n); the smaller one drives."""
+    if len(a) > len(b):
+        a, b = b, a
+    if not len(a) or not len(b):
+        return a[:0]
+    if len(a) * 32 < len(b):
+        # a few binary searches beat touching all of b
+        at = np.searchsorted(b, a)
+        at[at == len(b)] = 0
+        return a[b[at] == a]
+    mark = np.zeros(n, dtype=bool)
+    mark[b] = True
+    return a[mark[a]]
+
+
+class _Facet:
+    """Postings per value plus each item's value code (0: none)."""
+
+    def __init__(self, values: List[Optional[Hashable]]):
+        self.code_of: Dict[Hashable, int] = {}
+        codes = np.zeros(len(values), dtype=np.int32)
+        groups: List[List[int]] = [[]]
+        for pos, value in enumerate(values):
+            if value is None:
+                continue
+            code = self.code_of.get(value)
+            if code is None:
+                code = self.code_of[value] = len(groups)
+                groups.append([])
+            codes[pos] = code
+            groups[code].append(pos)
+        self.codes = codes
+        self.postings = [np.array(g, dtype=np.int32) for g in groups]
+
+    def lookup(self, values: Iterable[Hashable]) -> List[int]:
+        return sorted({self.code_of[v] for v in values if v in self.code_of})
+
+    def keep(self, codes: List[int], positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """Boolean mask of the items (all, or just ``positions``) whose value is one of ``codes``."""
+        values = self.codes if positions is None else np.take(self.codes, positions)
+        if len(codes) <= 4:  # a few vectorised compares are cheaper than a gather
+            keep = values == codes[0]
+            for code in codes[1:]:
+                keep |= values == code
+            return keep
+        table = np.zeros(len(self.postings), dtype=bool)
+        table[codes] = True
+        return np.take(table, values)
+
+    def __len__(self):
+        return len(self.code_of)
+
+
+class CatalogSearchIndex:
+    def __init__(self, catalog: Dict[str, ChallengeItemModel]):
+        self.ids: List[str] = list(catalog)
+        self.items = list(catalog.values())
+        slots: Dict[Tuple[str, str], int] = {}  # ("p", prefix) / ("t", token) -> slot
+        slot_positions: List[List[int]] = []
+        for pos, it in enumerate(self.items):
+            keys = set()
+            for token in tokenize(it.name):
+                keys.add(("t", token))
+                for end in range(1, len(token) + 1):
+                    keys.add(("p", token[:end]))
+            for key in keys:  # a set, so a name repeating a word still lists the item once
+                slot = slots.get(key)
+                if slot is None:
+                    slot = slots[key] = len(slot_positions)
+                    slot_positions.append([])
+                slot_positions[slot].append(pos)
+
+        self._slots = slots
+        self._offsets = np.zeros(len(slot_positions) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in slot_positions], out=self._offsets[1:])
+        self._flat = np.fromiter((pos for p in slot_positions for pos in p), dtype=np.int32,
+                                 count=int(self._offsets[-1]))
+        self.categories = _Facet([it.category.casefold() for it in self.items])
+        self.aisles = _Facet([parse_aisle(it.location) for it in self.items])
+        self.promo = _Facet([bool(it.isPromo) for it in self.items])
+        self._empty = np.zeros(0, dtype=np.int32)
+
+    def _name_posting(self, kind: str, token: str) -> np.ndarray:
+        slot = self._slots.get((kind, token))
+        if slot is None:
+            return self._empty
+        return self._flat[self._offsets[slot]:self._offsets[slot + 1]]
+
+    def search(self, q: Optional[str] = None, categories: Optional[List[str]] = None,
+               aisles: Optional[List[str]] = None, is_promo: Optional[bool] = None,
+               whole_words: bool = False) -> np.ndarray:
+        """Sorted positions of the items matching every given filter.
+
+        Each word of ``q`` has to start a word of the name (or be one, with ``whole_words``);
+        a list of categories or aisles matches any of them. A ``q`` with no words in it
+        (only punctuation, say) matches nothing.
+        """
+        n = len(self.ids)
+        kind = "t" if whole_words else "p"
+        names = sorted((self._name_posting(kind, t) for t in dict.fromkeys(tokenize(q or ""))), key=len)
+        facets = []
+        if categories:
+            facets.append((self.categories, self.categories.lookup(c.casefold() for c in categories)))
+        if aisles:
+            facets.append((self.aisles, self.aisles.lookup(a.strip().lower() for a in aisles)))
+        if is_promo is not None:
+            facets.append((self.promo, self.promo.lookup([is_promo])))
+        if (q and not names) or any(not codes for _, codes in facets):
+            return self._empty
+
+        if names:
+            out = names[0]
+            for other in names[1:]:
+                if not len(out):
+                    break
+                out = _intersect(out, other, n)
+        else:
+            # no words: start from a small single-value facet, or else scan every item once
+            singles = sorted((len(facet.postings[codes[0]]), i)
+                             for i, (facet, codes) in enumerate(facets) if len(codes) == 1)
+            if singles and singles[0][0] * 8 < n:
+                facet, codes = facets.pop(singles[0][1])
+                out = facet.postings[codes[0]]
+            else:
+                if not facets:
+                    return np.arange(n, dtype=np.int32)
+                keep = facets[0][0].keep(facets[0][1])
+                for facet, codes in facets[1:]:
+                    keep &= facet.keep(codes)
+                return np.flatnonzero(keep).astype(np.int32)
+        for facet, codes in facets:
+            if not len(out):
+                break
+            out = out[facet.keep(codes, out)]
+        return out
+
+    def page(self, positions: np.ndarray, offset: int, limit: int) -> List[ChallengeItemModel]:
+        return [self.items[p] for p in positions[offset:offset + limit].tolist()]
+
+    def stats(self):
+        return {"items": len(self.ids), "name_keys": len(self._slots), "name_postings": int(self._offsets[-1]),
+                "categories": len(self.categories), "aisles": len(self.aisles)}
@@ -0,0 +1,118 @@
+"""
+Bounded LRU + TTL cache for generated challenges, dropped per user on purchase
+and wholesale on a newer catalog version.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Set, Tuple
+
+
+class ChallengeCache:
+    """Keys are tuples whose first element is the user id."""
+
+    def __init__(self, maxsize: int = 10_000, ttl_seconds: float = 300.0,
+                 clock: Callable[[], float] = time.monotonic, stripes: int = 1024):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()  # key -> (expires_at, value)
+        self._by_user: Dict[Hashable, Set[Tuple]] = {}
+        self._version: Optional[int] = None
+        self._generations = [0] * max(1, stripes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # pushed out by size or TTL
+        self.invalidations = 0  # dropped because of a purchase or a catalog change
+        self.stale_puts = 0  # built from an older catalog or before a purchase; not stored
+
+    def _drop(self, key: Tuple):
+        self._entries.pop(key, None)
+        keys = self._by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[key[0]]
+
+    def _check_version(self, version: int) -> bool:
+        """Move on to a newer catalog version; False for one older than the current."""
+        if self._version is None or version > self._version:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_user.clear()
+            self._version = version
+        return version == self._version
+
+    def _stripe(self, user_id: Hashable) -> int:
+        return hash(user_id) % len(self._generations)
+
+    def generation(self, user_id: Hashable) -> int:
+        """Read before generating a challenge for ``user_id``; hand the value to put. Kept per
+        stripe of users, so a purchase by another user on the stripe just costs one put."""
+        return self._generations[self._stripe(user_id)]
+
+    def get(self, key: Tuple, version: int) -> Optional[Any]:
+        with self._lock:
+            if not self._check_version(version):
+                self.misses += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= self._clock():
+                self._drop(key)
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Tuple, version: int, value: Any, generation: Optional[int] = None):
+        """Cache ``value`` unless the catalog or (given ``generation``) the user's history
+        has moved on since it was generated."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if not self._check_version(version) or (
+                    generation is not None and generation != self.generation(key[0])):
+                self.stale_puts += 1
+                return
+            self._entries[key] = (self._clock() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            self._by_user.setdefault(key[0], set()).add(key)
+            while len(self._entries) > self.maxsize:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: Hashable):
+        with self._lock:
+            self._generations[self._stripe(user_id)] += 1
+            for key in self._by_user.pop(user_id, ()):
+                self._entries.pop(key, None)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_user.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl_seconds,
+                "catalog_version": self._version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts,
+            }
@@ -0,0 +1,161 @@
+"""
+Item-to-item co-purchase index, updated incrementally as purchases arrive.
+
+A basket is everything one user bought within ``window_seconds`` of each
+other. Each pair of distinct items in a basket adds 1 to that pair's weight,
+once per basket. Checkouts that post item by item to /history and receipts
+posted all at once to /history/bulk count the same way. Every item keeps at
+most ``capacity`` partners. When an item goes over, its partners are pruned
+to the ``top_n`` heaviest, so memory is bounded by items x capacity no
+matter how much traffic arrives. A pair seen once can be pruned before it
+comes round again. Pairs that keep coming back win.
+
+Neighbours are ranked by cosine similarity over baskets,
+w(a, b) / sqrt(n(a) * n(b)), where n counts the baskets an item was in. Raw
+counts would pair everything with the best sellers. Each item's top list is
+computed the first time it is needed and cached until one of its pairs
+changes. ``related`` expands a user's few purchases into scored neighbours
+in O(seeds x top_n), whatever the catalog size.
+
+Writers are serialised by the index's own lock (api.py also calls it under
+_POPULARITY_LOCK). Readers take the lock only to rebuild a stale top list.
+"""
+import heapq
+import math
+import threading
+from collections import deque
+from operator import itemgetter
+from typing import Deque, Dict, Iterable, Tuple
+
+from event_log import Row
+
+Neighbours = Tuple[Tuple[str, float], ...]  # (item_id, similarity), best first
+
+# forget the open baskets of users idle for a window, every this many purchases
+_SWEEP_EVERY = 4096
+
+
+class CoPurchaseIndex:
+    def __init__(self, top_n: int = 20, capacity: int = 0, window_seconds: float = 3600.0,
+                 max_basket: int = 32):
+        self.top_n = top_n
+        self.capacity = capacity or 4 * top_n
+        self.window_seconds = window_seconds
+        self.max_basket = max_basket
+        self._lock = threading.Lock()
+        self._pairs: Dict[str, Dict[str, int]] = {}  # item -> partner -> baskets with both
+        self._baskets_with: Dict[str, int] = {}  # item -> baskets containing it
+        self._top: Dict[str, Neighbours] = {}
+        # user -> (ts, item) of their open basket, oldest first
+        self._open: Dict[str, Deque[Tuple[float, str]]] = {}
+        self._latest_ts = float("-inf")
+        self._since_sweep = 0
+        self.n_pairs = 0
+        self.pruned = 0
+
+    def __len__(self) -> int:
+        return len(self._pairs)
+
+    def add_rows(self, rows: Iterable[Row]):
+        """(user_id, item_id, quantity, price_paid, epoch seconds) rows; a PURCHASE_LISTENERS callback."""
+        with self._lock:
+            for user_id, item_id, _quantity, _price, ts in rows:
+                self._add(user_id, item_id, ts)
+            if self._since_sweep >= _SWEEP_EVERY:
+                self._sweep()
+
+    def _add(self, user_id: str, item_id: str, ts: float):
+        basket = self._open.get(user_id)
+        if basket is None:
+            basket = self._open[user_id] = deque(maxlen=self.max_basket)
+        window = self.window_seconds
+        while basket and basket[0][0] < ts - window:
+            basket.popleft()
+        partners = set()
+        for t, other in basket:
+            if other == item_id:
+                return  # already in this basket, and already paired with everything in it
+            if abs(ts - t) <= window:  # a late, out-of-order row may sit in an old basket
+                partners.add(other)
+        basket.append((ts, item_id))
+        self._baskets_with[item_id] = self._baskets_with.get(item_id, 0) + 1
+        pairs, drop_top = self._pairs, self._top.pop
+        drop_top(item_id, None)
+        if partners:
+            mine = pairs.get(item_id)
+            if mine is None:
+                mine = pairs[item_id] = {}
+            for other in partners:
+                # both directions of the pair, inlined: this is the bulk-ingest hot loop
+                n = mine.get(other)
+                mine[other] = 1 if n is None else n + 1
+                if n is None:
+                    self.n_pairs += 1
+                    if len(mine) > self.capacity:
+                        mine = self._prune(item_id)
+                theirs = pairs.get(other)
+                if theirs is None:
+                    theirs = pairs[other] = {}
+                n = theirs.get(item_id)
+                theirs[item_id] = 1 if n is None else n + 1
+                drop_top(other, None)
+                if n is None:
+                    self.n_pairs += 1
+                    if len(theirs) > self.capacity:
+                        self._prune(other)
+        if ts > self._latest_ts:
+            self._latest_ts = ts
+        self._since_sweep += 1
+
+    def _prune(self, a: str) -> Dict[str, int]:
+        """Cut ``a``'s partners down to the top_n heaviest; returns the new partner dict."""
+        partners = self._pairs[a]
+        kept = self._pairs[a] = dict(heapq.nlargest(self.top_n, partners.items(), key=itemgetter(1)))
+        dropped = len(partners) - len(kept)
+        self.n_pairs -= dropped
+        self.pruned += dropped
+        return kept
+
+    def _sweep(self):
+        horizon = self._latest_ts - self.window_seconds
+        self._open = {u: b for u, b in self._open.items() if b and b[-1][0] >= horizon}
+        self._since_sweep = 0
+
+    def neighbours(self, item_id: str) -> Neighbours:
+        """Up to top_n items most often bought with ``item_id``, by similarity."""
+        top = self._top.get(item_id)
+        if top is not None:
+            return top
+        with self._lock:
+            partners = self._pairs.get(item_id)
+            if not partners:
+                return ()
+            counts = self._baskets_with
+            n = counts.get(item_id, 1)
+            sims = ((other, w / math.sqrt(n * counts.get(other, 1))) for other, w in partners.items())
+            top = self._top[item_id] = tuple(heapq.nlargest(self.top_n, sims, key=itemgetter(1)))
+        return top
+
+    def related(self, seeds: Dict[str, float], max_seeds: int = 10) -> Dict[str, float]:
+        """item -> sum of seed weight x similarity, over the ``max_seeds`` heaviest seeds with partners.
+
+        ``seeds`` is e.g. a user's affinity; the result is empty for an empty index.
+        """
+        pairs = self._pairs
+        if not pairs or not seeds:
+            return {}
+        # seeds without partners add nothing; dropping them first keeps nlargest small
+        weighted = [(iid, w) for iid, w in seeds.items() if w > 0 and iid in pairs]
+        if len(weighted) > max_seeds:
+            weighted = heapq.nlargest(max_seeds, weighted, key=itemgetter(1))
+        out: Dict[str, float] = {}
+        get, cached = out.get, self._top.get
+        for item_id, weight in weighted:
+            for other, sim in cached(item_id) or self.neighbours(item_id):
+                out[other] = get(other, 0.0) + weight * sim
+        return out
+
+    def stats(self) -> Dict[str, float]:
+        return {"items": len(self._pairs), "pairs": self.n_pairs, "pruned_pairs": self.pruned,
+                "open_baskets": len(self._open), "top_n": self.top_n, "capacity": self.capacity,
+                "window_seconds": self.window_seconds}
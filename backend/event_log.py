@@ -0,0 +1,324 @@
+"""Durable purchase log (CRC-checked segments, group commit) and snapshots of the in-memory state."""
+try:
+    import fcntl
+except ImportError:  # not on Windows; the log then can't tell a second writer is there
+    fcntl = None
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import zlib
+from array import array
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+Row = Tuple[str, str, int, float, float]  # user_id, item_id, quantity, price_paid, epoch seconds
+
+_RECORD = struct.Struct("<IHHifd")
+_BODY = struct.Struct("<HHifd")
+_CRC = struct.Struct("<I")
+_SNAPSHOT_MAGIC = b"CQSNAP01"
+SNAPSHOT_NAME = "snapshot.bin"
+LOCK_NAME = "writer.lock"
+
+
+class EventLogLocked(RuntimeError):
+    """Another process is already writing the log directory."""
+
+
+def _segment_path(directory: str, segment: int) -> str:
+    return os.path.join(directory, f"{segment:08d}.log")
+
+
+def encode_rows(rows: List[Row]) -> bytearray:
+    """The rows' log records; raises ValueError for a row a record can't hold, having encoded nothing."""
+    out = bytearray()
+    pack_body, pack_crc, crc32 = _BODY.pack, _CRC.pack, zlib.crc32
+    for n, (user_id, item_id, quantity, price, ts) in enumerate(rows, 1):
+        u, i = user_id.encode(), item_id.encode()
+        try:
+            body = pack_body(len(u), len(i), quantity, price, ts) + u + i
+        except (struct.error, OverflowError) as e:
+            raise ValueError(f"row {n} can't be logged: {e}") from None
+        out += pack_crc(crc32(body))
+        out += body
+    return out
+
+
+def decode_segment(data, start: int = 0) -> Tuple[List[Row], int]:
+    """(rows, offset just past the last intact record)."""
+    rows: List[Row] = []
+    pos, end = start, len(data)
+    head = _RECORD.size
+    while pos + head <= end:
+        crc, ulen, ilen, quantity, price, ts = _RECORD.unpack_from(data, pos)
+        stop = pos + head + ulen + ilen
+        if stop > end or zlib.crc32(data[pos + 4:stop]) != crc:
+            break
+        u0 = pos + head
+        rows.append((bytes(data[u0:u0 + ulen]).decode(), bytes(data[u0 + ulen:stop]).decode(),
+                     quantity, price, ts))
+        pos = stop
+    return rows, pos
+
+
+class EventLog:
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._cond = threading.Condition(threading.Lock())
+        self._buf = bytearray()
+        self._appended = 0  # records handed to append()
+        self._durable = 0  # records known to be fsynced
+        self._flushing = False
+        self._file = None
+        self._lock_file = None
+        existing = self.segments()
+        self.segment = existing[-1] if existing else 1
+
+    def segments(self) -> List[int]:
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                      if name.endswith(".log") and name[:-4].isdigit())
+
+    def replay(self, from_segment: int = 0, batch_size: int = 10_000,
+               repair: bool = True) -> Iterator[List[Row]]:
+        """Rows from every segment >= from_segment, oldest first; a torn tail is truncated away
+        (only skipped with repair=False, e.g. when reading a log another process is appending to)."""
+        for segment in self.segments():
+            if segment < from_segment:
+                continue
+            path = _segment_path(self.directory, segment)
+            with open(path, "rb") as f:
+                data = f.read()
+            rows, good = decode_segment(data)
+            if repair and good < len(data):
+                with open(path, "r+b") as f:
+                    f.truncate(good)
+            for i in range(0, len(rows), batch_size):
+                yield rows[i:i + batch_size]
+
+    def lock(self):
+        """Become the directory's only writer; EventLogLocked if another process already is.
+        Held until close(); take it before a repairing replay(), open() takes it otherwise."""
+        if self._lock_file is not None or fcntl is None:
+            return
+        f = open(os.path.join(self.directory, LOCK_NAME), "a+b")
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            raise EventLogLocked(
+                f"{self.directory} is already being written by another process; "
+                "give each worker its own EVENT_LOG_DIR or run them behind an ingest server") from None
+        self._lock_file = f
+
+    def open(self):
+        self.lock()
+        self._file = open(_segment_path(self.directory, self.segment), "ab")
+
+    def append(self, rows: List[Row], encoded: Optional[bytes] = None) -> int:
+        """Buffer rows (``encoded`` = encode_rows(rows) if the caller already has it); returns the
+        sequence number to hand to sync(). Encoding happens before the shared buffer is touched,
+        so a bad row can't leave the rows before it to be fsynced."""
+        if encoded is None:
+            encoded = encode_rows(rows)
+        with self._cond:
+            self._buf += encoded
+            self._appended += len(rows)
+            return self._appended
+
+    def _write_buffered(self):
+        """Called with the lock held and no flush in progress."""
+        buf, self._buf = self._buf, bytearray()
+        target, f = self._appended, self._file
+        self._flushing = True
+        self._cond.release()
+        try:
+            f.write(buf)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            self._cond.acquire()
+            self._flushing = False
+            self._cond.notify_all()
+        self._durable = max(self._durable, target)
+
+    def sync(self, seq: int):
+        """Block until record ``seq`` is on disk, fsyncing for everyone else waiting too."""
+        with self._cond:
+            while self._durable < seq:
+                if self._flushing:
+                    self._cond.wait()
+                else:
+                    self._write_buffered()
+
+    def roll(self) -> int:
+        """Make everything so far durable and start a new segment; returns the new segment id."""
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            self._write_buffered()
+            self._file.close()
+            self.segment += 1
+            self.open()
+            return self.segment
+
+    def drop_segments_before(self, segment: int):
+        for old in self.segments():
+            if old < segment:
+                os.remove(_segment_path(self.directory, old))
+
+    def close(self):
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            if self._file is not None:
+                self._write_buffered()
+                self._file.close()
+                self._file = None
+            if self._lock_file is not None:
+                self._lock_file.close()  # releases the flock
+                self._lock_file = None
+
+
+# --- Snapshots ---
+
+def capture_snapshot(segment: int, store, popularity: Dict[str, int],
+                     affinity: Dict[str, Dict[float, object]],
+                     half_lives: Tuple[float, ...]) -> Tuple[bytes, Dict[str, array]]:
+    """Copy the derived state into (header, sections) for save_snapshot; the copy shares nothing
+    with the containers, so they can change again as soon as this returns.
+
+    ``store`` is an event_store.EventStore; ``affinity`` maps user -> half-life ->
+    DecayedAffinity (anything with ``ref`` and ``scores``).
+    """
+    item_index = dict(store.item_index)
+    items = list(store.item_ids)
+
+    def intern(iid: str) -> int:
+        idx = item_index.get(iid)
+        if idx is None:
+            idx = item_index[iid] = len(items)
+            items.append(iid)
+        return idx
+
+    users = list(store)
+    users += [u for u in affinity if u not in store]
+    sections: Dict[str, array] = {
+        "pop_item": array("i", (intern(i) for i in popularity)),
+        "pop_count": array("q", popularity.values()),
+        "hist_offsets": array("q", [0]),
+        "hist_compacted": array("q"),
+        "hist_item": array("i"), "hist_qty": array("i"), "hist_price": array("f"), "hist_ts": array("q"),
+    }
+    for u in users:
+        events = store.get(u)
+        if events is not None:
+            sections["hist_item"].extend(events.item_idx)
+            sections["hist_qty"].extend(events.quantity)
+            sections["hist_price"].extend(events.price)
+            sections["hist_ts"].extend(events.ts)
+        sections["hist_offsets"].append(len(sections["hist_ts"]))
+        sections["hist_compacted"].append(events.compacted_len if events is not None else 0)
+    for k, hl in enumerate(half_lives):
+        refs, offsets, aff_items, scores = array("d"), array("q", [0]), array("i"), array("d")
+        for u in users:
+            aff = affinity.get(u, {}).get(hl)
+            refs.append(math.nan if aff is None or aff.ref is None else aff.ref)
+            if aff is not None:
+                aff_items.extend(intern(i) for i in aff.scores)
+                scores.extend(aff.scores.values())
+            offsets.append(len(scores))
+        sections.update({f"aff{k}_ref": refs, f"aff{k}_offsets": offsets,
+                         f"aff{k}_item": aff_items, f"aff{k}_score": scores})
+
+    layout, offset = {}, 0
+    for name, arr in sections.items():
+        layout[name] = [offset, arr.typecode, len(arr)]
+        offset += len(arr) * arr.itemsize
+        offset += -offset % 8
+    header = json.dumps({"segment": segment, "items": items, "users": users,
+                         "half_lives": list(half_lives), "sections": layout}).encode()
+    return header, sections
+
+
+def save_snapshot(path: str, captured: Tuple[bytes, Dict[str, array]]):
+    """Write a capture_snapshot() result atomically (tmp file + rename)."""
+    header, sections = captured
+    layout = json.loads(header)["sections"]
+    base = len(_SNAPSHOT_MAGIC) + 8 + len(header)
+    base += -base % 8
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_SNAPSHOT_MAGIC + struct.pack("<Q", len(header)) + header)
+        f.write(b"\0" * (base - f.tell()))
+        for name, arr in sections.items():
+            f.write(b"\0" * (base + layout[name][0] - f.tell()))
+            arr.tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def write_snapshot(path: str, segment: int, store, popularity: Dict[str, int],
+                   affinity: Dict[str, Dict[float, object]], half_lives: Tuple[float, ...]):
+    save_snapshot(path, capture_snapshot(segment, store, popularity, affinity, half_lives))
+
+
+def load_snapshot(path: str, store, popularity: Dict[str, int],
+                  affinity: Dict[str, Dict[float, object]],
+                  make_affinity: Callable[[float], object]) -> Optional[int]:
+    """Fill the (empty) containers from a snapshot; returns its segment, or None if there is none."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm[:len(_SNAPSHOT_MAGIC)] != _SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a snapshot")
+        (hlen,) = struct.unpack_from("<Q", mm, len(_SNAPSHOT_MAGIC))
+        start = len(_SNAPSHOT_MAGIC) + 8
+        header = json.loads(mm[start:start + hlen])
+        base = start + hlen
+        base += -base % 8
+        view = memoryview(mm)
+        opened: List[memoryview] = []
+        try:
+            def section(name: str) -> memoryview:
+                off, typecode, count = header["sections"][name]
+                size = array(typecode).itemsize
+                raw = view[base + off:base + off + count * size]
+                opened.extend((raw, raw.cast(typecode)))
+                return opened[-1]
+
+            items, users = header["items"], header["users"]
+            for idx, count in zip(section("pop_item"), section("pop_count")):
+                popularity[items[idx]] = count
+
+            store.item_ids[:] = items
+            store.item_index.clear()
+            store.item_index.update((iid, i) for i, iid in enumerate(items))
+            offsets, compacted = section("hist_offsets"), section("hist_compacted")
+            cols = [section(n) for n in ("hist_item", "hist_qty", "hist_price", "hist_ts")]
+            for u, user_id in enumerate(users):
+                a, b = offsets[u], offsets[u + 1]
+                if b > a:
+                    store.load_user(user_id, *(c[a:b].tobytes() for c in cols), compacted_len=compacted[u])
+
+            for k, hl in enumerate(header["half_lives"]):
+                refs, aff_off = section(f"aff{k}_ref"), section(f"aff{k}_offsets")
+                aff_items, scores = section(f"aff{k}_item"), section(f"aff{k}_score")
+                for u, user_id in enumerate(users):
+                    if math.isnan(refs[u]):
+                        continue
+                    a, b = aff_off[u], aff_off[u + 1]
+                    aff = make_affinity(hl)
+                    aff.ref = refs[u]
+                    aff.scores = dict(zip([items[i] for i in aff_items[a:b]], scores[a:b].tolist()))
+                    affinity.setdefault(user_id, {})[hl] = aff
+        finally:
+            # every view into the map has to go before the map can close
+            for v in reversed(opened):
+                v.release()
+            view.release()
+    return header["segment"]
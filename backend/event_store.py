@@ -0,0 +1,215 @@
+"""
+Compact per-user purchase history.
+
+Each user's events live in four typed arrays (interned item id int32, quantity
+int32, price float32, epoch-second timestamp int64) instead of a list of
+PurchaseEvent models, about 20 bytes per event instead of several hundred.
+Events whose decay weight has fallen below ``min_weight`` under
+``half_life_days`` are compacted away as the user's history grows, and no user
+keeps more than ``max_events_per_user`` events.
+"""
+import math
+import struct
+import threading
+import time
+from array import array
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+
+class StoredEvent(NamedTuple):
+    """What iterating a user's history yields; duck-types PurchaseEvent for scoring."""
+    user_id: str
+    item_id: str
+    quantity: int
+    price_paid: float
+    purchased_at: datetime  # naive UTC
+
+
+_EPOCH = datetime(1970, 1, 1)
+# one event as the four columns store it; packing it first rejects a value a column can't hold
+# before any column has changed, so they can't fall out of step
+_EVENT = struct.Struct("<iifq")
+MAX_QUANTITY = 2 ** 31 - 1  # int32 column
+MAX_PRICE = 3.4028234663852886e38  # float32 column
+
+
+def epoch_timestamp(ts: datetime) -> float:
+    """Seconds since the Unix epoch; naive datetimes are taken as UTC."""
+    return ts.timestamp() if ts.tzinfo is not None else (ts - _EPOCH).total_seconds()
+
+
+def epoch_seconds(ts: datetime) -> int:
+    """Whole seconds since the Unix epoch; naive datetimes are taken as UTC."""
+    return math.floor(epoch_timestamp(ts))
+
+
+class UserEvents:
+    """One user's events as parallel arrays, oldest first in arrival order."""
+
+    __slots__ = ("store", "user_id", "item_idx", "quantity", "price", "ts", "compacted_len")
+
+    def __init__(self, store: "EventStore", user_id: str):
+        self.store = store
+        self.user_id = user_id
+        self.item_idx = array("i")
+        self.quantity = array("i")
+        self.price = array("f")
+        self.ts = array("q")
+        self.compacted_len = 0
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def __iter__(self) -> Iterator[StoredEvent]:
+        item_ids = self.store.item_ids
+        for i in range(len(self.ts)):
+            yield StoredEvent(
+                self.user_id, item_ids[self.item_idx[i]], self.quantity[i], self.price[i],
+                datetime.fromtimestamp(self.ts[i], timezone.utc).replace(tzinfo=None),
+            )
+
+    def append(self, item_idx: int, quantity: int, price: float, ts: int):
+        """Raises struct.error or OverflowError, with nothing appended, for an out-of-range value."""
+        _EVENT.pack(item_idx, quantity, price, ts)
+        self.item_idx.append(item_idx)
+        self.quantity.append(quantity)
+        self.price.append(price)
+        self.ts.append(ts)
+
+    def extend(self, item_idx: List[int], quantity: List[int], price: List[float], ts: List[int]):
+        """append() for many events; nothing is appended if any of them is out of range."""
+        pack = _EVENT.pack
+        for event in zip(item_idx, quantity, price, ts):
+            pack(*event)
+        self.item_idx.extend(item_idx)
+        self.quantity.extend(quantity)
+        self.price.extend(price)
+        self.ts.extend(ts)
+
+    def keep(self, mask: List[bool]):
+        for name in ("item_idx", "quantity", "price", "ts"):
+            old = getattr(self, name)
+            setattr(self, name, array(old.typecode, (v for v, k in zip(old, mask) if k)))
+
+    def nbytes(self) -> int:
+        return sum(a.itemsize * a.buffer_info()[1] for a in (self.item_idx, self.quantity, self.price, self.ts))
+
+
+class EventStore(Mapping):
+    """user_id -> UserEvents, with item ids interned store-wide.
+
+    Appends for different users may run concurrently; callers serialise each
+    user's own appends and reads (api.py does it with striped locks).
+    """
+
+    def __init__(self, half_life_days: float = 90.0, min_weight: float = 1e-3,
+                 max_events_per_user: int = 10_000, compact_min_events: int = 64):
+        self.half_life_days = half_life_days
+        self.min_weight = min_weight
+        self.max_events_per_user = max_events_per_user
+        self.compact_min_events = compact_min_events
+        self.item_ids: List[str] = []
+        self.item_index: Dict[str, int] = {}
+        self._users: Dict[str, UserEvents] = {}
+        self.total_events = 0
+        self.compacted_events = 0
+        self._lock = threading.Lock()  # item interning and the counters
+
+    # Mapping
+    def __getitem__(self, user_id: str) -> UserEvents:
+        return self._users[user_id]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._users)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def intern_item(self, item_id: str) -> int:
+        idx = self.item_index.get(item_id)
+        if idx is None:
+            with self._lock:
+                idx = self.item_index.get(item_id)
+                if idx is None:
+                    self.item_ids.append(item_id)
+                    idx = self.item_index[item_id] = len(self.item_ids) - 1
+        return idx
+
+    def append(self, user_id: str, item_id: str, quantity: int, price: float, ts: int):
+        events = self._users.get(user_id)
+        if events is None:
+            events = self._users.setdefault(user_id, UserEvents(self, user_id))
+        events.append(self.intern_item(item_id), quantity, price, ts)
+        with self._lock:
+            self.total_events += 1
+        # amortised O(1): only look again once the history has doubled since the last pass
+        n = len(events)
+        if n >= self.compact_min_events and n >= 2 * events.compacted_len:
+            # not the event's own time: one future-dated event would make the real history look ancient
+            self.compact_user(events, min(ts, math.floor(time.time())))
+
+    def append_rows(self, user_id: str, rows: List[Tuple[str, str, int, float, float]]):
+        """append() for one user's (user_id, item_id, quantity, price, epoch seconds) rows, in order."""
+        events = self._users.get(user_id)
+        if events is None:
+            events = self._users.setdefault(user_id, UserEvents(self, user_id))
+        intern = self.intern_item
+        ts = [math.floor(r[4]) for r in rows]
+        events.extend([intern(r[1]) for r in rows],
+                      [r[2] for r in rows], [r[3] for r in rows], ts)
+        with self._lock:
+            self.total_events += len(rows)
+        n = len(events)
+        if n >= self.compact_min_events and n >= 2 * events.compacted_len:
+            self.compact_user(events, min(max(ts), math.floor(time.time())))
+
+    def load_user(self, user_id: str, item_idx, quantity, price, ts, compacted_len: int = 0):
+        """Install one user's arrays (e.g. from a snapshot), interned against self.item_ids."""
+        events = self._users[user_id] = UserEvents(self, user_id)
+        events.item_idx.frombytes(item_idx)
+        events.quantity.frombytes(quantity)
+        events.price.frombytes(price)
+        events.ts.frombytes(ts)
+        events.compacted_len = compacted_len
+        with self._lock:
+            self.total_events += len(events)
+
+    def compact_user(self, events: UserEvents, now_ts: int) -> int:
+        """Drop the user's events that weigh less than min_weight at now_ts; returns how many."""
+        lam = math.log(2) / (self.half_life_days * 86400.0)
+        # older than the horizon and a single unit is already too light
+        horizon = now_ts + math.log(self.min_weight) / lam if self.min_weight > 0 else -math.inf
+        mask = [ts >= horizon or abs(q) * math.exp(-lam * (now_ts - ts)) >= self.min_weight
+                for ts, q in zip(events.ts, events.quantity)]
+        overflow = sum(mask) - self.max_events_per_user
+        if overflow > 0:  # still too many: drop the earliest-recorded survivors
+            for i, k in enumerate(mask):
+                if overflow <= 0:
+                    break
+                if k:
+                    mask[i] = False
+                    overflow -= 1
+        dropped = len(mask) - sum(mask)
+        if dropped:
+            events.keep(mask)
+            with self._lock:
+                self.total_events -= dropped
+                self.compacted_events += dropped
+        events.compacted_len = len(events)
+        return dropped
+
+    def compact(self, now_ts: int) -> int:
+        """Compact every user; returns the number of events dropped."""
+        return sum(self.compact_user(events, now_ts) for events in self._users.values())
+
+    def memory_report(self) -> Dict[str, int]:
+        payload = sum(e.nbytes() for e in self._users.values())
+        return {
+            "users": len(self._users),
+            "events": self.total_events,
+            "compacted_events": self.compacted_events,
+            "interned_items": len(self.item_ids),
+            "array_bytes": payload,
+        }
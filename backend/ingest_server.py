@@ -0,0 +1,179 @@
+"""
+Single-writer ingest process for running api:app with several workers.
+
+    SHARED_STATE_PATH=/dev/shm/cartquest.state INGEST_SOCKET=/tmp/cartquest-ingest.sock \
+        python ingest_server.py &
+    SHARED_STATE_PATH=/dev/shm/cartquest.state INGEST_SOCKET=/tmp/cartquest-ingest.sock \
+        python -m uvicorn api:app --workers 4
+
+The ingester holds the authoritative state exactly as a single-process api
+would (including EVENT_LOG_DIR durability and snapshots), and after every
+applied batch copies the touched popularity counters and user affinities into
+the shared_state file that the workers read. Workers send purchase batches
+over the Unix socket as length-prefixed event_log records and get an answer
+once the batch is applied (and fsynced, with a log).
+"""
+import os
+import signal
+import socket
+import socketserver
+import struct
+import threading
+from typing import Callable, List, Optional
+
+from event_log import Row, decode_segment, encode_rows
+from shared_state import SharedStateFull
+
+_LEN = struct.Struct("<I")
+_REPLY = struct.Struct("<BI")  # status, message length
+# reply statuses; a rejected batch was neither applied nor logged
+_OK, _FAILED, _REJECTED, _FULL = range(4)
+
+
+def _read_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("ingest connection closed")
+        buf += chunk
+    return bytes(buf)
+
+
+class IngestClient:
+    """Worker side: one connection per thread, reconnecting after errors."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _sock(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+            self._local.sock = sock
+        return sock
+
+    def send(self, rows: List[Row], encoded: Optional[bytes] = None):
+        """Hand rows (``encoded`` = encode_rows(rows), if already done) to the ingester and
+        wait until they are applied."""
+        body = encode_rows(rows) if encoded is None else encoded
+        sock = self._sock()
+        try:
+            sock.sendall(_LEN.pack(len(body)) + body)
+            status, n = _REPLY.unpack(_read_exact(sock, _REPLY.size))
+            message = _read_exact(sock, n).decode()
+        except OSError:
+            sock.close()
+            self._local.sock = None
+            raise
+        if status == _REJECTED:
+            raise ValueError(message)
+        if status == _FULL:
+            raise SharedStateFull(message)
+        if status:
+            raise RuntimeError(f"ingest failed: {message}")
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                (n,) = _LEN.unpack(_read_exact(self.request, _LEN.size))
+                body = _read_exact(self.request, n)
+            except ConnectionError:
+                return
+            rows, end = decode_segment(body)
+            try:
+                if end != len(body):
+                    raise ValueError("corrupt batch")
+                self.server.apply(rows)
+                reply = _REPLY.pack(_OK, 0)
+            except SharedStateFull as e:
+                message = str(e).encode()
+                reply = _REPLY.pack(_FULL, len(message)) + message
+            except ValueError as e:
+                message = str(e).encode()
+                reply = _REPLY.pack(_REJECTED, len(message)) + message
+            except Exception as e:  # report to the worker, keep serving
+                message = f"{type(e).__name__}: {e}".encode()
+                reply = _REPLY.pack(_FAILED, len(message)) + message
+            self.request.sendall(reply)
+
+
+class IngestServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, apply: Callable[[List[Row]], None]):
+        if os.path.exists(path):
+            os.remove(path)
+        self.apply = apply
+        super().__init__(path, _Handler)
+
+
+def main():
+    import api
+    from shared_state import SharedState
+
+    state_path = os.environ["SHARED_STATE_PATH"]
+    socket_path = os.environ["INGEST_SOCKET"]
+
+    if api.EVENT_LOG_DIR:
+        api.open_event_log(api.EVENT_LOG_DIR)
+        threading.Thread(target=api._snapshot_loop, args=(api._SNAPSHOT_STOP,), daemon=True).start()
+
+    state = SharedState.create(
+        state_path, api.AFFINITY_HALF_LIVES,
+        item_capacity=int(os.getenv("SHARED_STATE_MAX_ITEMS", 1 << 17)),
+        user_capacity=int(os.getenv("SHARED_STATE_MAX_USERS", 1 << 20)),
+        entry_capacity=int(os.getenv("SHARED_STATE_MAX_ENTRIES", 1 << 23)),
+    )
+    with api.ingest_paused():
+        for iid, count in api.STOREWIDE_POPULARITY.items():
+            state.set_popularity(iid, count)
+        for user_id, tracked in api.USER_AFFINITY.items():
+            state.write_user(user_id, tracked, ())
+
+    def mirror(rows: List[Row]):
+        touched = {}
+        for user_id, item_id, *_ in rows:
+            touched.setdefault(user_id, set()).add(item_id)
+        for iid in {r[1] for r in rows}:
+            state.set_popularity(iid, api.STOREWIDE_POPULARITY[iid])
+        for user_id, items in touched.items():
+            state.write_user(user_id, api.USER_AFFINITY[user_id], items)
+
+    # slots promised to batches being applied right now, so concurrent batches can't
+    # together overrun a capacity that each of them fits on its own
+    reserved = [0, 0, 0]
+    reserving = threading.Lock()
+
+    def apply(rows: List[Row]):
+        """Refuse a batch that mirror couldn't publish before it is logged or applied."""
+        needed = state.slots_needed(rows)
+        with reserving:
+            for n, free, held, what in zip(needed, state.slots_free(), reserved, ("item", "user", "affinity entry")):
+                if n > free - held:
+                    raise SharedStateFull(f"{state_path}: no room for {n} more {what} slots")
+            reserved[:] = [r + n for r, n in zip(reserved, needed)]
+        try:
+            api.record_rows(rows)
+        finally:
+            with reserving:
+                reserved[:] = [r - n for r, n in zip(reserved, needed)]
+
+    api.PURCHASE_LISTENERS.append(mirror)
+    server = IngestServer(socket_path, apply)
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    print(f"ingest: {socket_path} -> {state_path}", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        api.close_event_log()
+        state.close()
+
+
+if __name__ == "__main__":
+    main()
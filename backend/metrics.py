@@ -0,0 +1,237 @@
+"""
+Prometheus-style metrics without a client library: counters, gauges, histograms,
+an ASGI middleware for per-route request metrics, and the text exposition format.
+
+Each app keeps its own Registry and serves ``registry.render()`` at /metrics.
+The middleware labels requests by route template ("/users/{user_id}", never
+the raw path), so label sets stay bounded. Requests that match no route share
+the "unmatched" label.
+
+Recording a request costs two perf_counter calls, a bisect over the bucket
+bounds and one uncontended lock, a few microseconds in all. Values are per
+process. With several uvicorn workers, every worker has its own numbers and a
+scrape sees whichever worker answers.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import Response
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield f"{self.name}{_labels(self.labelnames, values)} {_number(child.value)}"
+
+
+class Gauge(Counter):
+    """A value that goes up and down; or, with ``fn``, one read at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def _samples(self):
+        if self.fn is not None:
+            yield f"{self.name} {_number(self.fn())}"
+        else:
+            yield from super()._samples()
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # per bucket, not cumulative; the last one is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect_left(self.bounds, value)  # le is inclusive
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, n in zip((*self.bounds, float("inf")), counts):
+                cumulative += n
+                le = 'le="' + _number(bound) + '"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, values)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add ``metric``; a metric already registered under its name wins (apps may build middleware twice)."""
+        for existing in self.metrics:
+            if existing.name == metric.name:
+                return existing
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (),
+              fn: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, help, labelnames, fn))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> bytes:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode()
+
+    def response(self) -> Response:
+        return Response(content=self.render(), media_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware (no BaseHTTPMiddleware, which costs a task per request)."""
+
+    def __init__(self, app, registry: Registry):
+        self.app = app
+        self.requests = registry.counter("http_requests_total", "HTTP requests by route, method and status.",
+                                         ("method", "route", "status"))
+        self.latency = registry.histogram("http_request_duration_seconds", "Time to the end of the response body.",
+                                          ("method", "route"))
+        self.in_flight = registry.gauge("http_requests_in_flight", "Requests being handled right now.")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        in_flight = self.in_flight.labels()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight.inc()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - t0
+            in_flight.dec()
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            self.requests.labels(method, template, str(status)).inc()
+            self.latency.labels(method, template).observe(elapsed)
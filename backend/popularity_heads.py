@@ -0,0 +1,57 @@
+"""Each category's most popular items, kept in order as purchase counts grow."""
+import heapq
+import threading
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+
+Popularity = Callable[[str, int], int]  # (item_id, default) -> count
+
+
+class PopularityHeads:
+    def __init__(self, pools: Dict[str, List[str]], size: int = 32):
+        """``pools``: category -> item ids in catalog order."""
+        self.size = size
+        self._pools = pools
+        self._category = {iid: cat for cat, ids in pools.items() for iid in ids}
+        self._position = {iid: pos for ids in pools.values() for pos, iid in enumerate(ids)}
+        self._heads: Dict[str, List[str]] = {}
+        self._stamp: Optional[Hashable] = None
+        self._lock = threading.Lock()
+
+    def pool(self, category: str) -> List[str]:
+        return self._pools.get(category, [])
+
+    def _key(self, popularity: Popularity):
+        position = self._position
+        return lambda iid: (-popularity(iid, 0), position[iid])
+
+    def head(self, category: str, popularity: Popularity) -> List[str]:
+        """Up to ``size`` of the category's items, most popular first; treat as read-only."""
+        head = self._heads.get(category)
+        if head is None:
+            with self._lock:
+                head = self._heads.get(category)
+                if head is None:
+                    head = self._heads[category] = heapq.nsmallest(self.size, self.pool(category),
+                                                                   key=self._key(popularity))
+        return head
+
+    def bump(self, item_ids: Iterable[str], popularity: Popularity):
+        """The counts of ``item_ids`` went up."""
+        key = self._key(popularity)
+        with self._lock:
+            for iid in item_ids:
+                cat = self._category.get(iid)
+                head = self._heads.get(cat) if cat is not None else None
+                if head is None:
+                    continue
+                if iid in head or key(iid) < key(head[-1]):
+                    merged = head if iid in head else head + [iid]
+                    self._heads[cat] = sorted(merged, key=key)[:self.size]
+
+    def expire(self, stamp: Hashable):
+        """Drop every head if ``stamp`` differs from the last one seen."""
+        if stamp != self._stamp:
+            with self._lock:
+                if stamp != self._stamp:
+                    self._heads = {}
+                    self._stamp = stamp
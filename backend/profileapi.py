@@ -4,17 +4,36 @@ from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
 from datetime import datetime, timezone
-import snowflake.connector
-from snowflake.connector import DictCursor
 import os
+import time
 from contextlib import contextmanager
 import uuid
-from dotenv import load_dotenv
 import json
-
+import logging
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from fast_json import fast_response
+from metrics import MetricsMiddleware, Registry
+import sqlite_standin
+
+try:
+    import snowflake.connector
+    from snowflake.connector import DictCursor
+except ImportError:  # only the local stand-in (PROFILE_DB=sqlite:...) works without the driver
+    snowflake = None
+    DictCursor = sqlite_standin.DictCursor
+
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    load_dotenv = None
 
 # Load environment variables
-load_dotenv()
+if load_dotenv is not None:
+    load_dotenv()
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Grocery Store User Profile API", version="1.0.0")
 
@@ -27,6 +46,17 @@ app.add_middleware(
     allow_headers=["*"],          # e.g. Content-Type
 )
 
+# Request metrics and database timings at /metrics; METRICS=0 turns the middleware off
+METRICS = Registry()
+if os.getenv("METRICS", "1").lower() not in ("0", "false", "no", "off"):
+    app.add_middleware(MetricsMiddleware, registry=METRICS)
+DB_CONNECT_SECONDS = METRICS.histogram("db_connect_seconds", "Time to open a database connection.", ("backend",))
+DB_SESSION_SECONDS = METRICS.histogram("db_session_seconds", "Time a request holds its database connection.",
+                                       ("backend",))
+DB_ERRORS = METRICS.counter("db_errors_total", "Database work that failed and was rolled back.", ("backend",))
+BASKET_FORWARD_ERRORS = METRICS.counter("basket_forward_errors_total",
+                                        "Checkouts that could not be posted to the recommender.")
+
 # Pydantic models for request/response
 class UserProfile(BaseModel):
     user_id: str
@@ -86,20 +116,73 @@ SNOWFLAKE_CONFIG = {
     'schema': os.getenv('SNOWFLAKE_SCHEMA')
 }
 
+# PROFILE_DB=sqlite:<path> swaps Snowflake for a local SQLite stand-in (see sqlite_standin.py)
+PROFILE_DB = os.getenv('PROFILE_DB', '')
+STANDIN_PATH = PROFILE_DB[len('sqlite:'):] if PROFILE_DB.startswith('sqlite:') else None
+
+INTEGRITY_ERRORS = (sqlite_standin.IntegrityError,)
+if snowflake is not None:
+    INTEGRITY_ERRORS += (snowflake.connector.errors.IntegrityError,)
+
 @contextmanager
 def get_snowflake_connection():
     """Context manager for Snowflake database connections"""
     conn = None
+    backend = "snowflake" if STANDIN_PATH is None else "sqlite"
+    start = time.perf_counter()
     try:
-        conn = snowflake.connector.connect(**SNOWFLAKE_CONFIG)
+        if STANDIN_PATH is not None:
+            conn = sqlite_standin.connect(STANDIN_PATH)
+        else:
+            conn = snowflake.connector.connect(**SNOWFLAKE_CONFIG)
+        DB_CONNECT_SECONDS.labels(backend).observe(time.perf_counter() - start)
         yield conn
     except Exception as e:
+        if not isinstance(e, HTTPException):  # a 404 raised mid-query is not a database failure
+            DB_ERRORS.labels(backend).inc()
         if conn:
             conn.rollback()
         raise e
     finally:
         if conn:
             conn.close()
+        DB_SESSION_SECONDS.labels(backend).observe(time.perf_counter() - start)
+
+# With RECOMMENDER_URL set (the api.py service), every checkout is also posted to its
+# /history/bulk, so the recommender's co-purchase index sees whole baskets. Fire and forget:
+# a recommender that is down never fails a checkout.
+RECOMMENDER_URL = os.getenv("RECOMMENDER_URL")
+_BASKET_FORWARDER = ThreadPoolExecutor(max_workers=2, thread_name_prefix="basket") if RECOMMENDER_URL else None
+
+def _post_basket(body: bytes):
+    request = urllib.request.Request(f"{RECOMMENDER_URL.rstrip('/')}/history/bulk", data=body, method="POST",
+                                     headers={"Content-Type": "application/json"})
+    try:
+        urllib.request.urlopen(request, timeout=5).close()
+    except OSError as e:
+        BASKET_FORWARD_ERRORS.inc()
+        logger.warning("basket not forwarded to the recommender: %s", e)
+
+def forward_basket(user_id: str, items: List[LineItem], purchased_at: datetime):
+    if _BASKET_FORWARDER is None or not items:
+        return
+    body = json.dumps([
+        {"user_id": user_id, "item_id": item.id, "quantity": item.quantity, "price_paid": item.price,
+         "purchased_at": purchased_at.isoformat()}
+        for item in items
+    ]).encode()
+    _BASKET_FORWARDER.submit(_post_basket, body)
+
+def row_fields(row: dict) -> dict:
+    """A DictCursor row as model fields: Snowflake returns unquoted column names in upper
+    case (the scripts here read row['USER_ID'], row['RECORD_COUNT']), and VARIANT columns
+    as JSON text (add_consolidated_purchase.py decodes PURCHASES the same way).
+    Already lower-case keys and decoded items pass through; test_connection.py checks
+    real rows against the models."""
+    fields = {k.lower(): v for k, v in row.items()}
+    if isinstance(fields.get('items'), str):
+        fields['items'] = json.loads(fields['items'])
+    return fields
 
 # Database initialization
 def init_database():
@@ -148,6 +231,7 @@ async def root():
 
 # User Profile Management
 @app.post("/users", response_model=UserProfile)
+@fast_response(UserProfile)
 async def create_user(user_data: UserProfileCreate):
     """Create a new user profile"""
     user_id = str(uuid.uuid4())
@@ -173,10 +257,11 @@ async def create_user(user_data: UserProfileCreate):
                 created_at=current_time,
                 updated_at=current_time
             )
-        except snowflake.connector.errors.IntegrityError:
+        except INTEGRITY_ERRORS:
             raise HTTPException(status_code=400, detail="User with this email already exists")
 
 @app.get("/users/{user_id}", response_model=UserProfile)
+@fast_response(UserProfile)
 async def get_user(user_id: str):
     """Get user profile by ID"""
     with get_snowflake_connection() as conn:
@@ -188,9 +273,10 @@ async def get_user(user_id: str):
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        return UserProfile(**user)
+        return UserProfile(**row_fields(user))
 
 @app.put("/users/{user_id}", response_model=UserProfile)
+@fast_response(UserProfile)
 async def update_user(user_id: str, user_data: UserProfileUpdate):
     """Update user profile"""
     with get_snowflake_connection() as conn:
@@ -231,7 +317,7 @@ async def update_user(user_id: str, user_data: UserProfileUpdate):
         # Return updated user
         cursor.execute("SELECT * FROM users WHERE user_id = %s", (user_id,))
         user = cursor.fetchone()
-        return UserProfile(**user)
+        return UserProfile(**row_fields(user))
 
 @app.delete("/users/{user_id}")
 async def delete_user(user_id: str):
@@ -289,6 +375,7 @@ async def update_user_points(user_id: str, points_data: PointsUpdate):
 
 # Purchase History Management
 @app.post("/users/{user_id}/purchases", response_model=Purchase)
+@fast_response(Purchase)
 def create_purchase(user_id: str, purchase_data: PurchaseCreate):
     purchase_id = str(uuid.uuid4())
     current_time = datetime.now(timezone.utc)
@@ -333,6 +420,7 @@ def create_purchase(user_id: str, purchase_data: PurchaseCreate):
                 cursor.execute(sql, params)
                 conn.commit()
 
+        forward_basket(uid, purchase_data.items, ts)
         return Purchase(
             purchase_id=pid,
             user_id=uid,
@@ -347,6 +435,7 @@ def create_purchase(user_id: str, purchase_data: PurchaseCreate):
         raise HTTPException(status_code=500, detail=f"DB error: {e}")
 
 @app.get("/users/{user_id}/purchases", response_model=List[Purchase])
+@fast_response(List[Purchase])
 async def get_purchase_history(user_id: str, limit: int = 50):
     """Get purchase history for a user"""
     with get_snowflake_connection() as conn:
@@ -365,9 +454,10 @@ async def get_purchase_history(user_id: str, limit: int = 50):
         """, (user_id, limit))
         
         purchases = cursor.fetchall()
-        return [Purchase(**purchase) for purchase in purchases]
+        return [Purchase(**row_fields(purchase)) for purchase in purchases]
 
 @app.get("/users/{user_id}/purchases/{purchase_id}", response_model=Purchase)
+@fast_response(Purchase)
 async def get_purchase(user_id: str, purchase_id: str):
     """Get a specific purchase by ID"""
     with get_snowflake_connection() as conn:
@@ -382,7 +472,7 @@ async def get_purchase(user_id: str, purchase_id: str):
         if not purchase:
             raise HTTPException(status_code=404, detail="Purchase not found")
         
-        return Purchase(**purchase)
+        return Purchase(**row_fields(purchase))
 
 # Health check endpoint
 @app.get("/health")
@@ -390,6 +480,11 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "timestamp": datetime.now()}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus text format; values are for this worker process only"""
+    return METRICS.response()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
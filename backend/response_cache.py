@@ -0,0 +1,65 @@
+"""Pre-encoded JSON bodies and ETags for responses that only change with the catalog."""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses the weak comparison: W/"x" matches "x"."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+class EncodedResponseCache:
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[bytes, str]]" = OrderedDict()
+        self._version: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key: Hashable, version: int, build: Callable[[], bytes]) -> Tuple[bytes, str]:
+        """(body, etag) for ``key``, encoding it with ``build()`` on a miss."""
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        body = build()  # outside the lock; two racing misses just encode twice
+        entry = (body, make_etag(body))
+        with self._lock:
+            if version == self._version and self.maxsize > 0:
+                self._entries[key] = entry
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize, "catalog_version": self._version,
+                    "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,316 @@
+"""
+Recommender state shared by several uvicorn worker processes.
+
+One ingest process (ingest_server.py) owns the authoritative in-memory state
+and mirrors storewide popularity and the tracked per-user decayed affinity into
+a memory-mapped file (ideally under /dev/shm). Workers map the same file
+read-only and forward purchases to the ingester over a Unix socket, so there is
+exactly one writer and no cross-process locking.
+
+File layout (little endian, fixed at creation):
+
+    header          int64[16], then float64[MAX_HALF_LIVES] half-lives
+    item_names      KEY_BYTES per item slot, NUL padded
+    popularity      int64 per item slot
+    user_names      KEY_BYTES per user slot
+    user_seq        int64 per user: odd while the writer is changing that user
+    user_head       int32 per user: first affinity entry, -1 if none
+    user_ref        float64 per user x half-life (DecayedAffinity.ref, NaN = unset)
+    entry_item      int32 per entry: item slot
+    entry_next      int32 per entry: next entry of the same user, -1 at the end
+    entry_score     float64 per entry x half-life
+
+Item and user slots are append-only: the writer fills a slot's name, then
+bumps the published count in the header, so a reader that sees the count also
+sees the name. Popularity counts are single aligned 8-byte stores. A user's
+affinity is read under a per-user seqlock: read user_seq, copy, and retry if
+user_seq was odd or has moved on.
+"""
+import math
+import mmap
+import os
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+MAGIC = 0x31304554534D5143  # "CQMSTE01"
+KEY_BYTES = 64
+MAX_HALF_LIVES = 8
+_HEADER_BYTES = 4096
+
+# header slots
+_H_MAGIC, _H_ITEM_CAP, _H_USER_CAP, _H_ENTRY_CAP, _H_N_HALF_LIVES, _H_N_ITEMS, _H_N_USERS, _H_N_ENTRIES = range(8)
+
+
+def _layout(n_half_lives: int, item_cap: int, user_cap: int, entry_cap: int) -> Dict[str, Tuple[int, str, int]]:
+    """name -> (byte offset, typecode, count); every section starts 8-aligned."""
+    sections = [
+        ("item_names", "B", item_cap * KEY_BYTES),
+        ("popularity", "q", item_cap),
+        ("user_names", "B", user_cap * KEY_BYTES),
+        ("user_seq", "q", user_cap),
+        ("user_head", "i", user_cap),
+        ("user_ref", "d", user_cap * n_half_lives),
+        ("entry_item", "i", entry_cap),
+        ("entry_next", "i", entry_cap),
+        ("entry_score", "d", entry_cap * n_half_lives),
+    ]
+    layout, offset = {}, _HEADER_BYTES
+    for name, typecode, count in sections:
+        layout[name] = (offset, typecode, count)
+        offset += count * array(typecode).itemsize
+        offset += -offset % 8
+    layout["_end"] = (offset, "B", 0)
+    return layout
+
+
+class SharedStateFull(RuntimeError):
+    """Ran out of item, user or entry slots; recreate the file with larger capacities."""
+
+
+def check_id(name: str) -> bytes:
+    """The id as stored in a name slot; ValueError if it doesn't fit one."""
+    key = name.encode()
+    if len(key) > KEY_BYTES or not key:
+        raise ValueError(f"ids must be 1-{KEY_BYTES} bytes: {name!r}")
+    return key
+
+
+class SharedState:
+    """A mapped state file. Use create() in the ingester and attach() in workers."""
+
+    def __init__(self, path: str, writable: bool):
+        self.path = path
+        self.writable = writable
+        self._file = open(path, "r+b" if writable else "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        view = memoryview(self._mm)
+        self._views = [view]
+        self._header = self._cast(view, 0, "q", 16)
+        if self._header[_H_MAGIC] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a shared state file")
+        n_hl = self._header[_H_N_HALF_LIVES]
+        self.half_lives: Tuple[float, ...] = tuple(self._cast(view, 128, "d", n_hl))
+        self.item_capacity = self._header[_H_ITEM_CAP]
+        self.user_capacity = self._header[_H_USER_CAP]
+        self.entry_capacity = self._header[_H_ENTRY_CAP]
+        layout = _layout(n_hl, self.item_capacity, self.user_capacity, self.entry_capacity)
+        for name, (offset, typecode, count) in layout.items():
+            if not name.startswith("_"):
+                setattr(self, "_" + name, self._cast(view, offset, typecode, count))
+        # local indexes over the append-only name tables, caught up lazily
+        self._item_ids: List[str] = []
+        self._item_slots: Dict[str, int] = {}
+        self._user_slots: Dict[str, int] = {}
+        self._n_users_seen = 0
+        self._writer_entries: Dict[int, Dict[str, int]] = {}  # user slot -> item -> entry
+
+    def _cast(self, view: memoryview, offset: int, typecode: str, count: int) -> memoryview:
+        raw = view[offset:offset + count * array(typecode).itemsize]
+        typed = raw.cast(typecode)
+        self._views += [raw, typed]
+        return typed
+
+    @classmethod
+    def create(cls, path: str, half_lives: Iterable[float], item_capacity: int = 1 << 17,
+               user_capacity: int = 1 << 20, entry_capacity: int = 1 << 23) -> "SharedState":
+        """Create (or replace) the file and open it for writing. Untouched pages stay sparse."""
+        half_lives = tuple(half_lives)
+        if not 0 < len(half_lives) <= MAX_HALF_LIVES:
+            raise ValueError(f"between 1 and {MAX_HALF_LIVES} half-lives")
+        size = _layout(len(half_lives), item_capacity, user_capacity, entry_capacity)["_end"][0]
+        header = array("q", [0] * 16)
+        header[_H_MAGIC] = MAGIC
+        header[_H_ITEM_CAP], header[_H_USER_CAP], header[_H_ENTRY_CAP] = item_capacity, user_capacity, entry_capacity
+        header[_H_N_HALF_LIVES] = len(half_lives)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.truncate(size)
+            header.tofile(f)
+            array("d", half_lives).tofile(f)
+        os.replace(tmp, path)
+        return cls(path, writable=True)
+
+    @classmethod
+    def attach(cls, path: str, timeout: float = 30.0) -> "SharedState":
+        """Open read-only, waiting up to ``timeout`` seconds for the ingester to create the file."""
+        deadline = time.monotonic() + timeout
+        while not os.path.exists(path):
+            if time.monotonic() > deadline:
+                raise FileNotFoundError(f"no shared state at {path}; is the ingest server running?")
+            time.sleep(0.1)
+        return cls(path, writable=False)
+
+    def close(self):
+        for v in reversed(self._views):
+            v.release()
+        self._views = []
+        self._mm.close()
+        self._file.close()
+
+    # --- name tables ---
+
+    def _name(self, table: memoryview, slot: int) -> str:
+        return bytes(table[slot * KEY_BYTES:(slot + 1) * KEY_BYTES]).rstrip(b"\0").decode()
+
+    def _publish_name(self, table: memoryview, header_slot: int, capacity: int, name: str) -> int:
+        key = check_id(name)
+        slot = self._header[header_slot]
+        if slot >= capacity:
+            raise SharedStateFull(f"{self.path}: all {capacity} slots in use")
+        table[slot * KEY_BYTES:slot * KEY_BYTES + len(key)] = key
+        self._header[header_slot] = slot + 1  # publish after the name is in place
+        return slot
+
+    def _catch_up_items(self):
+        for slot in range(len(self._item_ids), self._header[_H_N_ITEMS]):
+            iid = self._name(self._item_names, slot)
+            self._item_ids.append(iid)
+            self._item_slots[iid] = slot
+
+    def _catch_up_users(self):
+        n = self._header[_H_N_USERS]
+        for slot in range(self._n_users_seen, n):
+            self._user_slots[self._name(self._user_names, slot)] = slot
+        self._n_users_seen = n
+
+    def _item_slot(self, item_id: str, create: bool = False) -> Optional[int]:
+        slot = self._item_slots.get(item_id)
+        if slot is None and len(self._item_ids) < self._header[_H_N_ITEMS]:
+            self._catch_up_items()
+            slot = self._item_slots.get(item_id)
+        if slot is None and create:
+            slot = self._publish_name(self._item_names, _H_N_ITEMS, self.item_capacity, item_id)
+            self._catch_up_items()
+        return slot
+
+    def _user_slot(self, user_id: str, create: bool = False) -> Optional[int]:
+        slot = self._user_slots.get(user_id)
+        if slot is None and self._n_users_seen < self._header[_H_N_USERS]:
+            self._catch_up_users()
+            slot = self._user_slots.get(user_id)
+        if slot is None and create:
+            slot = self._header[_H_N_USERS]
+            if slot < self.user_capacity:  # fresh users start with no entries and no reference time
+                self._user_head[slot] = -1
+                for k in range(len(self.half_lives)):
+                    self._user_ref[slot * len(self.half_lives) + k] = math.nan
+            slot = self._publish_name(self._user_names, _H_N_USERS, self.user_capacity, user_id)
+            self._catch_up_users()
+        return slot
+
+    # --- reads (any process) ---
+
+    def popularity(self, item_id: str, default: int = 0) -> int:
+        slot = self._item_slot(item_id)
+        return default if slot is None else self._popularity[slot]
+
+    def has_user(self, user_id: str) -> bool:
+        return self._user_slot(user_id) is not None
+
+    def user_version(self, user_id: str) -> int:
+        """Changes every time the user's affinity is written; 0 for unknown users."""
+        slot = self._user_slot(user_id)
+        return 0 if slot is None else self._user_seq[slot]
+
+    def user_affinity(self, user_id: str, half_life_days: float) -> Optional[Tuple[float, Dict[str, float]]]:
+        """(reference time in days, item -> stored score) for one tracked half-life, or None.
+
+        Scores are stored the way DecayedAffinity keeps them; multiply by
+        exp(-lam * (now - ref)) to get the value at ``now``.
+        """
+        slot = self._user_slot(user_id)
+        if slot is None:
+            return None
+        n_hl = len(self.half_lives)
+        k = self.half_lives.index(half_life_days)
+        seq, head, refs, items, nxt, scores = (self._user_seq, self._user_head, self._user_ref,
+                                               self._entry_item, self._entry_next, self._entry_score)
+        while True:
+            before = seq[slot]
+            if before & 1:
+                time.sleep(0)
+                continue
+            ref = refs[slot * n_hl + k]
+            raw: List[Tuple[int, float]] = []
+            e, budget = head[slot], self.entry_capacity
+            while e >= 0 and budget:
+                raw.append((items[e], scores[e * n_hl + k]))
+                e = nxt[e]
+                budget -= 1
+            if seq[slot] == before:
+                break
+        if math.isnan(ref):
+            return None
+        if raw and max(i for i, _ in raw) >= len(self._item_ids):
+            self._catch_up_items()
+        item_ids = self._item_ids
+        return ref, {item_ids[i]: s for i, s in raw}
+
+    # --- writes (the ingest process only) ---
+
+    def set_popularity(self, item_id: str, count: int):
+        self._popularity[self._item_slot(item_id, create=True)] = count
+
+    def write_user(self, user_id: str, tracked: Dict[float, object], item_ids: Iterable[str]):
+        """Copy ``item_ids``' scores from the user's DecayedAffinity objects; every score is
+        copied for a half-life whose reference time moved (a rebase rescales them all)."""
+        slot = self._user_slot(user_id, create=True)
+        n_hl = len(self.half_lives)
+        seq = self._user_seq
+        entries = self._writer_entries.setdefault(slot, {})  # so the writer never walks the lists
+        seq[slot] += 1
+        try:
+            for k, hl in enumerate(self.half_lives):
+                aff = tracked.get(hl)
+                if aff is None or aff.ref is None:
+                    continue
+                rebased = self._user_ref[slot * n_hl + k] != aff.ref  # NaN != anything
+                self._user_ref[slot * n_hl + k] = aff.ref
+                for iid in (aff.scores if rebased else item_ids):
+                    e = entries.get(iid)
+                    if e is None:
+                        e = entries[iid] = self._new_entry(slot, iid)
+                    self._entry_score[e * n_hl + k] = aff.scores.get(iid, 0.0)
+        finally:
+            seq[slot] += 1
+
+    def slots_needed(self, rows: Iterable[Tuple]) -> Tuple[int, int, int]:
+        """(items, users, affinity entries) that mirroring these purchase rows would add, at
+        most; ValueError for an id that doesn't fit a name slot. In the writer, whose
+        indexes are always caught up, so this is only lookups."""
+        items, users, entries = set(), set(), set()
+        for user_id, item_id, *_ in rows:
+            check_id(user_id)
+            check_id(item_id)
+            if item_id not in self._item_slots:
+                items.add(item_id)
+            slot = self._user_slots.get(user_id)
+            if slot is None:
+                users.add(user_id)
+            if slot is None or item_id not in self._writer_entries.get(slot, ()):
+                entries.add((user_id, item_id))
+        return len(items), len(users), len(entries)
+
+    def slots_free(self) -> Tuple[int, int, int]:
+        h = self._header
+        return (self.item_capacity - h[_H_N_ITEMS], self.user_capacity - h[_H_N_USERS],
+                self.entry_capacity - h[_H_N_ENTRIES])
+
+    def _new_entry(self, slot: int, item_id: str) -> int:
+        e = self._header[_H_N_ENTRIES]
+        if e >= self.entry_capacity:
+            raise SharedStateFull(f"{self.path}: all {self.entry_capacity} affinity entries in use")
+        self._entry_item[e] = self._item_slot(item_id, create=True)
+        self._entry_next[e] = self._user_head[slot]
+        self._header[_H_N_ENTRIES] = e + 1
+        self._user_head[slot] = e  # linked in only once the entry is complete
+        return e
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "items": self._header[_H_N_ITEMS], "item_capacity": self.item_capacity,
+            "users": self._header[_H_N_USERS], "user_capacity": self.user_capacity,
+            "entries": self._header[_H_N_ENTRIES], "entry_capacity": self.entry_capacity,
+        }
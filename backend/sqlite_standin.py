@@ -0,0 +1,172 @@
+"""
+A local SQLite stand-in for the Snowflake connector, for load tests and offline runs.
+
+profileapi uses it instead of Snowflake when PROFILE_DB=sqlite:<path> is set
+(see get_snowflake_connection). It only covers the SQL profileapi sends, and
+it behaves like the real connector where the app can tell the difference:
+
+- ``%s`` placeholders, and ``cursor(DictCursor)`` rows keyed by UPPERCASE
+  column names;
+- VARIANT columns hold JSON text and come back as strings, as the connector
+  returns them. ``PARSE_JSON(x)`` becomes SQLite's ``json(x)``, and
+  ``CURRENT_TIMESTAMP()`` becomes ``CURRENT_TIMESTAMP``. SQLite accepts
+  Snowflake's column type names as they are;
+- a duplicate key raises ``IntegrityError``, a subclass of sqlite3's.
+
+Every connect, execute and commit counts as one round trip, since each one
+is a round trip to Snowflake. ``STATS`` keeps the counts for this process.
+To count the round trips of a single request, put a list in
+``ROUND_TRIP_SINK`` for that request's context. With STANDIN_STATS_PATH set
+(``{pid}`` is replaced by the process id), the process writes its counts there
+as JSON on exit, so a load test can read them back from servers it started.
+STANDIN_LATENCY_MS adds that much sleep to every round trip, to stand in for
+the network.
+"""
+import atexit
+import contextvars
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, Dict, Optional, Sequence
+
+LATENCY_S = float(os.getenv("STANDIN_LATENCY_MS", "0")) / 1000.0
+STATS_PATH = os.getenv("STANDIN_STATS_PATH")
+
+_REWRITES = [
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\bPARSE_JSON\s*\(", re.IGNORECASE), "json("),
+    (re.compile(r"\bCURRENT_TIMESTAMP\s*\(\s*\)", re.IGNORECASE), "CURRENT_TIMESTAMP"),
+]
+
+
+class IntegrityError(sqlite3.IntegrityError):
+    pass
+
+
+class DictCursor:
+    """Pass to ``connection.cursor()`` for dict rows, like snowflake.connector.DictCursor."""
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.executes = 0
+        self.commits = 0
+
+    def count(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    @property
+    def round_trips(self) -> int:
+        return self.connects + self.executes + self.commits
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {"connects": self.connects, "executes": self.executes, "commits": self.commits,
+                    "round_trips": self.round_trips}
+
+
+STATS = _Stats()
+ROUND_TRIP_SINK: contextvars.ContextVar = contextvars.ContextVar("standin_round_trips", default=None)
+
+
+def _round_trip(field: str):
+    STATS.count(field)
+    sink = ROUND_TRIP_SINK.get()
+    if sink is not None:
+        sink.append(field)
+    if LATENCY_S:
+        time.sleep(LATENCY_S)
+
+
+def translate(sql: str) -> str:
+    for pattern, replacement in _REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def _param(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+class Cursor:
+    def __init__(self, cursor: sqlite3.Cursor, as_dict: bool):
+        self._cursor = cursor
+        self._as_dict = as_dict
+        self._columns = None
+
+    def execute(self, sql: str, params: Optional[Sequence[Any]] = None) -> "Cursor":
+        _round_trip("executes")
+        try:
+            self._cursor.execute(translate(sql), [_param(p) for p in params or ()])
+        except sqlite3.IntegrityError as e:
+            raise IntegrityError(str(e)) from e
+        description = self._cursor.description
+        self._columns = [d[0].upper() for d in description] if description else None
+        return self
+
+    def _row(self, row):
+        if row is None or not self._as_dict:
+            return row
+        return dict(zip(self._columns, row))
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(r) for r in self._cursor.fetchall()]
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Connection:
+    def __init__(self, path: str):
+        _round_trip("connects")
+        # one connection per request, like the app does with Snowflake; WAL lets readers run during writes
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+
+    def cursor(self, cursor_class: Optional[type] = None) -> Cursor:
+        # snowflake.connector.DictCursor too, when the driver is installed
+        return Cursor(self._conn.cursor(), as_dict=getattr(cursor_class, "__name__", None) == "DictCursor")
+
+    def commit(self):
+        _round_trip("commits")
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+def connect(path: str) -> Connection:
+    return Connection(path)
+
+
+def _dump_stats():
+    with open(STATS_PATH.replace("{pid}", str(os.getpid())), "w") as f:
+        json.dump(STATS.snapshot(), f)
+
+
+if STATS_PATH:
+    atexit.register(_dump_stats)
@@ -0,0 +1,105 @@
+"""
+Per-stage timing of the recommender hot path, sampled per request:
+
+    with stage("rank"):
+        ...
+"""
+import contextvars
+import random
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from metrics import Histogram
+
+# stage durations are microseconds to milliseconds, well below the request buckets
+STAGE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+Trace = List[Tuple[str, int]]  # (stage, nanoseconds), in the order the stages finished
+
+_TRACE: contextvars.ContextVar = contextvars.ContextVar("stage_trace", default=None)
+_NO_STAGE = nullcontext()
+
+
+class _Stage:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc):
+        self.trace.append((self.name, time.perf_counter_ns() - self.start))
+        return False
+
+
+def stage(name: str):
+    """Time the ``with`` block as ``name`` if this request is being traced."""
+    trace = _TRACE.get()
+    if trace is None:
+        return _NO_STAGE
+    return _Stage(trace, name)
+
+
+@contextmanager
+def collect() -> Iterator[Trace]:
+    """Trace the stages run inside the block; the list fills in as they finish."""
+    trace: Trace = []
+    token = _TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        _TRACE.reset(token)
+
+
+def totals(trace: Trace) -> Dict[str, Tuple[int, int]]:
+    """stage -> (total ns, times run); batch requests run each stage once per challenge."""
+    out: Dict[str, Tuple[int, int]] = {}
+    for name, ns in trace:
+        total, count = out.get(name, (0, 0))
+        out[name] = (total + ns, count + 1)
+    return out
+
+
+def server_timing(trace: Trace) -> str:
+    """Server-Timing header value, durations in milliseconds."""
+    parts = []
+    for name, (ns, count) in totals(trace).items():
+        part = f"{name};dur={ns / 1e6:.3f}"
+        if count > 1:
+            part += f';desc="x{count}"'
+        parts.append(part)
+    return ", ".join(parts)
+
+
+class StageTimingMiddleware:
+    """Collect stage traces for a sample of HTTP requests; plain ASGI like MetricsMiddleware."""
+
+    def __init__(self, app, histogram: Histogram, sample_rate: float = 1.0, header: bool = False,
+                 rng: Optional[random.Random] = None):
+        self.app = app
+        self.histogram = histogram
+        self.sample_rate = sample_rate
+        self.header = header
+        self._random = (rng or random.Random()).random
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (self.sample_rate < 1.0 and self._random() >= self.sample_rate):
+            await self.app(scope, receive, send)
+            return
+
+        with collect() as trace:
+            async def send_wrapper(message):
+                if self.header and trace and message["type"] == "http.response.start":
+                    headers = [*message.get("headers", ()), (b"server-timing", server_timing(trace).encode())]
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                for name, ns in trace:
+                    self.histogram.labels(name).observe(ns / 1e9)
@@ -0,0 +1,168 @@
+"""
+Store layout model for ordering a challenge's items along a walking route.
+
+``location`` is free text such as "Aisle 8, Left" or "Front Section". It is
+parsed into a point on a simple floor plan:
+
+- aisles run front to back, side by side, with aisle k at x = k * AISLE_SPACING;
+- "Front", "Center" and "Back" give the position along the aisle; "Left" and
+  "Right" give the shelf side, halfway down; an "Endcap" sits at the aisle's
+  front end;
+- a location without an aisle ("Front Section") is on the front wall, next to
+  the entrance and checkout at x = 0.
+
+Aisles connect only through the front and back cross-aisles. Walking between
+two aisles means leaving through one end and coming back in, whichever end is
+shorter. A layout is built once per catalog version. It holds one point per
+distinct parsed location (a few per aisle), so the distance matrix stays
+small even for a 100k-item catalog.
+
+A route is a tour that starts and ends at the entrance. It is built with
+nearest neighbour and then improved with 2-opt, over the distinct points of
+the item set rather than the items themselves. Routes are cached per point
+set, so each distinct set is solved only once.
+"""
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from catalog import ChallengeItemModel
+
+AISLE_SPACING = 3.0  # metres between aisle centre lines
+AISLE_LENGTH = 20.0
+SHELF_OFFSET = 0.6  # a Left/Right shelf is this far off the centre line
+FRONT_DEPTH = 6.0  # front wall (produce, entrance, checkout) to the aisle ends
+
+_AISLE_RE = re.compile(r"\baisle\s*(\d+)", re.IGNORECASE)
+_ALONG = {"front": 0.15, "center": 0.5, "centre": 0.5, "middle": 0.5, "back": 0.85}
+
+Point = Tuple[Optional[int], float, float]  # (aisle or None, x, y); y = 0 is the front end of the aisles
+
+
+def parse_location(location: str) -> Point:
+    words = location.lower()
+    m = _AISLE_RE.search(words)
+    if m is None:
+        return (None, 0.0, -FRONT_DEPTH)
+    aisle = int(m.group(1))
+    x = aisle * AISLE_SPACING
+    if "endcap" in words or "end cap" in words:
+        return (aisle, x, -0.5)
+    along = next((f for w, f in _ALONG.items() if w in words), 0.5)
+    if "left" in words:
+        x -= SHELF_OFFSET
+    elif "right" in words:
+        x += SHELF_OFFSET
+    return (aisle, x, along * AISLE_LENGTH)
+
+
+ENTRANCE: Point = (None, 0.0, -FRONT_DEPTH)
+
+
+def walking_distance(a: Point, b: Point) -> float:
+    (aisle_a, xa, ya), (aisle_b, xb, yb) = a, b
+    dx = abs(xa - xb)
+    if aisle_a == aisle_b:  # same aisle, or both along the front wall
+        return abs(ya - yb) + dx
+    # out of an aisle through either end; the front wall only reaches the front cross-aisle
+    front = max(ya, 0.0) + max(yb, 0.0) + max(-ya, 0.0) + max(-yb, 0.0)
+    if aisle_a is None or aisle_b is None:
+        return front + dx
+    back = (AISLE_LENGTH - ya) + (AISLE_LENGTH - yb)
+    return min(front, back) + dx
+
+
+def tour_length(order: Sequence[int], dist: List[List[float]]) -> float:
+    """Closed tour through ``order`` from point 0 (the entrance) and back."""
+    stops = [0, *order, 0]
+    return sum(dist[a][b] for a, b in zip(stops, stops[1:]))
+
+
+def route(stops: Sequence[int], dist: List[List[float]]) -> List[int]:
+    """Near-shortest order of ``stops`` (point ids, not 0) for a tour from and back to point 0."""
+    left = list(stops)
+    tour = [0]
+    while left:  # nearest neighbour
+        row = dist[tour[-1]]
+        nxt = min(left, key=row.__getitem__)
+        left.remove(nxt)
+        tour.append(nxt)
+    tour.append(0)
+    n = len(tour)
+    improved = True
+    while improved:  # 2-opt: reverse tour[i:j + 1] while that shortens it
+        improved = False
+        for i in range(1, n - 2):
+            a, b = tour[i - 1], tour[i]
+            dab = dist[a][b]
+            for j in range(i + 1, n - 1):
+                c, d = tour[j], tour[j + 1]
+                if dist[a][c] + dist[b][d] < dab + dist[c][d] - 1e-9:
+                    tour[i:j + 1] = tour[i:j + 1][::-1]
+                    b = tour[i]
+                    dab = dist[a][b]
+                    improved = True
+    return tour[1:-1]
+
+
+class StoreLayout:
+    def __init__(self, catalog: Dict[str, ChallengeItemModel], route_cache_size: int = 4096):
+        points: Dict[Point, int] = {}
+        by_location: Dict[str, int] = {}
+        self.point_of: Dict[str, int] = {}
+        for iid, it in catalog.items():
+            p = by_location.get(it.location)
+            if p is None:
+                # point 0 is the entrance, even when a location parses to the same spot
+                p = by_location[it.location] = points.setdefault(parse_location(it.location), len(points) + 1)
+            self.point_of[iid] = p
+        self.points: List[Point] = [ENTRANCE, *points]
+        self.distances = np.array([[walking_distance(a, b) for b in self.points] for a in self.points],
+                                  dtype=np.float32)
+        self._rows: List[List[float]] = self.distances.tolist()  # scalar lookups are faster on lists
+        self.route_cache_size = route_cache_size
+        self._lock = threading.Lock()
+        self._routes: "OrderedDict[Tuple[int, ...], Dict[int, int]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _rank(self, stops: Tuple[int, ...]) -> Dict[int, int]:
+        with self._lock:
+            rank = self._routes.get(stops)
+            if rank is not None:
+                self._routes.move_to_end(stops)
+                self.hits += 1
+                return rank
+            self.misses += 1
+        rank = {p: i for i, p in enumerate(route(stops, self._rows))}  # outside the lock, like ChallengeCache
+        with self._lock:
+            self._routes[stops] = rank
+            while len(self._routes) > self.route_cache_size:
+                self._routes.popitem(last=False)
+        return rank
+
+    def order(self, item_ids: List[str]) -> List[str]:
+        """``item_ids`` in walking order; items at the same spot keep their relative order."""
+        if len(item_ids) < 2:
+            return list(item_ids)
+        point_of = self.point_of
+        stops = tuple(sorted({point_of[iid] for iid in item_ids}))
+        rank = self._rank(stops)
+        return sorted(item_ids, key=lambda iid: rank[point_of[iid]])
+
+    def route_length(self, item_ids: List[str]) -> float:
+        """Length of the tour from the entrance through ``item_ids`` in the given order and back."""
+        stops: List[int] = []
+        for iid in item_ids:
+            p = self.point_of[iid]
+            if not stops or stops[-1] != p:
+                stops.append(p)
+        return tour_length(stops, self._rows)
+
+    def stats(self):
+        with self._lock:
+            return {"points": len(self.points), "routes_cached": len(self._routes),
+                    "hits": self.hits, "misses": self.misses}
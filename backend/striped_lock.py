@@ -0,0 +1,51 @@
+"""
+Lock striping for per-user state.
+
+Users hash onto a fixed number of locks, so purchases for different users
+rarely wait on each other while all of one user's updates stay serialised.
+Batches that touch several users take their stripes in index order, which
+keeps two overlapping batches from deadlocking.
+"""
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List
+
+
+class StripedLock:
+    def __init__(self, stripes: int = 64):
+        self._locks = [threading.Lock() for _ in range(max(1, stripes))]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def stripe(self, key: str) -> int:
+        return hash(key) % len(self._locks)
+
+    def for_key(self, key: str) -> threading.Lock:
+        return self._locks[self.stripe(key)]
+
+    @contextmanager
+    def holding(self, keys: Iterable[str]) -> Iterator[None]:
+        """Hold the stripes of every key (each once, in index order)."""
+        locks: List[threading.Lock] = [self._locks[i] for i in sorted({self.stripe(k) for k in keys})]
+        taken = 0
+        try:
+            for lock in locks:
+                lock.acquire()
+                taken += 1
+            yield
+        finally:
+            for lock in reversed(locks[:taken]):
+                lock.release()
+
+    @contextmanager
+    def holding_all(self) -> Iterator[None]:
+        taken = 0
+        try:
+            for lock in self._locks:
+                lock.acquire()
+                taken += 1
+            yield
+        finally:
+            for lock in reversed(self._locks[:taken]):
+                lock.release()
@@ -10,6 +10,24 @@ from snowflake.connector import DictCursor
 # Load environment variables
 load_dotenv()
 
+def check_row_shape(cursor):
+    """profileapi builds its models from DictCursor rows through row_fields(); check that
+    holds for the rows this connector really returns (upper-case keys, VARIANT as text)"""
+    from profileapi import Purchase, UserProfile, row_fields
+
+    print("\n🔄 Checking DictCursor row shape against profileapi models...")
+    for table, model in (("users", UserProfile), ("purchases", Purchase)):
+        cursor.execute(f"SELECT * FROM {table} LIMIT 1")
+        row = cursor.fetchone()
+        if not row:
+            print(f"⚠️  No rows in {table} to check")
+            continue
+        print(f"  {table} keys: {sorted(row)}")
+        if "ITEMS" in row:
+            print(f"  {table} ITEMS type: {type(row['ITEMS']).__name__}")
+        model(**row_fields(row))
+        print(f"✅ {table} rows load as {model.__name__}")
+
 def test_snowflake_connection():
     """Test the Snowflake connection and basic operations"""
     
@@ -69,6 +87,8 @@ def test_snowflake_connection():
             cursor.execute("SELECT COUNT(*) as user_count FROM users")
             count = cursor.fetchone()
             print(f"✅ Current user count: {count['USER_COUNT']}")
+
+            check_row_shape(cursor)
             
         else:
             print("⚠️  Users table not found. You may need to create it.")
@@ -0,0 +1,20 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """A freshly imported api module, so each test starts from empty in-memory state."""
+    for name in ("EVENT_LOG_DIR", "SHARED_STATE_PATH", "INGEST_SOCKET", "FACTOR_MODEL_PATH"):
+        monkeypatch.delenv(name, raising=False)
+    import api
+    api = importlib.reload(api)
+    yield api
+    api._SNAPSHOT_STOP.set()
+    if api.EVENT_LOG is not None:
+        api.EVENT_LOG.close()
@@ -0,0 +1,23 @@
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+
+
+def test_mixed_template_batches_rank_like_single_template_ones(api):
+    item_ids = list(api.CATALOG)
+    events = [{"user_id": f"user-{n % 6}", "item_id": item_ids[(n * 5) % len(item_ids)], "quantity": 1 + n % 3,
+               "price_paid": 1.0, "purchased_at": f"2026-01-0{1 + n % 9}T00:00:00"} for n in range(90)]
+    with TestClient(api.app) as client:
+        assert client.post("/history/bulk", json=events).status_code == 200
+
+    reqs = [api.BatchChallengeRequest(user_id=f"user-{n % 8}", template_id=tid)
+            for n, tid in enumerate(["health", "bbq", "baking"] * 8)]
+    tpls = [api.TEMPLATES[r.template_id] for r in reqs]
+    index, now = api.current_catalog_index(), datetime(2026, 1, 10)
+    mixed = api.rank_regulars_batch(reqs, tpls, [None] * len(reqs), index, now)
+    for tid in ("health", "bbq", "baking"):
+        picks = [i for i, r in enumerate(reqs) if r.template_id == tid]
+        alone = api.rank_regulars_batch([reqs[i] for i in picks], [tpls[i] for i in picks],
+                                        [None] * len(picks), index, now)
+        assert [mixed[i] for i in picks] == alone
+        assert all(alone)
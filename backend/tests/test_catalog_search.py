@@ -0,0 +1,15 @@
+from catalog import ChallengeItemModel
+from catalog_search import CatalogSearchIndex
+
+
+def item(iid: str, name: str, category: str = "Dairy") -> ChallengeItemModel:
+    return ChallengeItemModel(id=iid, name=name, category=category, location="Aisle 3", points=1, price=1.0)
+
+
+def test_a_query_without_words_matches_nothing():
+    index = CatalogSearchIndex({it.id: it for it in [item("1", "Greek Yogurt"), item("2", "Oat Milk")]})
+    assert index.search("gr").tolist() == [0]
+    assert index.search("!?").tolist() == []
+    assert index.search("--", categories=["dairy"]).tolist() == []
+    assert index.search("", categories=["dairy"]).tolist() == [0, 1]
+    assert index.search().tolist() == [0, 1]
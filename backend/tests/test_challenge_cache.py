@@ -0,0 +1,43 @@
+from challenge_cache import ChallengeCache
+
+
+def test_put_after_invalidate_user_is_dropped():
+    cache = ChallengeCache()
+    key = ("alice", "4")
+    gen = cache.generation("alice")
+    cache.invalidate_user("alice")  # a purchase lands while the challenge is being generated
+    cache.put(key, 1, "stale", gen)
+    assert cache.get(key, 1) is None
+    assert cache.stale_puts == 1
+
+    cache.put(key, 1, "fresh", cache.generation("alice"))
+    assert cache.get(key, 1) == "fresh"
+
+
+def test_invalidate_user_drops_only_that_user():
+    cache = ChallengeCache()
+    cache.put(("alice", "4"), 1, "a")
+    cache.put(("bob", "4"), 1, "b")
+    cache.invalidate_user("alice")
+    assert cache.get(("alice", "4"), 1) is None
+    assert cache.get(("bob", "4"), 1) == "b"
+
+
+def test_newer_catalog_empties_and_older_is_ignored():
+    cache = ChallengeCache()
+    cache.put(("alice", "4"), 1, "v1")
+    assert cache.get(("alice", "4"), 2) is None  # version 2 seen: everything from 1 is gone
+    cache.put(("alice", "4"), 1, "late v1")  # built from the old catalog, finished late
+    assert cache.get(("alice", "4"), 2) is None
+    assert cache.stale_puts == 1
+
+
+def test_ttl_and_size_bound():
+    now = [0.0]
+    cache = ChallengeCache(maxsize=2, ttl_seconds=10, clock=lambda: now[0])
+    for user in ("a", "b", "c"):
+        cache.put((user, "4"), 1, user)
+    assert cache.get(("a", "4"), 1) is None
+    assert cache.get(("c", "4"), 1) == "c"
+    now[0] = 11.0
+    assert cache.get(("c", "4"), 1) is None
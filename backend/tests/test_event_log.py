@@ -0,0 +1,108 @@
+import os
+
+from event_log import EventLog, EventLogLocked, decode_segment, encode_rows
+
+ROWS = [("alice", "milk", 2, 3.5, 1_700_000_000.0), ("bob", "eggs", 1, 4.25, 1_700_000_100.5)]
+
+
+def write_log(directory, rows):
+    log = EventLog(directory)
+    log.open()
+    log.sync(log.append(rows))
+    log.close()
+    return os.path.join(directory, f"{log.segment:08d}.log")
+
+
+def test_encode_decode_round_trip():
+    rows, end = decode_segment(encode_rows(ROWS))
+    assert rows == ROWS
+    assert end == len(encode_rows(ROWS))
+
+
+def test_torn_tail_is_truncated_on_replay(tmp_path):
+    path = write_log(str(tmp_path), ROWS)
+    good = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(encode_rows([("carol", "bread", 1, 2.0, 1_700_000_200.0)])[:-3])  # crashed mid-write
+
+    assert [r for batch in EventLog(str(tmp_path)).replay() for r in batch] == ROWS
+    assert os.path.getsize(path) == good
+
+
+def test_read_only_replay_leaves_a_torn_tail(tmp_path):
+    path = write_log(str(tmp_path), ROWS)
+    with open(path, "ab") as f:
+        f.write(b"\x01\x02")
+    size = os.path.getsize(path)
+
+    assert [r for batch in EventLog(str(tmp_path)).replay(repair=False) for r in batch] == ROWS
+    assert os.path.getsize(path) == size
+
+
+def test_corrupt_record_stops_replay(tmp_path):
+    path = write_log(str(tmp_path), ROWS)
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b"X")  # flips a byte of the last record's item id
+    assert [r for batch in EventLog(str(tmp_path)).replay() for r in batch] == ROWS[:1]
+
+
+def test_bad_row_is_refused_before_anything_is_buffered(tmp_path):
+    log = EventLog(str(tmp_path))
+    log.open()
+    try:
+        encode_rows([ROWS[0], ("x" * 70_000, "milk", 1, 1.0, 0.0)])
+    except ValueError as e:
+        assert "row 2" in str(e)
+    else:
+        raise AssertionError("an oversized user id was encoded")
+    log.close()
+
+
+def test_second_writer_is_refused(tmp_path):
+    first = EventLog(str(tmp_path))
+    first.open()
+    second = EventLog(str(tmp_path))
+    try:
+        second.lock()
+    except EventLogLocked:
+        pass
+    else:
+        raise AssertionError("two writers share one log directory")
+    # a read-only replay doesn't need the lock
+    assert list(second.replay(repair=False)) == []
+    first.close()
+    second.lock()
+    second.close()
+
+
+def test_snapshot_plus_replay_matches_live_state(api, tmp_path):
+    api.open_event_log(str(tmp_path))
+    now = 1_760_000_000.0
+    api.record_rows([(f"u{i % 5}", f"item{i % 7}", 1 + i % 3, 2.5, now + i * 60) for i in range(40)])
+    api.snapshot_state()
+    api.record_rows([(f"u{i % 3}", f"item{i % 4}", 1, 1.25, now + 3600 + i) for i in range(25)])
+    live = state_of(api)
+    assert live[1]  # something was recorded
+
+    api.EVENT_LOG.close()  # a crash: no shutdown snapshot, the newest batch is only in the log
+    api.EVENT_LOG = None
+    assert os.path.exists(os.path.join(str(tmp_path), "snapshot.bin"))
+
+    import importlib
+    restored = importlib.reload(api)
+    restored.open_event_log(str(tmp_path))
+    assert state_of(restored) == live
+
+
+def state_of(api):
+    history = {
+        user_id: ([api.PURCHASE_HISTORY.item_ids[i] for i in events.item_idx], list(events.quantity),
+                  list(events.price), list(events.ts))
+        for user_id, events in api.PURCHASE_HISTORY.items()
+    }
+    affinity = {
+        user_id: {hl: (aff.ref, aff.scores) for hl, aff in tracked.items()}
+        for user_id, tracked in api.USER_AFFINITY.items()
+    }
+    return history, dict(api.STOREWIDE_POPULARITY), affinity
@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+import pytest
+
+from factorization import FactorModel
+
+
+def model(v: float, items=("a", "b", "c")) -> FactorModel:
+    rng = np.random.default_rng(int(v))
+    return FactorModel(["u"], list(items), np.full((1, 4), v, np.float32),
+                       rng.standard_normal((len(items), 4)).astype(np.float32), {"v": v})
+
+
+def test_save_switches_versions_and_keeps_the_newest(tmp_path):
+    path = str(tmp_path / "model")
+    for v in (1, 2, 3):
+        model(v).save(path)
+    loaded = FactorModel.load(path)
+    assert loaded.meta == {"v": 3}
+    assert (loaded.user_factors == 3).all()
+    versions = sorted(n for n in os.listdir(path) if n.startswith("v"))
+    assert len(versions) == 2
+    with open(os.path.join(path, "CURRENT")) as f:
+        assert f.read().strip() == versions[-1]
+
+
+def test_load_reads_a_bare_model_directory(tmp_path):
+    path = str(tmp_path / "model")
+    model(5).save(path)
+    with open(os.path.join(path, "CURRENT")) as f:
+        bare = os.path.join(path, f.read().strip())
+    assert FactorModel.load(bare).meta == {"v": 5}
+
+
+def test_scorer_and_top_items_only_see_the_candidates():
+    m = model(1, items=[f"i{k}" for k in range(50)])
+    full = m.item_factors @ m.user_factors[0]
+    among = [f"i{k}" for k in range(0, 50, 2)] + ["unknown"]
+    score = m.scorer("u", among)
+    assert score("i4") == pytest.approx(float(full[4]), rel=1e-5)
+    assert score("i5") == 0.0 and score("unknown") == 0.0
+    best = sorted(among[:-1], key=lambda iid: -full[int(iid[1:])])[:3]
+    assert set(m.top_items("u", 3, among)) == set(best)
+    assert m.scorer("nobody", among) is None and m.top_items("nobody", 3, among) == []
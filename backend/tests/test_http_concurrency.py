@@ -0,0 +1,76 @@
+import threading
+from collections import Counter
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(api):
+    with TestClient(api.app) as client:
+        yield client
+
+
+def test_concurrent_purchases_and_reads_over_http(api, client):
+    item_ids = list(api.CATALOG)[:12]
+    writers, per_writer = 4, 60
+    posted = [Counter() for _ in range(writers)]
+    failures = []
+
+    def write(w):
+        for n in range(per_writer):
+            item = item_ids[(w * 7 + n) % len(item_ids)]
+            evt = {"user_id": f"user-{n % 5}", "item_id": item, "quantity": 1 + n % 2,
+                   "price_paid": 1.0, "purchased_at": f"2026-01-01T00:{n % 60:02d}:00"}
+            r = client.post("/history", json=evt) if n % 3 else client.post("/history/bulk", json=[evt])
+            if r.status_code != 200:
+                failures.append((r.status_code, r.text))
+            posted[w][item] += evt["quantity"]
+
+    def read(r):
+        for n in range(per_writer):
+            resp = client.get(f"/challenges/{4 + n % 3}", params={"user_id": f"user-{n % 5}"})
+            if resp.status_code != 200 or not resp.json()["items"]:
+                failures.append((resp.status_code, resp.text))
+
+    threads = ([threading.Thread(target=write, args=(w,)) for w in range(writers)]
+               + [threading.Thread(target=read, args=(r,)) for r in range(2)])
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=120)
+
+    assert not any(t.is_alive() for t in threads)
+    assert not failures
+    assert api.STOREWIDE_POPULARITY == dict(sum(posted, Counter()))
+    assert api.PURCHASE_HISTORY.total_events == writers * per_writer
+    assert sum(len(events) for events in api.PURCHASE_HISTORY.values()) == writers * per_writer
+
+
+def test_batch_reports_unknown_ids_on_their_own(client):
+    r = client.post("/challenges/batch", json=[{"template_id": "4"}, {"template_id": "nope"}])
+    assert r.status_code == 200
+    first, second = r.json()
+    assert first["id"] == "4" and second is None
+
+
+def test_batch_ranks_users_the_factor_model_knows_one_by_one(api, client, monkeypatch):
+    import numpy as np
+    from factorization import FactorModel
+
+    item_ids = list(api.CATALOG)
+    factors = np.random.default_rng(0).standard_normal((len(item_ids), 4)).astype(np.float32)
+    monkeypatch.setattr(api, "FACTOR_MODEL", FactorModel(["fan"], item_ids, np.ones((1, 4), np.float32), factors, {}))
+    vectorised = []
+    batch = api.rank_regulars_batch
+
+    def spy(reqs, *args):
+        vectorised.extend(r.user_id for r in reqs)
+        return batch(reqs, *args)
+    monkeypatch.setattr(api, "rank_regulars_batch", spy)
+
+    users = ["fan"] * 4 + [f"other-{n}" for n in range(api.BATCH_VECTORISE_MIN)]
+    r = client.post("/challenges/batch", json=[{"user_id": u, "template_id": "4"} for u in users])
+    assert r.status_code == 200
+    assert all(c is not None and c["items"] for c in r.json())
+    assert sorted(vectorised) == sorted(users[4:])
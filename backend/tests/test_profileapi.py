@@ -0,0 +1,13 @@
+import logging
+
+import profileapi
+
+
+def test_a_failed_basket_forward_is_logged_and_counted(monkeypatch, caplog):
+    monkeypatch.setattr(profileapi, "RECOMMENDER_URL", "http://127.0.0.1:9")
+    before = profileapi.BASKET_FORWARD_ERRORS.labels().value
+    with caplog.at_level(logging.WARNING, logger=profileapi.logger.name):
+        profileapi._post_basket(b"[]")
+    assert profileapi.BASKET_FORWARD_ERRORS.labels().value == before + 1
+    assert any("basket not forwarded" in r.getMessage() for r in caplog.records)
+    assert b"basket_forward_errors_total" in profileapi.METRICS.render()
@@ -0,0 +1,17 @@
+import logging
+
+
+def test_sighup_reload_logs_success_and_failure(api, monkeypatch, tmp_path, caplog):
+    caplog.set_level(logging.INFO, logger=api.logger.name)
+    api._reload_logged()
+    assert any(r.levelno == logging.INFO and "catalog reloaded" in r.getMessage() for r in caplog.records)
+
+    version = api.CATALOG_INDEX.version
+    monkeypatch.setattr(api, "CATALOG_PATH", str(tmp_path / "missing.json"))
+    monkeypatch.setattr(api, "FACTOR_MODEL_PATH", str(tmp_path / "no-model"))
+    caplog.clear()
+    api._reload_logged()
+    failures = [r for r in caplog.records if r.levelno == logging.ERROR]
+    assert [r.getMessage().split(",")[0] for r in failures] == ["catalog reload failed", "factor model reload failed"]
+    assert all(r.exc_info for r in failures)
+    assert api.CATALOG_INDEX.version == version
@@ -0,0 +1,87 @@
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from shared_state import SharedState
+
+HALF_LIVES = (7.0, 30.0)
+
+
+@pytest.fixture
+def states(tmp_path):
+    path = str(tmp_path / "state")
+    writer = SharedState.create(path, HALF_LIVES, item_capacity=64, user_capacity=16, entry_capacity=256)
+    reader = SharedState.attach(path, timeout=1)
+    yield writer, reader
+    reader.close()
+    writer.close()
+
+
+def tracked(ref, scores):
+    return {hl: SimpleNamespace(ref=ref, scores=dict(scores)) for hl in HALF_LIVES}
+
+
+def test_reader_sees_what_the_writer_published(states):
+    writer, reader = states
+    writer.set_popularity("milk", 5)
+    writer.write_user("alice", tracked(10.0, {"milk": 2.0, "eggs": 1.0}), ["milk", "eggs"])
+    assert reader.popularity("milk") == 5
+    assert reader.popularity("bread", -1) == -1
+    assert reader.user_affinity("alice", 7.0) == (10.0, {"milk": 2.0, "eggs": 1.0})
+    assert reader.user_affinity("bob", 7.0) is None
+
+
+def test_reader_waits_while_a_write_is_in_progress(states):
+    writer, reader = states
+    writer.write_user("alice", tracked(1.0, {"milk": 1.0}), ["milk"])
+    slot = writer._user_slots["alice"]
+    writer._user_seq[slot] += 1  # odd: a write has started
+    got = []
+    t = threading.Thread(target=lambda: got.append(reader.user_affinity("alice", 7.0)))
+    t.start()
+    t.join(timeout=0.1)
+    assert t.is_alive() and not got
+    writer._user_seq[slot] += 1
+    t.join(timeout=5)
+    assert got == [(1.0, {"milk": 1.0})]
+
+
+def test_concurrent_reads_are_never_torn(states):
+    writer, reader = states
+    items = [f"item{i}" for i in range(20)]
+    stop = threading.Event()
+    torn = []
+
+    def read():
+        while not stop.is_set():
+            got = reader.user_affinity("alice", 30.0)
+            if got is not None and len(set(got[1].values())) > 1:
+                torn.append(got)
+
+    readers = [threading.Thread(target=read) for _ in range(3)]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for t in readers:
+            t.start()
+        for n in range(1, 2000):  # every score of a write is the same, so a mix means a torn read
+            writer.write_user("alice", tracked(1.0, {i: float(n) for i in items}), items)
+    finally:
+        stop.set()
+        for t in readers:
+            t.join()
+        sys.setswitchinterval(interval)
+    assert not torn
+
+
+def test_slots_needed_and_full(states):
+    writer, _ = states
+    rows = [("alice", "milk"), ("alice", "eggs"), ("bob", "milk")]
+    assert writer.slots_needed(rows) == (2, 2, 3)
+    writer.set_popularity("milk", 1)
+    writer.write_user("alice", tracked(1.0, {"milk": 1.0}), ["milk"])
+    assert writer.slots_needed(rows) == (1, 1, 2)
+    with pytest.raises(ValueError):
+        writer.slots_needed([("x" * 1000, "milk")])
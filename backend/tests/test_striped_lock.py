@@ -0,0 +1,55 @@
+import threading
+
+from striped_lock import StripedLock
+
+
+def run_threads(target, n):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=30)
+    assert not any(t.is_alive() for t in threads), "deadlocked"
+
+
+def test_keys_on_one_stripe_are_taken_once():
+    locks = StripedLock(1)
+    with locks.holding(["a", "b", "a"]):  # a plain Lock taken twice would block here
+        pass
+
+
+def test_overlapping_batches_in_any_order_dont_deadlock():
+    locks = StripedLock(8)
+    keys = [f"user-{i}" for i in range(32)]
+    counts = {k: 0 for k in keys}
+
+    def worker(i):
+        for n in range(500):
+            batch = keys[(i + n) % 32:] + keys[:(i * n) % 32]
+            with locks.holding(reversed(batch) if n % 2 else batch):
+                for k in set(batch):
+                    counts[k] += 1
+
+    run_threads(worker, 8)
+    expected = {k: 0 for k in keys}
+    for i in range(8):
+        for n in range(500):
+            for k in set(keys[(i + n) % 32:] + keys[:(i * n) % 32]):
+                expected[k] += 1
+    assert counts == expected
+
+
+def test_holding_all_excludes_holding():
+    locks = StripedLock(4)
+    entered = threading.Event()
+
+    def writer():
+        with locks.holding(["x"]):
+            entered.set()
+
+    t = threading.Thread(target=writer)
+    with locks.holding_all():
+        t.start()
+        assert not entered.wait(0.1)
+    t.join(timeout=5)
+    assert entered.is_set()
@@ -0,0 +1,110 @@
+"""
+Sliding-window popularity from time-bucketed counters.
+
+Purchases are counted into fixed-width buckets (an hour by default) keyed by
+the purchase time, kept in a ring just long enough for the longest window.
+Each configured window also keeps a running item -> count total, so:
+
+- add is O(number of windows) per purchase;
+- advancing the clock is O(buckets passed), subtracting each bucket once as
+  it slides out of a window;
+- reading a window is a plain dict lookup per item.
+
+Memory is bounded by ring length x distinct items per bucket, whatever the
+traffic. Late events are counted into their own bucket while it is still in
+the ring; older ones are dropped. Events dated in the future (clock skew, a
+bad client) count in the current bucket: letting one move the head forward
+would slide every real purchase out of the windows.
+"""
+import math
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class WindowedPopularity:
+    def __init__(self, windows_days: Iterable[float] = (7.0, 30.0), bucket_seconds: float = 3600.0):
+        self.bucket_seconds = bucket_seconds
+        # window -> length in buckets
+        self.windows: Dict[float, int] = {
+            float(w): max(1, math.ceil(w * 86400.0 / bucket_seconds)) for w in windows_days
+        }
+        self.span = max(self.windows.values(), default=1)
+        self._ring: List[Optional[Tuple[int, Dict[str, int]]]] = [None] * self.span  # (bucket, counts)
+        self._head: Optional[int] = None  # newest bucket seen
+        # window -> item -> count; only ever changed by single dict stores, so readers don't lock
+        self.totals: Dict[float, Dict[str, int]] = {w: {} for w in self.windows}
+        self._lock = threading.Lock()
+
+    @property
+    def head(self) -> Optional[int]:
+        """Newest bucket seen; window counts only ever go down when this moves."""
+        return self._head
+
+    def _bucket(self, ts: float) -> int:
+        return math.floor(ts / self.bucket_seconds)
+
+    def _advance(self, head: int):
+        """Move the newest bucket to ``head``; called with the lock held."""
+        if self._head is None:
+            self._head = head
+            return
+        if head - self._head >= self.span:  # everything slid out at once
+            self._ring = [None] * self.span
+            self.totals = {w: {} for w in self.windows}
+            self._head = head
+            return
+        for b in range(self._head + 1, head + 1):
+            for w, length in self.windows.items():
+                slot = self._ring[(b - length) % self.span]
+                if slot is not None and slot[0] == b - length:
+                    totals = self.totals[w]
+                    for iid, n in slot[1].items():
+                        left = totals.get(iid, 0) - n
+                        if left > 0:
+                            totals[iid] = left
+                        else:
+                            totals.pop(iid, None)
+            self._ring[b % self.span] = None  # bucket b - span leaves the ring
+        self._head = head
+
+    def add_many(self, rows: Iterable[Tuple[str, int, float]]):
+        """(item_id, quantity, epoch seconds) for each purchase."""
+        now = self._bucket(time.time())
+        # a batch is mostly a few buckets' worth of repeat items: merge those first
+        merged: Dict[Tuple[int, str], int] = {}
+        bucket_seconds = self.bucket_seconds
+        for item_id, quantity, ts in rows:
+            key = (min(math.floor(ts / bucket_seconds), now), item_id)
+            merged[key] = merged.get(key, 0) + quantity
+        with self._lock:
+            for (b, item_id), quantity in merged.items():
+                if self._head is None or b > self._head:
+                    self._advance(b)
+                if b <= self._head - self.span:
+                    continue
+                slot = self._ring[b % self.span]
+                if slot is None or slot[0] != b:
+                    slot = self._ring[b % self.span] = (b, {})
+                slot[1][item_id] = slot[1].get(item_id, 0) + quantity
+                for w, length in self.windows.items():
+                    if b > self._head - length:
+                        totals = self.totals[w]
+                        totals[item_id] = totals.get(item_id, 0) + quantity
+
+    def view(self, window_days: float, now_ts: float) -> Dict[str, int]:
+        """item -> count over the ``window_days`` ending at ``now_ts`` (or the newest purchase,
+        if that is later). Treat the result as read-only."""
+        b = self._bucket(now_ts)
+        if self._head is not None and b > self._head:
+            with self._lock:
+                if b > self._head:
+                    self._advance(b)
+        return self.totals[float(window_days)]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "buckets": sum(slot is not None for slot in self._ring),
+            "bucket_entries": sum(len(slot[1]) for slot in self._ring if slot is not None),
+            **{f"items_{w:g}d": len(t) for w, t in self.totals.items()},
+        }
@@ -1,15 +1,28 @@
+type Challenge = (typeof import("@/lib/stores").mockChallenges)[number]
+
 export async function fetchPythonChallenges(
   baseUrl = process.env.NEXT_PUBLIC_COUPON_API ?? "http://localhost:8000",
   ids = ["4", "5", "6"],
   userId?: string
 ) {
+  // one round trip for every card; the backend keeps each challenge's id in the response
+  const res = await fetch(`${baseUrl}/challenges/batch`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(ids.map((id) => ({ user_id: userId ?? null, template_id: id }))),
+    cache: "no-store",
+  })
+  if (!res.ok) throw new Error(`Failed to fetch challenges ${ids.join(",")}: ${res.status}`)
+  const batch = (await res.json()) as (Challenge | null)[]
+
+  // ids the batch doesn't know come back as null; try each on its own and drop the ones that still fail
   const qs = userId ? `?user_id=${encodeURIComponent(userId)}` : ""
   const results = await Promise.all(
-    ids.map(async (id) => {
-      const res = await fetch(`${baseUrl}/challenges/${id}${qs}`, { cache: "no-store" })
-      if (!res.ok) throw new Error(`Failed to fetch challenge ${id}: ${res.status}`)
-      return res.json()
+    batch.map(async (challenge, i) => {
+      if (challenge) return challenge
+      const one = await fetch(`${baseUrl}/challenges/${encodeURIComponent(ids[i])}${qs}`, { cache: "no-store" })
+      return one.ok ? ((await one.json()) as Challenge) : null
     })
   )
-  return results as typeof import("@/lib/stores").mockChallenges
-}
\ No newline at end of file
+  return results.filter((c): c is Challenge => c !== null)
+}